@@ -0,0 +1,85 @@
+"""
+Count the database queries made by SettingUserMiddleware/SettingUserBackend
+during a simulated ``sencha create jsb`` crawl, with and without
+``SENCHATOOLS_CACHE_USER``.
+
+Usage::
+
+    $ python benchmarks/auth_queries.py [--requests 2000]
+"""
+import sys
+import time
+from optparse import OptionParser
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from django.conf import settings
+settings.configure(
+    DEBUG=True, # Required for connection.queries
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                           'NAME': ':memory:'}},
+    INSTALLED_APPS=['django.contrib.auth',
+                    'django.contrib.contenttypes',
+                    'django.contrib.sessions'],
+    MIDDLEWARE_CLASSES=['django.contrib.sessions.middleware.SessionMiddleware',
+                        'django.contrib.auth.middleware.AuthenticationMiddleware',
+                        'djangosenchatools.auth.SettingUserMiddleware'],
+    AUTHENTICATION_BACKENDS=['djangosenchatools.auth.SettingUserBackend'],
+    ROOT_URLCONF=__name__,
+    SENCHATOOLS_USER='grandma')
+
+from django.conf.urls import patterns, url
+from django.http import HttpResponse
+from django.core import signals
+from django.core.management import call_command
+from django.db import connection, reset_queries
+from django.test.client import Client
+
+
+def view(request, path=''):
+    return HttpResponse(request.user.username)
+
+urlpatterns = patterns('',
+    url(r'^static/(?P<path>.*)$', view),
+    url(r'^$', view))
+
+
+def crawl(requests):
+    """
+    Request the app page once, and the class files ``requests`` times,
+    using the same session, just like ``sencha create jsb`` does.
+
+    :return: ``(queries, seconds)``.
+    """
+    client = Client()
+    reset_queries()
+    start = time.time()
+    client.get('/')
+    for index in xrange(requests):
+        response = client.get('/static/app/view/Class{0}.js'.format(index))
+        assert response.content == settings.SENCHATOOLS_USER
+    return len(connection.queries), time.time() - start
+
+
+def main():
+    parser = OptionParser(usage='%prog [--requests N]')
+    parser.add_option('--requests', type='int', default=2000,
+                      help='Number of class file requests in the crawl. Defaults to 2000.')
+    opts, args = parser.parse_args()
+
+    # Django resets connection.queries at the start of each request
+    signals.request_started.disconnect(reset_queries)
+    call_command('syncdb', interactive=False, verbosity=0)
+    from django.contrib.auth.models import User
+    User.objects.create_user(settings.SENCHATOOLS_USER, 'grandma@example.com', 'test')
+
+    print 'Crawl with {0} requests:'.format(opts.requests + 1)
+    for cache_user in (False, True):
+        settings.SENCHATOOLS_CACHE_USER = cache_user
+        queries, seconds = crawl(opts.requests)
+        print '    SENCHATOOLS_CACHE_USER={0}: {1} queries, {2:.2f}s'.format(cache_user, queries, seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+"""
+Measure the performance of ``senchatoolsbuild`` on synthetic projects (see
+``synthetic.py``) of several sizes, using a stand-in for ``sencha`` (see
+``fake_sencha.py``), so neither Sencha SDK Tools nor a network connection is
+required.
+
+For each size, we measure:
+
+    - ``buildall_cold``: ``--buildall --nocompress`` with an empty cache.
+    - ``buildall_warm``: The same build again (build cache hits).
+    - ``buildall_jobs``: ``--buildall --nocompress --jobs N --no-cache``.
+    - ``watch_rebuild``: Time from changing a class in ``--watch`` mode
+      until the rebuild is finished (median).
+    - ``clean_jsb``: Time to clean the JSB config of an app (median).
+    - ``server_static_rps`` and ``server_django_rps``: Static file requests
+      per second handled by the buildserver with and without the static
+      file fast path.
+
+We also check that ``--builder python --nocompress`` creates the same
+files, byte for byte, as ``sencha build --nocompress`` in the stand-in, and
+fail if it does not. The stand-in concatenates files the way we believe
+JSBuilder does, so this is only a consistency check between the two. It
+does not verify that the files are byte-identical to the files created by
+the real JSBuilder (E.g.: its handling of ``debug`` builds and ``//<debug>``
+blocks). Use ``--real-sencha`` to compare with a real ``sencha`` instead
+(the JSB-files are still created by the stand-in).
+
+Finally, we check that the artifacts stored with ``--artifact-cache`` are
+restored by a build of a copy of the project, run from another directory.
+
+The results are written to a JSON file. Use ``--compare`` to compare them
+with the results of a previous run.
+
+Usage::
+
+    $ python benchmarks/build_performance.py [--sizes 2x50,10x200] [--output results.json]
+    $ python benchmarks/build_performance.py --compare old.json --output new.json
+    $ python benchmarks/build_performance.py --real-sencha /opt/SenchaSDKTools/sencha
+"""
+import sys
+import os
+import json
+import platform
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+from os.path import join, dirname, abspath, relpath, getmtime, exists
+
+from synthetic import generate_project
+
+BENCHMARKDIR = dirname(abspath(__file__))
+ROOTDIR = dirname(BENCHMARKDIR)
+sys.path.insert(0, ROOTDIR)
+
+#: The metrics where a larger value is better.
+HIGHER_IS_BETTER = ('server_static_rps', 'server_django_rps')
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def get_git_revision():
+    try:
+        return subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=ROOTDIR,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE).communicate()[0].strip()
+    except OSError:
+        return None
+
+
+class Project(object):
+    """
+    A generated project, with ``sencha`` in ``PATH`` running ``fake_sencha.py``.
+    """
+    def __init__(self, projectdir, apps, classes, framework_classes):
+        self.projectdir = projectdir
+        self.appnames = generate_project(projectdir, apps, classes, framework_classes)
+        bindir = join(projectdir, 'bin')
+        os.makedirs(bindir)
+        sencha = join(bindir, 'sencha')
+        with open(sencha, 'wb') as f:
+            f.write('#!/bin/sh\nexec "{0}" "{1}" "$@"\n'.format(sys.executable,
+                                                                 join(BENCHMARKDIR, 'fake_sencha.py')))
+        os.chmod(sencha, 0755)
+        self.env = dict(os.environ)
+        self.env['PATH'] = bindir + os.pathsep + self.env.get('PATH', '')
+        self.env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOTDIR, self.env.get('PYTHONPATH')]))
+        self.env['DJANGO_SETTINGS_MODULE'] = 'settings'
+
+    def get_command(self, *args):
+        port = get_free_port()
+        return [sys.executable, 'manage.py', 'senchatoolsbuild', '--verbosity', '0',
+                '--urlpattern', 'http://localhost:{0}/{{appname}}/'.format(port)] + list(args)
+
+    def run(self, *args, **kwargs):
+        """
+        Run ``senchatoolsbuild`` with the given arguments.
+
+        :param env: The environment of the command. Defaults to :obj:`env`.
+        :param projectdir: Run a copy of the project in this directory. Defaults to :obj:`projectdir`.
+        :param cwd: Run ``manage.py`` from this directory. Defaults to ``projectdir``.
+        :return: ``(seconds, report)``.
+        """
+        projectdir = kwargs.get('projectdir', self.projectdir)
+        cwd = kwargs.get('cwd', projectdir)
+        reportpath = join(projectdir, 'report.json')
+        cmd = self.get_command('--report', reportpath, *args)
+        cmd[1] = relpath(join(projectdir, 'manage.py'), cwd)
+        started = time.time()
+        process = subprocess.Popen(cmd, cwd=cwd, env=kwargs.get('env', self.env),
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        seconds = time.time() - started
+        if process.returncode != 0:
+            raise RuntimeError('{0} failed:\n{1}'.format(' '.join(cmd), output))
+        return seconds, json.load(open(reportpath, 'rb'))
+
+    def run_inprocess(self, *args):
+        """
+        Run this script with ``--inprocess`` in the project.
+        """
+        cmd = [sys.executable, abspath(__file__), '--inprocess'] + list(args)
+        process = subprocess.Popen(cmd, cwd=self.projectdir, env=self.env,
+                                   stdout=subprocess.PIPE)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            raise RuntimeError('{0} failed.'.format(' '.join(cmd)))
+        return json.loads(output)
+
+    def measure_watch(self, rebuilds):
+        """
+        Change a class ``rebuilds`` times while running ``--watch``.
+
+        :return: List with the number of seconds from each change until the rebuild was finished.
+        """
+        reportpath = join(self.projectdir, 'watch-report.json')
+        cmd = self.get_command('--buildall', '--nocompress', '--incremental-collectstatic',
+                               '--incremental-jsb', '--persistent-buildserver',
+                               '--watch', self.projectdir, '--watch-delay', '0.1',
+                               '--report', reportpath)
+        process = subprocess.Popen(cmd, cwd=self.projectdir, env=self.env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        classpath = join(self.get_outdir(self.appnames[0]), 'app', 'view', 'View1.js')
+        timings = []
+        try:
+            time.sleep(2) # Give the observer time to start
+            for index in xrange(rebuilds):
+                before = getmtime(reportpath) if exists(reportpath) else None
+                started = time.time()
+                with open(classpath, 'ab') as f:
+                    f.write('// Change {0}\n'.format(index))
+                while (getmtime(reportpath) if exists(reportpath) else None) == before:
+                    if process.poll() is not None:
+                        raise RuntimeError('{0} failed:\n{1}'.format(' '.join(cmd),
+                                                                     process.stdout.read()))
+                    if time.time() - started > 60:
+                        raise RuntimeError('Timeout waiting for the watch rebuild.')
+                    time.sleep(0.01)
+                timings.append(time.time() - started)
+                time.sleep(0.5) # Let events from the rebuild settle
+        finally:
+            process.kill()
+            process.wait()
+        return timings
+
+    def get_outdir(self, appname):
+        return join(self.projectdir, appname, 'static', appname)
+
+
+def check_python_builder(project, real_sencha=None):
+    """
+    Check that ``--builder python`` creates the same files as ``sencha
+    build``, byte for byte. By default, ``sencha build`` is the stand-in,
+    so this only checks that ``--builder python`` is consistent with
+    ``fake_sencha.py``.
+
+    :param real_sencha:
+        Path to a real ``sencha``, to compare with the files created by
+        JSBuilder instead. The JSB-files are created by the stand-in.
+    :raise RuntimeError: If any of the files differ.
+    """
+    targets = ('all-classes.js', 'app-all.js')
+    project.run('--buildall', '--nocompress', '--no-cache')
+    if real_sencha:
+        bindir = tempfile.mkdtemp(prefix='djangosenchatools-sencha-')
+        try:
+            os.symlink(abspath(real_sencha), join(bindir, 'sencha'))
+            env = dict(project.env, PATH=bindir + os.pathsep + project.env['PATH'])
+            project.run('--buildall', '--nocompress', '--no-cache', '--no-jsbcreate', env=env)
+        finally:
+            shutil.rmtree(bindir)
+    expected = {}
+    for appname in project.appnames:
+        for target in targets:
+            path = join(project.get_outdir(appname), target)
+            expected[path] = open(path, 'rb').read()
+    project.run('--buildall', '--nocompress', '--no-cache', '--no-jsbcreate', '--builder', 'python')
+    for path in sorted(expected):
+        if open(path, 'rb').read() != expected[path]:
+            raise RuntimeError('--builder python created another {0} than "sencha build".'.format(path))
+    return len(expected)
+
+
+def check_artifact_cache(project):
+    """
+    Check that the artifacts stored by a build of the project are restored
+    by a build of a copy of the project in another directory, run from
+    another directory (so both the current directory and ``STATIC_ROOT``
+    differ).
+
+    :raise RuntimeError: If any of the apps is not restored from the artifact cache.
+    """
+    tempdir = tempfile.mkdtemp(prefix='djangosenchatools-artifacts-')
+    try:
+        artifactdir = join(tempdir, 'artifacts')
+        project.run('--buildall', '--nocompress', '--artifact-cache', artifactdir)
+        copydir = join(tempdir, 'checkout', 'project')
+        shutil.copytree(project.projectdir, copydir, ignore=shutil.ignore_patterns('cache', 'static_root'))
+        seconds, report = project.run('--buildall', '--nocompress', '--artifact-cache', artifactdir,
+                                      projectdir=copydir, cwd=tempdir)
+        for app in report['apps']:
+            if not app['cached']:
+                raise RuntimeError('{0} was not restored from the artifact cache.'.format(app['appname']))
+        return len(report['apps'])
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+
+def measure_size(apps, classes, options):
+    tempdir = tempfile.mkdtemp(prefix='djangosenchatools-benchmark-')
+    try:
+        projectdir = join(tempdir, 'project')
+        project = Project(projectdir, apps, classes, options.framework_classes)
+        results = {}
+
+        print '{0} apps x {1} classes:'.format(apps, classes)
+        results['buildall_cold'], report = project.run('--buildall', '--nocompress')
+        results['report_cold'] = report
+        print '    buildall (cold): {0:.2f}s'.format(results['buildall_cold'])
+
+        results['buildall_warm'], report = project.run('--buildall', '--nocompress')
+        results['report_warm'] = report
+        print '    buildall (warm): {0:.2f}s'.format(results['buildall_warm'])
+
+        results['buildall_jobs'], report = project.run('--buildall', '--nocompress', '--no-cache',
+                                                       '--jobs', str(options.jobs))
+        print '    buildall (--jobs {0}): {1:.2f}s'.format(options.jobs, results['buildall_jobs'])
+
+        if options.watch_rebuilds:
+            timings = project.measure_watch(options.watch_rebuilds)
+            results['watch_rebuild'] = median(timings)
+            print '    watch rebuild: {0:.2f}s (median of {1})'.format(results['watch_rebuild'],
+                                                                        len(timings))
+
+        results.update(project.run_inprocess('clean', project.appnames[0]))
+        print '    clean JSB: {0:.4f}s'.format(results['clean_jsb'])
+
+        results.update(project.run_inprocess('server', str(options.server_requests)))
+        print '    buildserver: {0:.0f} static requests/s, {1:.0f} requests/s without the fast path'.format(
+            results['server_static_rps'], results['server_django_rps'])
+
+        checked = check_python_builder(project, options.real_sencha)
+        if options.real_sencha:
+            print '    --builder python: {0} files identical to "{1} build"'.format(checked,
+                                                                                options.real_sencha)
+        else:
+            print '    --builder python: {0} files consistent with the stand-in sencha'.format(checked)
+
+        restored = check_artifact_cache(project)
+        print '    artifact cache: {0} apps restored in another directory'.format(restored)
+        return results
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+
+def inprocess_clean(appname):
+    """
+    Measure :meth:`SenchaToolsWrapper.cleanJsbConfig` on the JSB created
+    by ``sencha create jsb`` for ``appname``.
+    """
+    from djangosenchatools.management.commands.senchatoolsbuild import get_appinfo, SenchaToolsWrapper
+    outdir, appname = get_appinfo(appname)
+    sencha = SenchaToolsWrapper(outdir, 'http://localhost/{0}/'.format(appname))
+    jsb = json.dumps({'builds': [
+        {'target': 'all-classes.js', 'files': [
+            {'clsName': 'x', 'name': fileinfo['name'], 'path': '../static/' + fileinfo['path'] + '/'}
+            for fileinfo in _iter_static_files()]},
+        {'target': 'app-all.js', 'files': [{'path': '', 'name': 'all-classes.js'},
+                                           {'path': '', 'name': 'app.js'}]}]})
+    timings = []
+    for index in xrange(20):
+        started = time.time()
+        sencha.cleanJsbConfig(jsb)
+        timings.append(time.time() - started)
+    return {'clean_jsb': median(timings)}
+
+
+def _iter_static_files():
+    from django.conf import settings
+    for dirpath, dirnames, filenames in os.walk(settings.STATIC_ROOT):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.js'):
+                path = os.path.relpath(dirpath, settings.STATIC_ROOT).replace(os.sep, '/')
+                yield {'path': path, 'name': filename}
+
+
+def _request_all(port, paths, results):
+    import httplib
+    connection = httplib.HTTPConnection('localhost', port)
+    for path in paths:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError('GET {0}: {1}'.format(path, response.status))
+    connection.close()
+    results.append(len(paths))
+
+
+def inprocess_server(requests, threads=4):
+    """
+    Measure the static file requests per second handled by the buildserver
+    with and without the fast path.
+    """
+    from djangosenchatools.buildserver import BuildServer
+    paths = ['/static/{path}/{name}'.format(**fileinfo) for fileinfo in _iter_static_files()]
+    paths = (paths * (requests // len(paths) + 1))[:requests]
+    results = {}
+    for name, static_fastpath in (('server_static_rps', True), ('server_django_rps', False)):
+        port = get_free_port()
+        server = BuildServer('localhost', port, static_fastpath=static_fastpath)
+        server.start()
+        try:
+            handled = []
+            workers = [threading.Thread(target=_request_all, args=(port, paths[index::threads], handled))
+                       for index in xrange(threads)]
+            started = time.time()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            results[name] = sum(handled) / (time.time() - started)
+        finally:
+            server.stop()
+    return results
+
+
+def inprocess(args):
+    sys.path.insert(0, os.getcwd())
+    import logging
+    logging.basicConfig(level=logging.ERROR)
+    from django.core.servers import basehttp
+    basehttp.WSGIRequestHandler.log_message = lambda *args: None
+    if args[0] == 'clean':
+        results = inprocess_clean(args[1])
+    elif args[0] == 'server':
+        results = inprocess_server(int(args[1]))
+    else:
+        raise ValueError('Invalid --inprocess benchmark: {0}'.format(args[0]))
+    json.dump(results, sys.stdout)
+
+
+def compare(old, new):
+    """
+    Print the change in each metric from the ``old`` to the ``new`` results.
+    """
+    print
+    print 'Compared with {0} ({1}):'.format(old['meta'].get('git_revision'), old['meta'].get('date'))
+    for size in sorted(new['results']):
+        if not size in old['results']:
+            continue
+        print '{0}:'.format(size)
+        for metric in sorted(new['results'][size]):
+            newvalue = new['results'][size][metric]
+            oldvalue = old['results'][size].get(metric)
+            if not isinstance(newvalue, (int, float)) or not oldvalue:
+                continue
+            change = (newvalue - oldvalue) / float(oldvalue) * 100
+            better = (change > 0) == (metric in HIGHER_IS_BETTER)
+            print '    {0:<20} {1:>10.4f} -> {2:>10.4f} ({3:+.1f}%{4})'.format(
+                metric, oldvalue, newvalue, change,
+                '' if abs(change) < 5 else (', better' if better else ', WORSE'))
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', default='2x50,10x200',
+                      help=('Comma separated list of project sizes as <apps>x<classes>. '
+                            'Defaults to "2x50,10x200".'))
+    parser.add_option('--framework-classes', type='int', default=300,
+                      help='Number of classes in the fake ExtJS framework. Defaults to 300.')
+    parser.add_option('--jobs', type='int', default=4,
+                      help='Number of jobs for the --jobs benchmark. Defaults to 4.')
+    parser.add_option('--watch-rebuilds', type='int', default=5,
+                      help='Number of rebuilds in the --watch benchmark. Use 0 to skip it. Defaults to 5.')
+    parser.add_option('--server-requests', type='int', default=5000,
+                      help='Number of requests in the buildserver benchmark. Defaults to 5000.')
+    parser.add_option('--output', default='benchmark-results.json',
+                      help='Write the results to this file. Defaults to "benchmark-results.json".')
+    parser.add_option('--compare', default=None,
+                      help='Compare the results with the results of a previous run.')
+    parser.add_option('--real-sencha', default=None,
+                      help=('Path to sencha from Sencha SDK Tools. Compare the files created by '
+                            '--builder python with the files created by its "sencha build", '
+                            'instead of the stand-in.'))
+    parser.add_option('--inprocess', action='store_true', default=False,
+                      help='Used internally to run benchmarks within a generated project.')
+    options, args = parser.parse_args()
+    if options.inprocess:
+        inprocess(args)
+        return
+
+    results = {}
+    for size in options.sizes.split(','):
+        apps, classes = [int(value) for value in size.split('x')]
+        results[size] = measure_size(apps, classes, options)
+    output = {'meta': {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'git_revision': get_git_revision(),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'options': vars(options)},
+              'results': results}
+    with open(options.output, 'wb') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print
+    print 'Wrote the results to', options.output
+    if options.compare:
+        compare(json.load(open(options.compare, 'rb')), output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Stand-in for the ``sencha`` command from Sencha SDK Tools, used by the
+benchmarks. Supports the two commands used by ``senchatoolsbuild``::
+
+    $ python fake_sencha.py create jsb -a URL -p JSBFILE
+    $ python fake_sencha.py build -p JSBFILE -d OUTDIR [--nocompress]
+
+``create jsb`` crawls the app over HTTP like the ExtJS loader: it reads
+the ``Ext.Loader.setPath`` configuration and the ``<script>`` tags of the
+page, and follows ``extend``, ``requires``, ``controllers``, ``views``,
+``models`` and ``stores`` in each class recursively. The JSB-file lists
+the classes in dependency order, with paths relative to the page, just
+like ``sencha create jsb``.
+
+``build`` concatenates the files in each build, followed by a newline,
+like JSBuilder. Without ``--nocompress``, whitespace and comments are
+removed, as a (crude) replacement for the YUI compressor.
+"""
+import sys
+import re
+import json
+import urllib2
+from os.path import join
+from urlparse import urljoin, urlparse
+
+_SETPATH_RE = re.compile(r'Ext\.Loader\.setPath\((\{.*?\})\)', re.DOTALL)
+_SCRIPT_RE = re.compile(r'<script[^>]+src="([^"]+)"')
+_NAME_RE = re.compile(r"Ext\.application\(\{\s*name:\s*'([^']+)'")
+_LIST_RE = re.compile(r"\b(requires|controllers|views|models|stores)\s*:\s*\[([^\]]*)\]")
+_EXTEND_RE = re.compile(r"\bextend\s*:\s*'([^']+)'")
+_STRING_RE = re.compile(r"'([^']+)'")
+_COMMENT_RE = re.compile(r'/\*.*?\*/|^\s*//.*?$', re.DOTALL | re.MULTILINE)
+
+
+def get_option(args, name):
+    return args[args.index(name) + 1]
+
+
+class Crawler(object):
+    def __init__(self, url):
+        self.url = url
+        self.paths = {}
+        self.appname = None
+        self.classes = [] # (clsName, urlpath) in dependency order
+        self.seen = set()
+
+    def fetch(self, url):
+        return urllib2.urlopen(urljoin(self.url, url)).read()
+
+    def get_class_url(self, clsname):
+        for prefix in sorted(self.paths, key=len, reverse=True):
+            if clsname == prefix or clsname.startswith(prefix + '.'):
+                rest = clsname[len(prefix):].lstrip('.').replace('.', '/')
+                return self.paths[prefix] + '/' + rest + '.js'
+        raise LookupError('No loader path for {0}'.format(clsname))
+
+    def get_dependencies(self, source):
+        dependencies = _EXTEND_RE.findall(source)
+        for kind, value in _LIST_RE.findall(source):
+            names = _STRING_RE.findall(value)
+            if kind != 'requires' and self.appname:
+                names = ['{0}.{1}.{2}'.format(self.appname, kind[:-1], name)
+                         if not name.startswith(self.appname + '.') else name
+                         for name in names]
+            dependencies.extend(names)
+        return dependencies
+
+    def load(self, clsname):
+        if clsname in self.seen:
+            return
+        self.seen.add(clsname)
+        url = self.get_class_url(clsname)
+        for dependency in self.get_dependencies(self.fetch(url)):
+            self.load(dependency)
+        self.classes.append((clsname, url))
+
+    def crawl(self):
+        page = self.fetch(self.url)
+        match = _SETPATH_RE.search(page)
+        if match:
+            self.paths = json.loads(match.group(1))
+        for script in _SCRIPT_RE.findall(page):
+            source = self.fetch(script)
+            match = _NAME_RE.search(source)
+            if match:
+                self.appname = match.group(1)
+            for dependency in self.get_dependencies(source):
+                self.load(dependency)
+
+
+def create_jsb(args):
+    url = get_option(args, '-a')
+    jsbpath = get_option(args, '-p')
+    crawler = Crawler(url)
+    crawler.crawl()
+    files = []
+    for clsname, classurl in crawler.classes:
+        path = urlparse(urljoin(url, classurl)).path
+        files.append({'clsName': clsname,
+                      'name': path.rsplit('/', 1)[1],
+                      'path': '..' + path.rsplit('/', 1)[0] + '/'})
+    config = {
+        'projectName': 'Project Name',
+        'licenseText': 'Copyright(c) 2012 Company Name',
+        'builds': [{'name': 'All Classes',
+                    'target': 'all-classes.js',
+                    'options': {'debug': True},
+                    'files': files},
+                   {'name': 'Application - Production',
+                    'target': 'app-all.js',
+                    'compress': True,
+                    'files': [{'path': '', 'name': 'all-classes.js'},
+                              {'path': '', 'name': 'app.js'}]}],
+        'resources': []
+    }
+    with open(jsbpath, 'wb') as f:
+        json.dump(config, f, indent=4)
+
+
+def compress(source):
+    return ' '.join(_COMMENT_RE.sub('', source).split())
+
+
+def build(args):
+    config = json.load(open(get_option(args, '-p'), 'rb'))
+    outdir = get_option(args, '-d')
+    for section in config['builds']:
+        with open(join(outdir, section['target']), 'wb') as target:
+            for fileinfo in section['files']:
+                source = open(fileinfo['path'] + fileinfo['name'], 'rb').read()
+                if not '--nocompress' in args:
+                    source = compress(source)
+                target.write(source)
+                target.write('\n')
+
+
+def main(args):
+    if not args:
+        print 'Sencha SDK Tools v2.0.0-beta3 (benchmark stand-in)'
+    elif args[:2] == ['create', 'jsb']:
+        create_jsb(args)
+    elif args[0] == 'build':
+        build(args)
+    else:
+        print >> sys.stderr, 'Unsupported command: {0}'.format(' '.join(args))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
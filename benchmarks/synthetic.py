@@ -0,0 +1,223 @@
+"""
+Generate a synthetic Django project with ExtJS apps for the benchmarks.
+
+The project contains:
+
+    - ``extjs4``: A Django app with a fake ExtJS framework of
+      ``framework_classes`` classes in ``static/extjs4/src/``.
+    - ``app0`` ... ``app<N-1>``: ExtJS apps with ``classes`` classes each
+      (controllers, views, models and stores) that extend and require each
+      other and the framework classes.
+    - A view at ``/<appname>/`` that loads the app like an ExtJS debug page,
+      and settings that serve the static files from ``STATIC_ROOT``.
+
+Usage::
+
+    $ python benchmarks/synthetic.py /tmp/project --apps 10 --classes 200
+"""
+import random
+import sys
+from optparse import OptionParser
+from os import makedirs
+from os.path import join, dirname, isdir
+
+KINDS = ['controller', 'view', 'model', 'store']
+
+SETTINGS = """import os
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEBUG = True
+DATABASES = {{'default': {{'ENGINE': 'django.db.backends.sqlite3',
+                         'NAME': os.path.join(HERE, 'db.sqlite')}}}}
+INSTALLED_APPS = {installed_apps!r}
+STATIC_ROOT = os.path.join(HERE, 'static_root')
+STATIC_URL = '/static/'
+ROOT_URLCONF = 'urls'
+SECRET_KEY = 'benchmark'
+EXTJS4_DEBUG = True
+MIDDLEWARE_CLASSES = ['django.contrib.sessions.middleware.SessionMiddleware',
+                      'django.contrib.auth.middleware.AuthenticationMiddleware']
+DJANGOSENCHATOOLS_CACHE_DIR = os.path.join(HERE, 'cache')
+"""
+
+URLS = """import json
+from django.conf import settings
+from django.conf.urls import patterns, url
+from django.conf.urls.static import static
+from django.http import HttpResponse
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+    <script src="/static/extjs4/ext-debug.js"></script>
+    <script>Ext.Loader.setPath({paths});</script>
+    <script src="/static/{appname}/app.js"></script>
+</head>
+<body></body>
+</html>'''
+
+def page(request, appname):
+    paths = json.dumps({'Ext': '/static/extjs4/src',
+                        appname.capitalize(): '/static/{0}/app'.format(appname)})
+    return HttpResponse(PAGE.format(paths=paths, appname=appname))
+
+urlpatterns = patterns('', url(r'^(app\\d+)/$', page))
+urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+"""
+
+MANAGE = """#!/usr/bin/env python
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+    from django.core.management import execute_from_command_line
+    execute_from_command_line(sys.argv)
+"""
+
+CLASS = """/**
+ * {clsname}
+ *
+ * Generated by benchmarks/synthetic.py.
+ */
+Ext.define('{clsname}', {{
+    extend: '{extend}',
+    requires: [{requires}],
+
+{members}
+}});
+"""
+
+MEMBER = """    /**
+     * Handle {name}. Lorem ipsum dolor sit amet, consectetur adipiscing
+     * elit, sed do eiusmod tempor incididunt ut labore et dolore magna.
+     */
+    {name}: function(record, options) {{
+        var result = this.callParent(arguments);
+        if(options && options.{name}) {{
+            result = Ext.apply({{}}, options.{name}, result);
+        }}
+        return result;
+    }},
+"""
+
+APP = """Ext.application({{
+    name: '{namespace}',
+    appFolder: '/static/{appname}/app',
+    controllers: [{controllers}],
+
+    launch: function() {{
+        Ext.create('Ext.container.Viewport', {{}});
+    }}
+}});
+"""
+
+
+def _write(path, content):
+    if not isdir(dirname(path)):
+        makedirs(dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def _quote(names):
+    return ', '.join("'{0}'".format(name) for name in names)
+
+
+def _members(rng, count):
+    return '\n'.join(MEMBER.format(name='method{0}'.format(rng.randint(0, 10**6)))
+                     for index in xrange(count))
+
+
+def _write_class(staticdir, prefix, clsname, extend, requires, rng):
+    relpath = clsname.split('.', 1)[1].replace('.', '/') + '.js'
+    _write(join(staticdir, prefix, relpath),
+           CLASS.format(clsname=clsname, extend=extend, requires=_quote(requires),
+                        members=_members(rng, rng.randint(2, 8))))
+
+
+def generate_framework(projectdir, classes, rng):
+    """
+    Create the ``extjs4`` app with ``classes`` framework classes.
+
+    :return: List of the class names.
+    """
+    appdir = join(projectdir, 'extjs4')
+    _write(join(appdir, '__init__.py'), '')
+    _write(join(appdir, 'models.py'), '')
+    staticdir = join(appdir, 'static', 'extjs4')
+    _write(join(staticdir, 'ext-debug.js'), '/* Ext core (not used by the crawl) */\n')
+    _write(join(staticdir, 'src', 'Base.js'), "Ext.define('Ext.Base', {});\n")
+    names = []
+    for index in xrange(classes):
+        clsname = 'Ext.{0}.Class{1}'.format(rng.choice(['panel', 'grid', 'data', 'form', 'util']), index)
+        extend = rng.choice(names) if names else 'Ext.Base'
+        requires = rng.sample(names, min(len(names), rng.randint(0, 3)))
+        _write_class(staticdir, 'src', clsname, extend, requires, rng)
+        names.append(clsname)
+    return names
+
+
+def generate_app(projectdir, appname, classes, framework, rng):
+    """
+    Create an ExtJS app with ``classes`` classes. Each controller requires
+    the classes following it, so all the classes are loaded by the crawl.
+    """
+    namespace = appname.capitalize()
+    appdir = join(projectdir, appname)
+    _write(join(appdir, '__init__.py'), '')
+    _write(join(appdir, 'models.py'), '')
+    staticdir = join(appdir, 'static', appname)
+    controllers = []
+    names = []
+    for index in xrange(classes):
+        kind = KINDS[index % len(KINDS)]
+        names.append('{0}.{1}.{2}{3}'.format(namespace, kind, kind.capitalize(), index))
+    for index, clsname in enumerate(names):
+        kind = KINDS[index % len(KINDS)]
+        requires = [rng.choice(framework)] if framework else []
+        if kind == 'controller':
+            controllers.append(clsname.rsplit('.', 1)[1])
+            requires.extend(names[index + 1:index + len(KINDS)])
+        extend = rng.choice(framework) if framework else 'Ext.Base'
+        _write_class(staticdir, 'app', clsname, extend, requires, rng)
+    _write(join(staticdir, 'app.js'),
+           APP.format(namespace=namespace, appname=appname, controllers=_quote(controllers)))
+
+
+def generate_project(projectdir, apps, classes, framework_classes=200, seed=0):
+    """
+    Generate a synthetic Django project in ``projectdir``.
+
+    :return: List with the name of each ExtJS app.
+    """
+    rng = random.Random(seed)
+    framework = generate_framework(projectdir, framework_classes, rng)
+    appnames = ['app{0}'.format(index) for index in xrange(apps)]
+    for appname in appnames:
+        generate_app(projectdir, appname, classes, framework, rng)
+    installed_apps = ['django.contrib.auth', 'django.contrib.contenttypes',
+                      'django.contrib.sessions', 'django.contrib.staticfiles',
+                      'djangosenchatools', 'extjs4'] + appnames
+    _write(join(projectdir, 'settings.py'), SETTINGS.format(installed_apps=installed_apps))
+    _write(join(projectdir, 'urls.py'), URLS)
+    _write(join(projectdir, 'manage.py'), MANAGE)
+    return appnames
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] <projectdir>')
+    parser.add_option('--apps', type='int', default=10,
+                      help='Number of ExtJS apps. Defaults to 10.')
+    parser.add_option('--classes', type='int', default=200,
+                      help='Number of classes in each app. Defaults to 200.')
+    parser.add_option('--framework-classes', type='int', default=200,
+                      help='Number of classes in the fake ExtJS framework. Defaults to 200.')
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('<projectdir> is required.')
+    generate_project(args[0], opts.apps, opts.classes, opts.framework_classes)
+    print 'Generated {0} apps with {1} classes each in {2}'.format(opts.apps, opts.classes, args[0])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""
+Cache of build artifacts shared between machines (E.g.: CI jobs and
+developers).
+
+The artifacts of an app (``app.jsb3`` and the files it builds) are stored
+in an :class:`ArtifactBackend` by a key computed from the inputs that are
+known before the app is crawled (see :func:`get_input_key`), so a clean
+checkout can skip both ``sencha create jsb`` and ``sencha build``. Since
+the crawl also finds files outside of the app (E.g.: the ExtJS framework),
+each artifact includes a manifest with the checksum of every file in the
+JSB-file, and the artifact is only used if all of them are unchanged.
+
+The paths in the JSB-file are relative to the current directory, so they
+are stored relative to ``STATIC_ROOT``, and made relative to the current
+directory again when the artifact is restored. Artifacts can therefore be
+used by builds in other directories and on other machines.
+"""
+import logging
+import json
+from hashlib import sha1
+from os import rename, remove, makedirs, stat
+from os.path import join, isdir, isfile, relpath, abspath, sep
+from shutil import copy2, copystat, rmtree
+from stat import S_IMODE
+from tempfile import mkdtemp
+from urlparse import urlparse
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+from djangosenchatools.buildcache import get_sencha_version, get_build_targets, iter_app_sources
+from djangosenchatools.jsb import load_jsb, dump_jsb
+from djangosenchatools.bundleindex import get_index_filenames
+from djangosenchatools.atomic import write_atomic, copy_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+#: Name of the manifest file in each artifact.
+MANIFEST_FILENAME = 'artifact.json'
+
+
+def _get_file_checksum(path):
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    checksum = sha1()
+    with f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def get_input_key(outdir, url, nocompressjs, builder='sencha', sources=None):
+    """
+    Get the key of the artifacts of the app in ``outdir``. The key is a
+    digest of the ``sencha`` version, the build options, the path of
+    ``url``, and the path (relative to ``outdir``) and content of each of
+    the app sources, so it is the same on all machines with the same
+    sources.
+
+    :param sources: The app sources. Defaults to :func:`djangosenchatools.buildcache.iter_app_sources`.
+    """
+    checksum = sha1()
+    checksum.update(get_sencha_version())
+    checksum.update('\0nocompressjs={0}\0builder={1}\0url={2}\0'.format(
+        bool(nocompressjs), builder, urlparse(url).path))
+    if sources is None:
+        sources = iter_app_sources(outdir)
+    for path in sources:
+        checksum.update(relpath(path, outdir).replace(sep, '/'))
+        checksum.update('\0')
+        checksum.update(_get_file_checksum(path) or '<missing>')
+        checksum.update('\0')
+    return checksum.hexdigest()
+
+
+def _make_portable(config, static_root):
+    """
+    Make the paths in the "All Classes" section of the JSB config relative
+    to ``static_root`` instead of the current directory. The config is
+    changed in place.
+    """
+    static_root = abspath(static_root)
+    for fileinfo in config['builds'][0]['files']:
+        fileinfo['path'] = relpath(abspath(fileinfo['path'] or '.'), static_root).replace(sep, '/') + '/'
+    return config
+
+
+def _make_local(config, static_root):
+    """
+    Reverse :func:`_make_portable`.
+    """
+    static_root = abspath(static_root)
+    for fileinfo in config['builds'][0]['files']:
+        fileinfo['path'] = relpath(join(static_root, fileinfo['path'])).replace(sep, '/') + '/'
+    return config
+
+
+class ArtifactBackend(object):
+    """
+    Base class for the storage of shared artifacts. Subclasses must make
+    :meth:`store` atomic, so :meth:`fetch` never gets a partial artifact.
+    """
+    def __init__(self, location):
+        """
+        :param location: The ``DJANGOSENCHATOOLS_ARTIFACT_CACHE`` setting or the ``--artifact-cache`` option.
+        """
+        self.location = location
+
+    def fetch(self, key, destdir):
+        """
+        Copy all the files in the artifact for ``key`` into ``destdir``.
+
+        :return: ``True`` if the artifact exists, and ``False`` if not.
+        :raise EnvironmentError: If the storage is not available.
+        """
+        raise NotImplementedError()
+
+    def store(self, key, sourcedir, filenames):
+        """
+        Store ``filenames`` from ``sourcedir`` as the artifact for ``key``,
+        replacing any existing artifact for ``key`` (it is only stored when
+        the existing artifact is outdated).
+
+        :raise EnvironmentError: If the storage is not available.
+        """
+        raise NotImplementedError()
+
+
+class DirectoryArtifactBackend(ArtifactBackend):
+    """
+    Stores artifacts in a directory, typically on shared storage (E.g.:
+    NFS or a CI cache volume). Each artifact is a directory named by its
+    key, created by renaming a temporary directory. Outdated artifacts are
+    moved away before they are replaced, so a concurrent :meth:`fetch` may
+    miss, but never sees a partial artifact.
+    """
+    def _get_artifactdir(self, key):
+        return join(self.location, key[:2], key)
+
+    def fetch(self, key, destdir):
+        artifactdir = self._get_artifactdir(key)
+        if not isfile(join(artifactdir, MANIFEST_FILENAME)):
+            return False
+        with open(join(artifactdir, MANIFEST_FILENAME), 'rb') as f:
+            filenames = json.load(f)['filenames']
+        for filename in filenames + [MANIFEST_FILENAME]:
+            copy2(join(artifactdir, filename), join(destdir, filename))
+        return True
+
+    def store(self, key, sourcedir, filenames):
+        artifactdir = self._get_artifactdir(key)
+        parentdir = join(self.location, key[:2])
+        if not isdir(parentdir):
+            try:
+                makedirs(parentdir)
+            except OSError:
+                if not isdir(parentdir): # Created by another build?
+                    raise
+        tempdir = mkdtemp(prefix='.tmp-', dir=parentdir)
+        try:
+            for filename in filenames:
+                copy2(join(sourcedir, filename), join(tempdir, filename))
+            if isdir(artifactdir):
+                olddir = mkdtemp(prefix='.old-', dir=parentdir)
+                rename(artifactdir, join(olddir, key))
+                rmtree(olddir, ignore_errors=True)
+            rename(tempdir, artifactdir)
+        except OSError:
+            rmtree(tempdir, ignore_errors=True)
+            if not isdir(artifactdir): # Not stored by a build running at the same time?
+                raise
+
+
+#: The default ``DJANGOSENCHATOOLS_ARTIFACT_BACKEND``.
+DEFAULT_BACKEND = 'djangosenchatools.artifacts.DirectoryArtifactBackend'
+
+
+def get_artifact_backend(location):
+    """
+    Get an instance of the :class:`ArtifactBackend` subclass configured in
+    ``settings.DJANGOSENCHATOOLS_ARTIFACT_BACKEND`` (python path). Defaults
+    to :class:`DirectoryArtifactBackend`.
+
+    :raise LookupError: If the backend can not be loaded.
+    """
+    path = getattr(settings, 'DJANGOSENCHATOOLS_ARTIFACT_BACKEND', DEFAULT_BACKEND)
+    modulename, classname = path.rsplit('.', 1)
+    try:
+        backend_cls = getattr(import_module(modulename), classname)
+    except (ImportError, AttributeError), e:
+        raise LookupError('Could not load artifact backend {0}: {1}'.format(path, e))
+    return backend_cls(location)
+
+
+class ArtifactCache(object):
+    """
+    An :class:`ArtifactBackend` with a local
+    :class:`djangosenchatools.buildcache.BuildCache` of recently used
+    artifacts in front of it. Artifacts are downloaded into the local cache
+    atomically (see :meth:`djangosenchatools.buildcache.BuildCache.insert`).
+    Errors from the backend are logged, and handled like a cache miss.
+    """
+    def __init__(self, backend, localcache, static_root):
+        """
+        :param backend: A :class:`ArtifactBackend`.
+        :param localcache: A :class:`djangosenchatools.buildcache.BuildCache`.
+        :param static_root:
+            ``settings.STATIC_ROOT``. The paths of the files in the
+            JSB-files are stored relative to this directory.
+        """
+        self.backend = backend
+        self.localcache = localcache
+        self.static_root = static_root
+
+    def _fetch(self, key, tempdir):
+        try:
+            fetched = self.backend.fetch(key, tempdir)
+        except EnvironmentError, e:
+            log.warning('Could not fetch %s from the artifact cache: %s', key, e)
+            return False
+        if fetched:
+            log.debug('Downloaded %s from the artifact cache.', key)
+        return fetched
+
+    def _get_entrydir(self, key):
+        entrydir = self.localcache.lookup(key)
+        if entrydir is None:
+            if not self.localcache.insert(key, lambda tempdir: self._fetch(key, tempdir)):
+                return None
+            entrydir = self.localcache.lookup(key)
+        return entrydir
+
+    def restore(self, key, outdir, unixstyle_outdir):
+        """
+        Restore the artifact for ``key`` into ``outdir``, if all the files
+        in its JSB-file are unchanged. The ``app-all.js`` section of the
+        JSB-file is made relative to ``unixstyle_outdir`` (see
+        :func:`djangosenchatools.jsb.clean_jsb`).
+
+        :return: ``True`` if the artifact was restored, and ``False`` if not.
+        """
+        entrydir = self._get_entrydir(key)
+        if entrydir is None:
+            return False
+        try:
+            with open(join(entrydir, MANIFEST_FILENAME), 'rb') as f:
+                manifest = json.load(f)
+            with open(join(entrydir, 'app.jsb3'), 'rb') as f:
+                config = load_jsb(f)
+        except (EnvironmentError, ValueError), e:
+            log.warning('Ignoring invalid artifact %s: %s', entrydir, e)
+            self.localcache.remove(key)
+            return False
+        if manifest.get('relative_to') != 'STATIC_ROOT':
+            log.debug('Not using artifact %s for %s: It was stored by an older version.', key, outdir)
+            self.localcache.remove(key) # Replaced when the app is built
+            return False
+        static_root = abspath(self.static_root)
+        for path, checksum in manifest['files']:
+            path = relpath(join(static_root, path))
+            if _get_file_checksum(path) != checksum:
+                log.debug('Not using artifact %s for %s: %s has changed.', key, outdir, path)
+                self.localcache.remove(key) # Replaced when the app is built
+                return False
+        for filename in manifest['filenames']:
+            if filename != 'app.jsb3':
+                copy_atomic(join(entrydir, filename), join(outdir, filename))
+        for filename in get_index_filenames([build['target'] for build in config['builds']]):
+            if not filename in manifest['filenames'] and isfile(join(outdir, filename)):
+                remove(join(outdir, filename)) # Left behind by a previous build
+        _make_local(config, self.static_root)
+        for fileinfo in config['builds'][1]['files']:
+            fileinfo['path'] = unixstyle_outdir
+        write_atomic(join(outdir, 'app.jsb3'), lambda f: dump_jsb(config, f),
+                     S_IMODE(stat(join(entrydir, 'app.jsb3')).st_mode))
+        return True
+
+    def store(self, key, outdir, jsb):
+        """
+        Store ``app.jsb3``, the files built from it and their indexes (see
+        :mod:`djangosenchatools.bundleindex`) in ``outdir`` as the artifact
+        for ``key``, along with the checksum of each file in the "All
+        Classes" section of ``jsb``. The paths of the files are stored
+        relative to ``STATIC_ROOT``.
+        """
+        config = json.loads(jsb)
+        targets = get_build_targets(jsb)
+        filenames = ['app.jsb3'] + targets + [filename for filename in get_index_filenames(targets)
+                                              if isfile(join(outdir, filename))]
+        checksums = [_get_file_checksum(fileinfo['path'] + fileinfo['name'])
+                     for fileinfo in config['builds'][0]['files']]
+        _make_portable(config, self.static_root)
+        manifest = {'filenames': filenames, 'relative_to': 'STATIC_ROOT',
+                    'files': [(fileinfo['path'] + fileinfo['name'], checksum)
+                              for fileinfo, checksum in zip(config['builds'][0]['files'], checksums)]}
+
+        def populate(tempdir):
+            for filename in filenames:
+                if filename == 'app.jsb3':
+                    with open(join(tempdir, filename), 'wb') as f:
+                        dump_jsb(config, f)
+                    copystat(join(outdir, filename), join(tempdir, filename))
+                else:
+                    copy2(join(outdir, filename), join(tempdir, filename))
+            with open(join(tempdir, MANIFEST_FILENAME), 'wb') as f:
+                json.dump(manifest, f)
+            return True
+        self.localcache.insert(key, populate)
+        entrydir = self.localcache.lookup(key)
+        try:
+            self.backend.store(key, entrydir, filenames + [MANIFEST_FILENAME])
+        except EnvironmentError, e:
+            log.warning('Could not store %s in the artifact cache: %s', key, e)
+        else:
+            log.debug('Stored %s in the artifact cache.', key)
@@ -0,0 +1,194 @@
+"""
+Crash-safe writing of build output.
+
+Files are written to a temporary file in the directory where they are
+published, and renamed into place when they are complete. A rename within
+a directory is atomic, so readers (E.g.: a web server, or another build)
+see either the previous or the new version of a file, never a partial
+file, and a build that fails or crashes leaves the previous output in
+place.
+
+Builds write all their output into a private :class:`BuildDirectory`, so
+concurrent builds never write to the same temporary files, and an
+:class:`AppLock` makes concurrent builds of the same app (E.g.: ``--watch``
+and a manual build) take turns.
+"""
+import logging
+import os
+import threading
+from hashlib import sha1
+from os import rename, fdopen, remove, chmod, utime, makedirs
+from os.path import join, dirname, abspath, isdir, isfile
+from shutil import copy2, rmtree
+from tempfile import mkdtemp, mkstemp
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+#: The mode of files created by :func:`open` (``mkstemp`` creates files with mode 0600).
+DEFAULT_MODE = 0666 & ~_get_umask()
+
+
+def write_atomic(path, content, mode=None, mtime=None):
+    """
+    Write to ``path`` atomically.
+
+    :param content:
+        A string, or a function that is called with the file object to
+        write to.
+    :param mode: The permissions of the file. Defaults to :data:`DEFAULT_MODE`.
+    :param mtime: The modification time of the file. Defaults to the current time.
+    """
+    fd, temppath = mkstemp(prefix='.tmp-', dir=dirname(path) or '.')
+    try:
+        with fdopen(fd, 'wb') as f:
+            if callable(content):
+                content(f)
+            else:
+                f.write(content)
+        chmod(temppath, DEFAULT_MODE if mode is None else mode)
+        if mtime is not None:
+            utime(temppath, (mtime, mtime))
+        rename(temppath, path)
+    except:
+        remove(temppath)
+        raise
+
+
+def copy_atomic(sourcepath, path):
+    """
+    Copy ``sourcepath`` to ``path`` atomically, with the permissions and
+    modification time of ``sourcepath``.
+    """
+    fd, temppath = mkstemp(prefix='.tmp-', dir=dirname(path) or '.')
+    os.close(fd)
+    try:
+        copy2(sourcepath, temppath)
+        rename(temppath, path)
+    except:
+        remove(temppath)
+        raise
+
+
+class BuildDirectory(object):
+    """
+    A private temporary directory inside ``outdir``, where a build writes
+    its output before it is published to ``outdir`` with :meth:`publish`.
+    The directory is inside ``outdir`` so the files are renamed within a
+    single file system, and it is hidden (``.build-*``), so it is ignored by
+    ``collectstatic``. It is removed by :meth:`close`, with any files that
+    were not published.
+
+    Example::
+
+        with BuildDirectory(outdir) as builddir:
+            build(builddir.path)
+            builddir.publish(['app-all.js'])
+    """
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.path = mkdtemp(prefix='.build-', dir=outdir)
+
+    def publish(self, filenames, optional_filenames=()):
+        """
+        Rename ``filenames`` from the build directory into ``outdir``.
+
+        :param optional_filenames:
+            Files that are published if they were created by the build, and
+            removed from ``outdir`` if not (E.g.: indexes that are left
+            behind by a previous build).
+        :raise IOError: If any of ``filenames`` were not created by the build.
+        """
+        for filename in filenames:
+            if not isfile(join(self.path, filename)):
+                raise IOError('The build did not create {0}.'.format(join(self.outdir, filename)))
+        for filename in filenames:
+            rename(join(self.path, filename), join(self.outdir, filename))
+        for filename in optional_filenames:
+            if isfile(join(self.path, filename)):
+                rename(join(self.path, filename), join(self.outdir, filename))
+            elif isfile(join(self.outdir, filename)):
+                remove(join(self.outdir, filename))
+
+    def close(self):
+        rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_process_locks = {}
+_process_locks_lock = threading.Lock()
+
+class AppLock(object):
+    """
+    An exclusive lock on the output directory of an app, held while the app
+    is built. Uses a ``flock`` on a file in ``lockdir``, so it works across
+    processes. Where ``fcntl`` is not available (Windows), only builds in the
+    same process are serialized.
+
+    Example::
+
+        with AppLock(join(cachedir, 'locks'), outdir):
+            build()
+    """
+    def __init__(self, lockdir, outdir):
+        self.outdir = outdir
+        self.lockpath = join(lockdir, sha1(abspath(outdir)).hexdigest() + '.lock')
+        self._file = None
+        self._lock = None
+
+    def acquire(self):
+        if fcntl is None:
+            with _process_locks_lock:
+                self._lock = _process_locks.setdefault(self.lockpath, threading.Lock())
+            if not self._lock.acquire(False):
+                log.info('Waiting for another build of %s to finish.', self.outdir)
+                self._lock.acquire()
+            return
+        if not isdir(dirname(self.lockpath)):
+            try:
+                makedirs(dirname(self.lockpath))
+            except OSError:
+                if not isdir(dirname(self.lockpath)): # Not created by another build
+                    raise
+        lockfile = open(self.lockpath, 'ab')
+        try:
+            try:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                log.info('Waiting for another build of %s to finish.', self.outdir)
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+        except:
+            lockfile.close()
+            raise
+        self._file = lockfile
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        elif self._lock is not None:
+            self._lock.release()
+            self._lock = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
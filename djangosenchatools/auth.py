@@ -1,13 +1,48 @@
+from copy import copy
+
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import authenticate, login, SESSION_KEY
+from django.db.models.signals import post_save, post_delete
+
+
+#: Users looked up by :meth:`SettingUserBackend.get_user`, by username.
+_user_cache = {}
+
+
+def use_user_cache():
+    """
+    ``True`` unless ``settings.SENCHATOOLS_CACHE_USER`` is ``False``.
+    """
+    return getattr(settings, 'SENCHATOOLS_CACHE_USER', True)
+
+
+def clear_user_cache(**kwargs):
+    """
+    Clear the users cached by :class:`SettingUserBackend`. Called whenever
+    a user is saved or deleted in this process, and by ``senchatoolsbuild``
+    at the start of each build, so a long-running ``--serve`` or ``--watch``
+    does not keep authenticating as a user that was changed by another
+    process.
+    """
+    _user_cache.clear()
+
+post_save.connect(clear_user_cache, sender=User,
+                  dispatch_uid='djangosenchatools.auth.clear_user_cache')
+post_delete.connect(clear_user_cache, sender=User,
+                    dispatch_uid='djangosenchatools.auth.clear_user_cache')
 
 
 class SettingUserBackend(object):
     """
     Authenticate automatically as the ``static_username`` user
     that :class:`SettingUserMiddleware` sends to this backend.
+
+    Unless ``settings.SENCHATOOLS_CACHE_USER`` is ``False``, users are
+    cached until the next build, or until a user is saved or deleted, so we
+    only query the database once during a build. Each request gets its own
+    copy of the cached user, since requests are handled in multiple threads.
     """
     supports_inactive_user = False
 
@@ -18,16 +53,29 @@ class SettingUserBackend(object):
 
 
     def get_user(self, username):
+        if use_user_cache():
+            try:
+                user = _user_cache[username]
+            except KeyError:
+                pass
+            else:
+                return user and copy(user)
         try:
-            return User.objects.get(username=username)
+            user = User.objects.get(username=username)
         except User.DoesNotExist:
-            return None
+            user = None
+        if use_user_cache():
+            _user_cache[username] = user and copy(user)
+        return user
 
 
 class SettingUserMiddleware(object):
     """
     Authenticate as ``settings.SENCHATOOLS_USER``. Expects
     :class:`SettingUserBackend` to be in ``settings.AUTHENTICATION_BACKENDS``.
+
+    Unless ``settings.SENCHATOOLS_CACHE_USER`` is ``False``, we only call
+    ``login()`` when the session is not already authenticated as the user.
     """
     def process_request(self, request):
         if not hasattr(settings, 'SENCHATOOLS_USER'):
@@ -36,4 +84,5 @@ class SettingUserMiddleware(object):
         user = authenticate(static_username=settings.SENCHATOOLS_USER)
         if user:
             request.user = user
-            login(request, user)
+            if not use_user_cache() or request.session.get(SESSION_KEY) != user.pk:
+                login(request, user)
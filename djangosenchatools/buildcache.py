@@ -0,0 +1,234 @@
+import logging
+import json
+import threading
+from hashlib import sha1
+from os import walk, listdir, stat, utime, rename, makedirs, remove
+from os.path import join, exists, isdir, isfile, getsize
+from shutil import copy2, rmtree
+from subprocess import Popen, PIPE, STDOUT
+from tempfile import mkdtemp
+
+from djangosenchatools.atomic import copy_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+_sencha_version = None
+_sencha_version_lock = threading.Lock()
+
+
+def get_sencha_version():
+    """
+    Get the version string printed by ``sencha`` when it is run without any
+    arguments. The result is cached, so ``sencha`` is only run once.
+    """
+    global _sencha_version
+    with _sencha_version_lock:
+        if _sencha_version is None:
+            try:
+                output = Popen(['sencha'], stdout=PIPE, stderr=STDOUT).communicate()[0]
+            except OSError, e:
+                output = 'unknown ({0})'.format(e)
+            lines = output.strip().splitlines()
+            _sencha_version = lines[0] if lines else 'unknown'
+            log.debug('sencha version: %s', _sencha_version)
+    return _sencha_version
+
+
+def _update_with_file(checksum, path):
+    checksum.update(path.encode('utf-8') if isinstance(path, unicode) else path)
+    checksum.update('\0')
+    if isfile(path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), ''):
+                checksum.update(chunk)
+    else:
+        checksum.update('<missing>')
+    checksum.update('\0')
+
+
+def iter_app_sources(outdir):
+    """
+    Iterate over the path of all the source files of the app in ``outdir``
+    (``<outdir>/app.js`` and all files in ``<outdir>/app/``), sorted by path.
+    """
+    yield join(outdir, 'app.js')
+    for dirpath, dirnames, filenames in walk(join(outdir, 'app')):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            yield join(dirpath, filename)
+
+
+def get_build_key(outdir, jsb, nocompressjs, builder='sencha', sources=None):
+    """
+    Get a key that identifies the result of building the app in ``outdir``
+    from the given JSB config.
+
+    The key is a digest of the JSB config, the ``nocompressjs`` flag, the
+    builder, the ``sencha`` version (only when building with ``sencha
+    build``), the app sources and all the files in the ``builds[0]`` section
+    of the JSB.
+
+    :param builder:
+        The name of the builder. ``sencha``, optionally followed by
+        ``+<suffix>``, means ``sencha build``. Other builders (E.g.:
+        ``python``) do not run ``sencha``, so its version is not included.
+    :param sources: The app sources. Defaults to :func:`iter_app_sources`.
+    """
+    checksum = sha1()
+    if builder.split('+')[0] == 'sencha':
+        checksum.update(get_sencha_version())
+    checksum.update('\0nocompressjs={0}\0builder={1}\0'.format(bool(nocompressjs), builder))
+    checksum.update(jsb)
+    checksum.update('\0')
+    if sources is None:
+        sources = iter_app_sources(outdir)
+    for path in sources:
+        _update_with_file(checksum, path)
+    config = json.loads(jsb)
+    for fileinfo in config['builds'][0]['files']:
+        _update_with_file(checksum, fileinfo['path'] + fileinfo['name'])
+    return checksum.hexdigest()
+
+
+def get_build_targets(jsb):
+    """
+    Get the ``target`` of each build in the JSB config.
+    """
+    return [build['target'] for build in json.loads(jsb)['builds']]
+
+
+class BuildCache(object):
+    """
+    Size-bounded on-disk cache of build results.
+
+    Each entry is a directory named by its key (see :func:`get_build_key`)
+    containing copies of the files created by the build. When the total
+    size of the cache exceeds ``maxsize``, the least recently used entries
+    are removed.
+    """
+    def __init__(self, cachedir, maxsize):
+        """
+        :param cachedir: The directory where the entries are stored.
+        :param maxsize: The maximum size of the cache in bytes.
+        """
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        if not isdir(self.cachedir):
+            try:
+                makedirs(self.cachedir)
+            except OSError:
+                if not isdir(self.cachedir): # Created by another build?
+                    raise
+
+    def _get_entrydir(self, key):
+        return join(self.cachedir, key)
+
+    def lookup(self, key):
+        """
+        Get the directory of the entry for ``key``, and mark the entry as
+        recently used.
+
+        :return: The path to the entry directory, or ``None`` if there is no entry for ``key``.
+        """
+        entrydir = self._get_entrydir(key)
+        if not isdir(entrydir):
+            return None
+        try:
+            utime(entrydir, None) # Mark as recently used
+        except OSError:
+            pass
+        return entrydir
+
+    def insert(self, key, populate):
+        """
+        Add an entry for ``key`` atomically. ``populate(tempdir)`` is called
+        with a temporary directory in the cache, and must put the files of
+        the entry in it and return ``True``, or return ``False`` to abort. The
+        directory is then renamed into place, so other builds never see a
+        partial entry. Old entries are evicted if the cache has grown too
+        large.
+
+        :return: ``True`` if the entry was added (or already exists), and ``False`` if not.
+        """
+        entrydir = self._get_entrydir(key)
+        if exists(entrydir):
+            return True
+        tempdir = mkdtemp(prefix='.tmp-', dir=self.cachedir)
+        try:
+            if not populate(tempdir):
+                rmtree(tempdir, ignore_errors=True)
+                return False
+            rename(tempdir, entrydir)
+        except OSError:
+            rmtree(tempdir, ignore_errors=True)
+            if not exists(entrydir): # Not stored by a build running at the same time?
+                raise
+        else:
+            log.debug('Stored %s in %s.', ', '.join(sorted(listdir(entrydir))), entrydir)
+        self.evict()
+        return True
+
+    def remove(self, key):
+        """
+        Remove the entry for ``key``, if it exists.
+        """
+        rmtree(self._get_entrydir(key), ignore_errors=True)
+
+    def restore(self, key, outdir, filenames, optional_filenames=()):
+        """
+        Copy ``filenames`` from the entry for ``key`` into ``outdir``.
+
+        :param optional_filenames:
+            Files that are copied if they are in the entry, and removed from
+            ``outdir`` if not.
+        :return: ``True`` if the entry exists and contains all of the files, and ``False`` if not.
+        """
+        entrydir = self.lookup(key)
+        if entrydir is None or not all(isfile(join(entrydir, filename)) for filename in filenames):
+            return False
+        for filename in filenames:
+            copy_atomic(join(entrydir, filename), join(outdir, filename))
+        for filename in optional_filenames:
+            if isfile(join(entrydir, filename)):
+                copy_atomic(join(entrydir, filename), join(outdir, filename))
+            elif isfile(join(outdir, filename)):
+                remove(join(outdir, filename))
+        return True
+
+    def store(self, key, outdir, filenames):
+        """
+        Copy ``filenames`` from ``outdir`` into the entry for ``key``, and
+        evict old entries if the cache has grown too large.
+        """
+        def populate(tempdir):
+            for filename in filenames:
+                copy2(join(outdir, filename), join(tempdir, filename))
+            return True
+        self.insert(key, populate)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is no larger
+        than ``maxsize``.
+        """
+        with self._lock:
+            entries = []
+            totalsize = 0
+            for key in listdir(self.cachedir):
+                entrydir = self._get_entrydir(key)
+                if key.startswith('.') or not isdir(entrydir):
+                    continue
+                try:
+                    size = sum(getsize(join(entrydir, filename))
+                               for filename in listdir(entrydir))
+                    entries.append((stat(entrydir).st_mtime, size, entrydir))
+                except OSError:
+                    continue # Removed by another build
+                totalsize += size
+            entries.sort()
+            while totalsize > self.maxsize and entries:
+                mtime, size, entrydir = entries.pop(0)
+                log.debug('Evicting %s from the build cache.', entrydir)
+                rmtree(entrydir, ignore_errors=True)
+                totalsize -= size
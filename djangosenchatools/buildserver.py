@@ -1,21 +1,232 @@
 import logging
 import threading
+import time
+import urllib2
+import socket
+import mimetypes
+from os import stat
+from os.path import abspath, join, normpath, isfile, sep
+from urllib import unquote
+from email.utils import formatdate, parsedate_tz, mktime_tz
 from SocketServer import ThreadingMixIn
+from django.conf import settings
 from django.core.servers.basehttp import WSGIServer
 from django.core.servers.basehttp import WSGIRequestHandler
+from django.core.servers.basehttp import ServerHandler
 from django.core.servers.basehttp import get_internal_wsgi_application
 
 log = logging.getLogger('senchatoolsbuild')
 
 
+class BuildServerError(Exception):
+    """
+    Raised when the buildserver fails to start.
+    """
+
+
+class StaticFileCache(object):
+    """
+    In-memory cache of the files in ``STATIC_ROOT``.
+
+    Files are read into memory the first time they are requested, and
+    validated against the modification time and size of the file on each
+    request, so files updated by collectstatic are picked up without
+    restarting the server. Files are no longer added to the cache when it
+    holds ``maxsize`` bytes. Those files are read from disk on each request.
+    """
+    def __init__(self, static_root, static_url, maxsize=256*1024*1024):
+        self.static_root = abspath(static_root)
+        self.static_url = static_url
+        self.maxsize = maxsize
+        self.size = 0
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _get_filesystem_path(self, urlpath):
+        path = normpath(join(self.static_root, unquote(urlpath).lstrip('/')))
+        if not path.startswith(self.static_root + sep):
+            return None # Outside of STATIC_ROOT (E.g.: ../../etc/passwd)
+        return path
+
+    def get(self, urlpath):
+        """
+        Get a file from the cache.
+
+        :param urlpath: The path of the file relative to ``STATIC_URL``.
+        :return: A ``(data, headers)`` tuple, or ``None`` if the file does not exist.
+        """
+        path = self._get_filesystem_path(urlpath)
+        if path is None:
+            return None
+        try:
+            filestat = stat(path)
+        except OSError:
+            return None
+        if not isfile(path):
+            return None
+        key = (filestat.st_mtime, filestat.st_size)
+        cached = self._files.get(path)
+        if cached and cached[0] == key:
+            return cached[1], cached[2]
+
+        data = open(path, 'rb').read()
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        headers = [('Content-Type', content_type),
+                   ('Content-Length', str(len(data))),
+                   ('Last-Modified', formatdate(filestat.st_mtime, usegmt=True)),
+                   ('ETag', '"{0:x}-{1:x}"'.format(int(filestat.st_mtime * 1000),
+                                                    filestat.st_size))]
+        with self._lock:
+            previous = self._files.pop(path, None)
+            if previous:
+                self.size -= len(previous[1])
+            if self.size + len(data) <= self.maxsize:
+                self._files[path] = (key, data, headers)
+                self.size += len(data)
+        return data, headers
+
+
+class RequestCounter(object):
+    """
+    Thread-safe counter of the requests handled by all buildservers.
+    """
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def increment(self):
+        with self._lock:
+            self.value += 1
+
+#: Counts the requests handled by :class:`CountingRequestHandler`.
+request_counter = RequestCounter()
+
+
+class CountingRequestHandler(WSGIRequestHandler):
+    """
+    Request handler that counts the handled requests in :data:`request_counter`.
+    """
+    def log_request(self, *args, **kwargs):
+        request_counter.increment()
+        WSGIRequestHandler.log_request(self, *args, **kwargs)
+
+
+class BuildServerRequestHandler(CountingRequestHandler):
+    """
+    Request handler that serves files in ``STATIC_ROOT`` directly from the
+    :class:`StaticFileCache` in ``server.static_files``, without going
+    through middleware and view dispatch. Static file responses support
+    ``If-None-Match``/``If-Modified-Since`` and keep-alive connections. All
+    other requests are handled by Django, and close the connection.
+    """
+    protocol_version = 'HTTP/1.1'
+    timeout = 30 # Close idle keep-alive connections
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = 1
+            return
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request(): # An error code has been sent, just exit
+            return
+        if self.command in ('GET', 'HEAD') and self._serve_static():
+            return
+
+        # Let Django handle the request
+        self.close_connection = 1
+        handler = ServerHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ()
+        )
+        handler.request_handler = self      # backpointer for logging
+        handler.run(self.server.get_app())
+
+    def _is_not_modified(self, headers):
+        headers = dict(headers)
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return headers['ETag'] in [etag.strip() for etag in if_none_match.split(',')]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            modified_since = parsedate_tz(if_modified_since.split(';')[0])
+            last_modified = parsedate_tz(headers['Last-Modified'])
+            if modified_since and last_modified:
+                return mktime_tz(last_modified) <= mktime_tz(modified_since)
+        return False
+
+    def _serve_static(self):
+        static_files = getattr(self.server, 'static_files', None)
+        path = self.path.split('?', 1)[0]
+        if static_files is None or not path.startswith(static_files.static_url):
+            return False
+        result = static_files.get(path[len(static_files.static_url):])
+        if result is None:
+            return False # Let Django decide what to do (most likely a 404)
+        data, headers = result
+        if self._is_not_modified(headers):
+            headers = [(name, value) for name, value in headers
+                       if name in ('ETag', 'Last-Modified')]
+            self._send_static_response(304, headers, '')
+        else:
+            self._send_static_response(200, headers, data)
+        return True
+
+    def _send_static_response(self, code, headers, data):
+        # Write the entire response at once. Writing the status line and
+        # each header separately to the unbuffered socket makes keep-alive
+        # requests wait for delayed ACKs.
+        self.log_request(code, len(data))
+        lines = ['{0} {1} {2}'.format(self.protocol_version, code, self.responses[code][0]),
+                 'Server: {0}'.format(self.version_string()),
+                 'Date: {0}'.format(self.date_time_string())]
+        lines.extend('{0}: {1}'.format(name, value) for name, value in headers)
+        response = '\r\n'.join(lines) + '\r\n\r\n'
+        if self.command == 'GET':
+            response += data
+        self.wfile.write(response)
+
+
+def get_static_file_cache():
+    """
+    Get a :class:`StaticFileCache` for ``settings.STATIC_ROOT``, or ``None``
+    if ``STATIC_ROOT`` is not set or ``STATIC_URL`` is not a path on this
+    server (E.g.: a CDN url).
+    """
+    static_root = getattr(settings, 'STATIC_ROOT', None)
+    static_url = getattr(settings, 'STATIC_URL', None)
+    if not static_root or not static_url or not static_url.startswith('/'):
+        return None
+    return StaticFileCache(static_root, static_url)
+
+
 class BuildServerThread(threading.Thread):
     """
     Thread for running a live http server while the tests are running.
     """
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, static_fastpath=True):
+        """
+        :param static_fastpath:
+            Serve files in ``STATIC_ROOT`` using :class:`BuildServerRequestHandler`.
+        """
         self.host = host
         self.port = port
+        self.static_fastpath = static_fastpath
         self.is_ready = threading.Event()
         self.error = None
         super(BuildServerThread, self).__init__()
@@ -28,12 +239,25 @@ class BuildServerThread(threading.Thread):
         server_address = (self.host, self.port)
         threading = True
         if threading:
-            httpd_cls = type('WSGIServer', (ThreadingMixIn, WSGIServer), {})
+            httpd_cls = type('WSGIServer', (ThreadingMixIn, WSGIServer), {'daemon_threads': True})
         else:
             httpd_cls = WSGIServer
-        self.httpd = httpd_cls(server_address, WSGIRequestHandler, ipv6=False)
-        wsgi_handler = get_internal_wsgi_application()
-        self.httpd.set_app(wsgi_handler)
+        try:
+            static_files = None
+            if self.static_fastpath:
+                static_files = get_static_file_cache()
+            if static_files:
+                handler_cls = BuildServerRequestHandler
+            else:
+                handler_cls = CountingRequestHandler
+            self.httpd = httpd_cls(server_address, handler_cls, ipv6=False)
+            self.httpd.static_files = static_files
+            wsgi_handler = get_internal_wsgi_application()
+            self.httpd.set_app(wsgi_handler)
+        except Exception, e:
+            self.error = e
+            self.is_ready.set()
+            return
         self.is_ready.set()
         self.httpd.serve_forever()
 
@@ -47,24 +271,109 @@ class BuildServerThread(threading.Thread):
 
 
 
-def build_with_buildserver(hostname, port, builder):
-    server_thread = BuildServerThread(hostname, port)
-    server_thread.daemon = True
-    server_thread.start()
+class BuildServer(object):
+    """
+    Runs a :class:`BuildServerThread` that can be reused for many builds.
+
+    Example::
+
+        server = BuildServer('localhost', 15041)
+        server.start()
+        try:
+            ... build one or more apps ...
+        finally:
+            server.stop()
+    """
+    def __init__(self, hostname, port, static_fastpath=True):
+        """
+        :param static_fastpath: See :class:`BuildServerThread`.
+        """
+        self.hostname = hostname
+        self.port = port
+        self.static_fastpath = static_fastpath
+        self.url = 'http://{0}:{1}'.format(hostname, port)
+        self.server_thread = None
+
+    @property
+    def running(self):
+        return self.server_thread is not None
+
+    def start(self, timeout=30):
+        """
+        Start the server, and wait until it responds to requests.
 
-    # Wait for the live server to be ready
-    server_thread.is_ready.wait()
-    if server_thread.error:
-        raise server_thread.error
+        The readiness check requests ``/``, which also loads the URL
+        configuration, so the first request from ``sencha create jsb`` does
+        not have to wait for it.
 
-    server_url = 'http://{0}:{1}'.format(server_thread.host, server_thread.port)
-    log.info('Listening on %s', server_url)
+        :param timeout: Number of seconds to wait for the server to respond.
+        :raise BuildServerError: If the server does not start.
+        """
+        server_thread = BuildServerThread(self.hostname, self.port,
+                                          static_fastpath=self.static_fastpath)
+        server_thread.daemon = True
+        server_thread.start()
 
-    # Run the builder callable
-    builder()
-    #raw_input()
+        # Wait for the live server to be ready
+        server_thread.is_ready.wait()
+        if server_thread.error:
+            raise BuildServerError('Failed to start the buildserver on {0}: {1}'.format(self.url,
+                                                                                        server_thread.error))
+        self.server_thread = server_thread
+        log.info('Listening on %s', self.url)
+        try:
+            self._wait_for_response(timeout)
+        except:
+            self.stop()
+            raise
 
-    ## Stop the server
-    log.info('Stopping buildserver %s ...', server_url)
-    server_thread.join()
-    log.info('... buildserver stopped')
+    def _wait_for_response(self, timeout):
+        started = time.time()
+        while True:
+            try:
+                urllib2.urlopen(self.url + '/', timeout=timeout).read()
+            except urllib2.HTTPError:
+                break # Any HTTP response means that the server is ready
+            except urllib2.URLError, e:
+                if time.time() - started > timeout:
+                    raise BuildServerError('The buildserver on {0} did not respond within '
+                                           '{1} seconds: {2}'.format(self.url, timeout, e))
+                time.sleep(0.1)
+            else:
+                break
+        log.debug('The buildserver on %s is ready (%.2fs).', self.url, time.time() - started)
+
+    def stop(self):
+        if not self.running:
+            return
+        log.info('Stopping buildserver %s ...', self.url)
+        self.server_thread.join()
+        self.server_thread = None
+        log.info('... buildserver stopped')
+
+
+def build_with_buildserver(hostname, port, builder, static_fastpath=True, report=None):
+    """
+    Start a :class:`BuildServer`, run ``builder()``, and stop the server.
+
+    :param static_fastpath: See :class:`BuildServerThread`.
+    :param report:
+        A :class:`djangosenchatools.report.BuildReport` or
+        :class:`djangosenchatools.report.AppReport` where the time spent
+        starting and stopping the server is recorded.
+    :return: The return value of ``builder()``.
+    """
+    server = BuildServer(hostname, port, static_fastpath=static_fastpath)
+    if report:
+        with report.phase('buildserver start'):
+            server.start()
+    else:
+        server.start()
+    try:
+        return builder()
+    finally:
+        if report:
+            with report.phase('buildserver stop'):
+                server.stop()
+        else:
+            server.stop()
@@ -0,0 +1,376 @@
+"""
+Per-class offset index and source maps for the bundles built from a JSB
+config.
+
+Each file in a bundle starts on a new line (the files are concatenated
+with a newline after each file), so a position in the bundle is mapped to
+a class by its line alone. The index of ``<target>`` is written to
+``<target>.idx`` in a compact binary format that is read with
+:mod:`mmap` (see :class:`BundleIndex`), so looking up a position does not
+require loading the index. When the bundle is not compressed, each line
+maps to a line in a source file, and a source map (version 3) is written
+to ``<target>.map``.
+"""
+import logging
+import json
+import mmap
+import struct
+from collections import namedtuple
+from os import remove, stat
+from os.path import join, dirname, relpath, abspath, sep, exists
+from stat import S_IMODE
+
+from djangosenchatools.atomic import write_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+#: Buffer size used when copying files into bundles.
+BUFSIZE = 1024*1024
+
+INDEX_MAGIC = 'DSTIDX01'
+
+#: Set in the header flags if each line of the bundle maps to a line in a source file.
+FLAG_EXACT = 1
+
+_HEADER = struct.Struct('<8sIII') # magic, entry count, flags, offset of the string table
+_RECORD = struct.Struct('<IIIIII') # line, lines, offset, size, path, clsname
+
+
+class BundleIndexError(ValueError):
+    """
+    Raised when reading a file that is not a valid bundle index.
+    """
+
+
+class BundleEntry(namedtuple('BundleEntry', 'line lines offset size path clsname')):
+    """
+    A file in a bundle.
+
+    - ``line``: The (0-based) line where the file starts in the bundle.
+    - ``lines``: Number of lines in the file.
+    - ``offset``: The byte offset where the file starts in the bundle.
+    - ``size``: Size of the file in bytes.
+    - ``path``: Path to the file, as listed in the JSB config.
+    - ``clsname``: The ``clsName`` of the file in the JSB config, or ``''``.
+    """
+
+
+def get_index_filenames(targets):
+    """
+    Get the name of the index and source map for each of the given build
+    targets.
+    """
+    filenames = []
+    for target in targets:
+        filenames.extend([target + '.idx', target + '.map'])
+    return filenames
+
+
+class BundleBuilder(object):
+    """
+    Concatenates files into a bundle, and records a :class:`BundleEntry`
+    for each file in :obj:`entries`.
+    """
+    def __init__(self, fileobj=None):
+        """
+        :param fileobj:
+            The file object where the bundle is written. If ``None``, the
+            files are only read to create :obj:`entries` (E.g.: for a bundle
+            created by ``sencha build``).
+        """
+        self.fileobj = fileobj
+        self.entries = []
+        self.line = 0
+        self.offset = 0
+
+    def _add(self, readpath):
+        newlines = 0
+        size = 0
+        last = '\n'
+        with open(readpath, 'rb') as source:
+            for chunk in iter(lambda: source.read(BUFSIZE), ''):
+                if self.fileobj is not None:
+                    self.fileobj.write(chunk)
+                newlines += chunk.count('\n')
+                size += len(chunk)
+                last = chunk[-1]
+        if self.fileobj is not None:
+            self.fileobj.write('\n')
+        line, offset = self.line, self.offset
+        self.line += newlines + 1
+        self.offset += size + 1
+        lines = newlines if last == '\n' else newlines + 1
+        return line, lines, offset, size
+
+    def add_file(self, path, clsname=None, readpath=None):
+        """
+        Add a file to the bundle.
+
+        :param path: The path of the file in the JSB config.
+        :param readpath: Read the content from this path instead of ``path`` (E.g.: a minified file).
+        """
+        line, lines, offset, size = self._add(readpath or path)
+        self.entries.append(BundleEntry(line, lines, offset, size, path, clsname or ''))
+
+    def add_bundle(self, path, entries):
+        """
+        Add a previously built bundle (E.g.: ``all-classes.js`` in
+        ``app-all.js``), with the given entries.
+        """
+        line, lines, offset, size = self._add(path)
+        for entry in entries:
+            self.entries.append(entry._replace(line=entry.line + line,
+                                               offset=entry.offset + offset))
+
+
+def write_index(path, entries, exact, mode=None):
+    """
+    Write the index of a bundle to ``path``.
+
+    :param entries: List of :class:`BundleEntry`, ordered by line.
+    :param exact: Does each line of the bundle map to a line in a source file?
+    :param mode: See :func:`djangosenchatools.atomic.write_atomic`.
+    """
+    strings = []
+    stringoffsets = {}
+    def add_string(value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if not value in stringoffsets:
+            stringoffsets[value] = sum(len(string) + 1 for string in strings)
+            strings.append(value)
+        return stringoffsets[value]
+    records = [_RECORD.pack(entry.line, entry.lines, entry.offset, entry.size,
+                            add_string(entry.path), add_string(entry.clsname))
+               for entry in entries]
+    flags = FLAG_EXACT if exact else 0
+    stringtable_offset = _HEADER.size + _RECORD.size * len(records)
+
+    def write(f):
+        f.write(_HEADER.pack(INDEX_MAGIC, len(records), flags, stringtable_offset))
+        f.write(''.join(records))
+        for string in strings:
+            f.write(string)
+            f.write('\0')
+    write_atomic(path, write, mode)
+
+
+_BASE64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+def _encode_vlq(value):
+    value = ((-value) << 1) | 1 if value < 0 else value << 1
+    result = ''
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        result += _BASE64[digit]
+        if not value:
+            return result
+
+
+def write_sourcemap(path, entries, targetpath, mode=None):
+    """
+    Write a source map (version 3) for an uncompressed bundle to ``path``.
+    Each line of each file is mapped to the same line in its source file.
+    The sources are relative to the directory containing the bundle.
+
+    :param entries: List of :class:`BundleEntry`, ordered by line.
+    :param targetpath: The path of the bundle.
+    :param mode: See :func:`djangosenchatools.atomic.write_atomic`.
+    """
+    targetdir = dirname(abspath(targetpath))
+    sources = []
+    sourceindexes = {}
+    mappings = []
+    previous_source = previous_line = 0
+    for entry in entries:
+        if not entry.path in sourceindexes:
+            sourceindexes[entry.path] = len(sources)
+            sources.append(relpath(abspath(entry.path), targetdir).replace(sep, '/'))
+        source = sourceindexes[entry.path]
+        mappings.extend([''] * (entry.line - len(mappings)))
+        for line in xrange(entry.lines):
+            mappings.append('A' + _encode_vlq(source - previous_source) +
+                            _encode_vlq(line - previous_line) + 'A')
+            previous_source, previous_line = source, line
+    sourcemap = {'version': 3,
+                 'file': targetpath.rsplit(sep, 1)[-1],
+                 'sources': sources,
+                 'names': [],
+                 'mappings': ';'.join(mappings)}
+    write_atomic(path, lambda f: json.dump(sourcemap, f), mode)
+
+
+def write_bundle_index(targetpath, entries, exact, publishpath=None):
+    """
+    Write the index of the bundle in ``targetpath`` to
+    ``<targetpath>.idx``, and a source map to ``<targetpath>.map`` if the
+    bundle is ``exact`` (see :func:`write_index`). Removes any source map
+    from a previous build if not ``exact``. The index and source map get the
+    permissions of the bundle.
+
+    :param publishpath:
+        The path where the bundle is published, if it is built in a
+        :class:`djangosenchatools.atomic.BuildDirectory`. The sources in the
+        source map are relative to it. Defaults to ``targetpath``.
+    """
+    mode = S_IMODE(stat(targetpath).st_mode)
+    write_index(targetpath + '.idx', entries, exact, mode)
+    if exact:
+        write_sourcemap(targetpath + '.map', entries, publishpath or targetpath, mode)
+    elif exists(targetpath + '.map'):
+        remove(targetpath + '.map')
+
+
+def remove_bundle_indexes(outdir, targets):
+    """
+    Remove the indexes and source maps of the given build targets in
+    ``outdir``, so they are not left behind when a build does not create
+    them.
+    """
+    for filename in get_index_filenames(targets):
+        if exists(join(outdir, filename)):
+            remove(join(outdir, filename))
+
+
+def index_native_build(config, outdir, compressed, builddir=None):
+    """
+    Index the bundles built by ``sencha build`` from the given JSB config.
+    JSBuilder concatenates the files of uncompressed builds with a newline
+    after each file, so their index is created from the source files. A
+    build is skipped if it is compressed, or if the size of its target does
+    not match (E.g.: if a future version of JSBuilder adds a header).
+
+    :param compressed: Was ``sencha build`` run without ``--nocompress``?
+    :param builddir:
+        The directory where the targets were built, if they are published
+        to ``outdir`` later (see :class:`djangosenchatools.atomic.BuildDirectory`).
+        Defaults to ``outdir``.
+    :return: List with the path of each indexed target.
+    """
+    builddir = builddir or outdir
+    indexed = []
+    previous = {}
+    for build in config['builds']:
+        targetpath = join(builddir, build['target'])
+        publishpath = join(outdir, build['target'])
+        if compressed and build.get('compress'):
+            continue
+        builder = BundleBuilder()
+        try:
+            for fileinfo in build['files']:
+                path = fileinfo['path'] + fileinfo['name']
+                if abspath(path) in previous:
+                    builder.add_bundle(*previous[abspath(path)])
+                else:
+                    builder.add_file(path, fileinfo.get('clsName'))
+            size = stat(targetpath).st_size
+        except EnvironmentError, e:
+            log.debug('Not indexing %s: %s', targetpath, e)
+            continue
+        if size != builder.offset:
+            log.debug('Not indexing %s: its size (%s) does not match the files '
+                      'in the JSB config (%s).', targetpath, size, builder.offset)
+            continue
+        previous[abspath(publishpath)] = (targetpath, builder.entries)
+        write_bundle_index(targetpath, builder.entries, exact=True, publishpath=publishpath)
+        indexed.append(targetpath)
+    return indexed
+
+
+class BundleIndex(object):
+    """
+    Read-only access to an index written by :func:`write_index`. The index
+    is memory-mapped, and entries are only decoded when they are looked up.
+
+    Example::
+
+        with BundleIndex('app-all.js.idx') as index:
+            entry, sourceline = index.find_line(1, 2345)
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError), e: # Empty file
+                raise BundleIndexError('{0} is not a bundle index: {1}'.format(path, e))
+        if len(self._mmap) < _HEADER.size:
+            self.close()
+            raise BundleIndexError('{0} is not a bundle index.'.format(path))
+        magic, self._count, flags, self._stringtable_offset = _HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC or len(self._mmap) < self._stringtable_offset:
+            self.close()
+            raise BundleIndexError('{0} is not a bundle index.'.format(path))
+        #: ``True`` if each line of the bundle maps to a line in a source file.
+        self.exact = bool(flags & FLAG_EXACT)
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _get_string(self, offset):
+        start = self._stringtable_offset + offset
+        return self._mmap[start:self._mmap.find('\0', start)].decode('utf-8')
+
+    def _get_record(self, index):
+        return _RECORD.unpack_from(self._mmap, _HEADER.size + _RECORD.size * index)
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        line, lines, offset, size, path, clsname = self._get_record(index)
+        return BundleEntry(line, lines, offset, size, self._get_string(path),
+                           self._get_string(clsname))
+
+    def _bisect(self, value, field):
+        # Find the last entry starting at or before value
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_record(middle)[field] <= value:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def find_line(self, line):
+        """
+        Find the file containing the given (1-based) line of the bundle.
+
+        :return: ``(entry, sourceline)``. ``sourceline`` is the 1-based line
+            in the source file, or ``None`` if the index is not
+            :obj:`exact`.
+        :raise LookupError: If the line is not in any of the files.
+        """
+        index = self._bisect(line - 1, 0)
+        if index >= 0:
+            entry = self[index]
+            if line - 1 < entry.line + max(entry.lines, 1):
+                sourceline = line - entry.line if self.exact else None
+                return entry, sourceline
+        raise LookupError('Line {0} is not in any of the files in {1}.'.format(line, self.path))
+
+    def find_offset(self, offset):
+        """
+        Find the file containing the given byte offset of the bundle.
+
+        :return: A :class:`BundleEntry`.
+        :raise LookupError: If the offset is not in any of the files.
+        """
+        index = self._bisect(offset, 2)
+        if index >= 0:
+            entry = self[index]
+            if offset < entry.offset + entry.size:
+                return entry
+        raise LookupError('Offset {0} is not in any of the files in {1}.'.format(offset, self.path))
@@ -0,0 +1,130 @@
+"""
+Client for the ``senchatoolsbuild --serve`` daemon (see
+:mod:`djangosenchatools.daemon`).
+
+This module does not import Django, so the client starts in a fraction of
+a second, which makes it usable from editors and test runners::
+
+    $ python -m djangosenchatools.client build myapp
+    $ python -m djangosenchatools.client changed myapp/static/myapp/app/view/Main.js
+
+The client sends a single JSON request line, and the daemon replies with
+one JSON message per line: ``{"type": "log", ...}`` for each log message of
+the build, and a final ``{"type": "result", ...}``.
+"""
+import json
+import os
+import sys
+import socket
+from optparse import OptionParser
+from os.path import join, expanduser
+
+
+class DaemonError(Exception):
+    """
+    Raised when the daemon can not be reached, or when it does not reply
+    with a result.
+    """
+
+
+def get_default_socket():
+    """
+    Get the default path of the daemon socket: The
+    ``DJANGOSENCHATOOLS_SOCKET`` environment variable, or
+    ``~/.cache/djangosenchatools/serve.sock``.
+    """
+    return (os.environ.get('DJANGOSENCHATOOLS_SOCKET') or
+            join(expanduser('~'), '.cache', 'djangosenchatools', 'serve.sock'))
+
+
+def send_message(fileobj, message):
+    """
+    Write ``message`` to ``fileobj`` as a single line of JSON.
+    """
+    fileobj.write(json.dumps(message) + '\n')
+    fileobj.flush()
+
+
+def request(message, socketpath=None):
+    """
+    Send a request to the daemon, and yield each message of the reply. The
+    last message is the result (``message['type'] == 'result'``).
+
+    :param message: The request. E.g.: ``{'command': 'build', 'apps': ['myapp']}``.
+    :param socketpath: Defaults to :func:`get_default_socket`.
+    :raise DaemonError: If the daemon is not running, or closes the connection without a result.
+    """
+    socketpath = socketpath or get_default_socket()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socketpath)
+        except socket.error, e:
+            raise DaemonError('Could not connect to {0}. Is "senchatoolsbuild --serve" '
+                              'running? ({1})'.format(socketpath, e))
+        writer = sock.makefile('wb')
+        reader = sock.makefile('rb')
+        send_message(writer, message)
+        for line in iter(reader.readline, ''):
+            reply = json.loads(line)
+            yield reply
+            if reply['type'] == 'result':
+                return
+        raise DaemonError('The daemon closed the connection without a result.')
+    finally:
+        sock.close()
+
+
+def main(argv=None):
+    parser = OptionParser(usage=('%prog [options] build [app ...] | changed <path> [path ...] '
+                                 '| ping | shutdown'))
+    parser.add_option('--socket',
+        dest='socketpath',
+        default=None,
+        help=('Path to the socket of the daemon. Defaults to the '
+              'DJANGOSENCHATOOLS_SOCKET environment variable, or '
+              '~/.cache/djangosenchatools/serve.sock.'))
+    parser.add_option('-q', '--quiet',
+        action='store_true',
+        dest='quiet',
+        default=False,
+        help='Only print errors.')
+    parser.add_option('--level',
+        dest='level',
+        default='INFO',
+        help='The level of the log messages to stream from the daemon. Defaults to INFO.')
+    options, args = parser.parse_args(argv)
+    if not args or not args[0] in ('build', 'changed', 'ping', 'shutdown'):
+        parser.error('A command is required.')
+    command, args = args[0], args[1:]
+    message = {'command': command, 'level': options.level.upper()}
+    if command == 'build':
+        message['apps'] = args
+    elif command == 'changed':
+        if not args:
+            parser.error('"changed" requires at least one path.')
+        message['paths'] = [os.path.abspath(path) for path in args]
+
+    result = None
+    try:
+        for reply in request(message, options.socketpath):
+            if reply['type'] == 'log':
+                if not options.quiet:
+                    sys.stderr.write('{0}: {1}\n'.format(reply['level'], reply['message']))
+            else:
+                result = reply
+    except DaemonError, e:
+        sys.stderr.write('{0}\n'.format(e))
+        return 2
+    if not result['ok']:
+        sys.stderr.write('{0}\n'.format(result.get('error') or 'The build failed.'))
+        return 1
+    if not options.quiet and result.get('report'):
+        report = result['report']
+        sys.stdout.write('Built {0} app(s) in {1:.2f}s.\n'.format(len(report['apps']),
+                                                                  report['duration'] or 0.0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
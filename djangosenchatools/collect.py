@@ -0,0 +1,185 @@
+import logging
+import json
+import threading
+from hashlib import sha1
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from os import stat, remove, makedirs, symlink, walk
+from os.path import join, abspath, dirname, isdir, exists, lexists, relpath
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+
+from djangosenchatools.atomic import write_atomic, copy_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+#: The default ignore patterns of collectstatic
+IGNORE_PATTERNS = ['CVS', '.*', '*~']
+
+
+def _get_checksum(path):
+    checksum = sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def iter_finder_files():
+    """
+    Iterate over all the files found by the staticfiles finders, just like
+    collectstatic does.
+
+    :return: Iterator of ``(destpath, sourcepath)``, where ``destpath`` is
+        the path relative to ``STATIC_ROOT``.
+    """
+    found = set()
+    for finder in finders.get_finders():
+        for path, storage in finder.list(IGNORE_PATTERNS):
+            prefix = getattr(storage, 'prefix', None)
+            if prefix:
+                destpath = join(prefix, path)
+            else:
+                destpath = path
+            if destpath in found:
+                continue # The first file found wins, just like with collectstatic
+            found.add(destpath)
+            yield destpath, storage.path(path)
+
+
+def iter_app_files(staticdir, paths=None):
+    """
+    Iterate over files in the static directory of an app.
+
+    :param staticdir: The ``<appdir>/static/`` directory.
+    :param paths:
+        Paths within ``staticdir``. If this is ``None``, we iterate over all
+        the files in ``staticdir``.
+    :return: Iterator of ``(destpath, sourcepath)``, where ``destpath`` is
+        the path relative to ``STATIC_ROOT``.
+    """
+    if paths is None:
+        paths = []
+        for dirpath, dirnames, filenames in walk(staticdir):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            paths.extend(join(dirpath, filename) for filename in filenames
+                         if not filename.startswith('.') and not filename.endswith('~'))
+    for path in paths:
+        yield relpath(path, staticdir), path
+
+
+class IncrementalCollector(object):
+    """
+    Copies (or symlinks) static files to ``STATIC_ROOT`` like collectstatic,
+    but only the files that have changed since they were last collected.
+
+    A manifest with the source path, modification time, size and SHA-1 of
+    each collected file is used to detect changes. Files with a new
+    modification time or size are only copied if their checksum changed.
+    Changed files are copied in parallel.
+    """
+    def __init__(self, manifestpath, link=False, jobs=None):
+        """
+        :param manifestpath: Path to the JSON manifest file.
+        :param link: Create symlinks instead of copying the files.
+        :param jobs: Number of files to copy at the same time. Defaults to the number of CPUs.
+        """
+        self.static_root = abspath(settings.STATIC_ROOT)
+        self.manifestpath = manifestpath
+        self.link = link
+        self.jobs = jobs or cpu_count()
+        self._lock = threading.Lock()
+        self.manifest = self._load()
+
+    def _load(self):
+        if not exists(self.manifestpath):
+            return {}
+        try:
+            manifest = json.load(open(self.manifestpath, 'rb'))
+        except ValueError:
+            log.warning('Ignoring invalid collectstatic manifest: %s', self.manifestpath)
+            return {}
+        if manifest.get('static_root') != self.static_root or manifest.get('link') != self.link:
+            return {}
+        return manifest['files']
+
+    def _save(self):
+        manifestdir = dirname(self.manifestpath)
+        if not isdir(manifestdir):
+            makedirs(manifestdir)
+        write_atomic(self.manifestpath, json.dumps({'static_root': self.static_root,
+                                                    'link': self.link,
+                                                    'files': self.manifest}))
+
+    def collect(self, files, remove_missing=False):
+        """
+        Collect the given files.
+
+        :param files: Iterable of ``(destpath, sourcepath)`` tuples. See :func:`iter_finder_files`.
+        :param remove_missing:
+            Remove files from ``STATIC_ROOT`` when their source no longer
+            exists. Used when ``files`` are changed paths reported by
+            ``--watch``.
+        :return: Number of copied files.
+        """
+        changed = []
+        total = 0
+        for destpath, sourcepath in files:
+            try:
+                sourcestat = stat(sourcepath)
+            except OSError:
+                if remove_missing:
+                    self._remove(destpath)
+                continue
+            total += 1
+            entry = self.manifest.get(destpath)
+            if entry and entry[:3] == [sourcepath, sourcestat.st_mtime, sourcestat.st_size] \
+                    and lexists(join(self.static_root, destpath)):
+                continue
+            changed.append((destpath, sourcepath, sourcestat))
+        copied = 0
+        if changed:
+            pool = ThreadPool(min(self.jobs, len(changed)))
+            try:
+                copied = sum(pool.map(self._collect_file, changed))
+            finally:
+                pool.close()
+                pool.join()
+        self._save()
+        log.info('Incremental collectstatic: %s file(s) copied, %s unchanged.',
+                 copied, total - copied)
+        return copied
+
+    def _collect_file(self, args):
+        destpath, sourcepath, sourcestat = args
+        destination = join(self.static_root, destpath)
+        entry = self.manifest.get(destpath)
+        checksum = _get_checksum(sourcepath)
+        if entry and entry[3] == checksum and entry[0] == sourcepath and lexists(destination):
+            copied = False # Touched, but not changed
+        else:
+            if not isdir(dirname(destination)):
+                try:
+                    makedirs(dirname(destination))
+                except OSError:
+                    if not isdir(dirname(destination)): # Created by another thread?
+                        raise
+            if self.link:
+                if lexists(destination):
+                    remove(destination)
+                symlink(sourcepath, destination)
+            else:
+                copy_atomic(sourcepath, destination) # Also replaces a symlink from --collectstatic-link
+            log.debug('Copied %s to %s', sourcepath, destination)
+            copied = True
+        with self._lock:
+            self.manifest[destpath] = [sourcepath, sourcestat.st_mtime, sourcestat.st_size, checksum]
+        return copied
+
+    def _remove(self, destpath):
+        destination = join(self.static_root, destpath)
+        if lexists(destination):
+            remove(destination)
+            log.debug('Removed %s', destination)
+        self.manifest.pop(destpath, None)
@@ -0,0 +1,145 @@
+import logging
+import json
+from os.path import join, abspath
+
+from djangosenchatools.bundleindex import BundleBuilder, write_bundle_index, remove_bundle_indexes
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+def get_build_sourcepaths(build):
+    """
+    Get the path of each file in a ``builds`` section of a JSB config.
+    """
+    return [fileinfo['path'] + fileinfo['name'] for fileinfo in build['files']]
+
+
+def concatenate_build(build, outdir, readpaths=None, previous=None):
+    """
+    Concatenate the files in a ``builds`` section of a JSB config into
+    ``<outdir>/<target>``. Each file is followed by a newline, just like
+    when JSBuilder (``sencha build``) builds without compression.
+
+    The files are streamed into the target in
+    :data:`djangosenchatools.bundleindex.BUFSIZE` chunks, so the bundle is
+    never held in memory.
+
+    :param readpaths:
+        Dict mapping source paths to the path where their content is read
+        from (E.g.: minified files). Defaults to reading the sources.
+    :param previous:
+        Dict mapping the absolute path of previously built targets (as
+        listed in the JSB config) to a ``(builtpath, entries)`` tuple, where
+        ``builtpath`` is the path where the target was built, and
+        ``entries`` is its :class:`djangosenchatools.bundleindex.BundleEntry` list.
+    :return: ``(targetpath, entries)``, where ``entries`` is a list of
+        :class:`djangosenchatools.bundleindex.BundleEntry`.
+    """
+    readpaths = readpaths or {}
+    previous = previous or {}
+    targetpath = join(outdir, build['target'])
+    with open(targetpath, 'wb') as target:
+        builder = BundleBuilder(target)
+        for fileinfo in build['files']:
+            sourcepath = fileinfo['path'] + fileinfo['name']
+            if abspath(sourcepath) in previous:
+                builder.add_bundle(*previous[abspath(sourcepath)])
+            else:
+                builder.add_file(sourcepath, fileinfo.get('clsName'), readpaths.get(sourcepath))
+    return targetpath, builder.entries
+
+
+def _inline_targets(build, targets):
+    """
+    Replace the targets of previous builds in the files of ``build`` with
+    the files they were built from.
+
+    :param targets: Dict mapping the absolute path of targets to their files.
+    """
+    files = []
+    for fileinfo in build['files']:
+        files.extend(targets.get(abspath(fileinfo['path'] + fileinfo['name']), [fileinfo]))
+    return dict(build, files=files)
+
+
+def get_compressed_builds(config, outdir):
+    """
+    Get the builds with ``compress`` in a JSB config. Targets of builds
+    without ``compress`` are replaced by the files they were built from (E.g.:
+    the sources in ``all-classes.js`` are listed in ``app-all.js``), so all
+    the sources of a compressed build can be minified.
+
+    :param config: The JSB config as a dict.
+    """
+    targets = {}
+    builds = []
+    for build in config['builds']:
+        build = _inline_targets(build, targets)
+        if build.get('compress'):
+            builds.append(build)
+        else:
+            targets[abspath(join(outdir, build['target']))] = build['files']
+    return builds
+
+
+def get_source_builds(config, outdir):
+    """
+    Get the builds in a JSB config, with the targets of previous builds
+    replaced by the files they were built from (E.g.: the sources in
+    ``all-classes.js`` are listed in ``app-all.js``).
+
+    :param config: The JSB config as a dict.
+    """
+    targets = {}
+    builds = []
+    for build in config['builds']:
+        build = _inline_targets(build, targets)
+        targets[abspath(join(outdir, build['target']))] = build['files']
+        builds.append(build)
+    return builds
+
+
+def concatenate_from_jsb(jsb, outdir, readpaths=None, exact=True, index=True, builddir=None):
+    """
+    Create all the build targets in the given JSB config in ``outdir``. The
+    builds are created in order, so a build can include the target of a
+    previous build (E.g.: ``app-all.js`` includes ``all-classes.js``).
+
+    :param jsb: The JSB config as a string.
+    :param readpaths:
+        Dict mapping the sources of the builds with ``compress`` to the
+        path where their content is read from (E.g.: minified files). See
+        :func:`get_compressed_builds`. Builds without ``compress`` are
+        concatenated from the sources.
+    :param exact: ``False`` if ``readpaths`` do not have the same lines as the sources.
+    :param index:
+        Write the index (and source map if ``exact``) of each target. See
+        :func:`djangosenchatools.bundleindex.write_bundle_index`.
+    :param builddir:
+        Create the targets in this directory instead, to publish them to
+        ``outdir`` when the build is finished (see
+        :class:`djangosenchatools.atomic.BuildDirectory`).
+    :return: List with the path of each created file.
+    """
+    builddir = builddir or outdir
+    config = json.loads(jsb)
+    compressed = dict((build['target'], build) for build in get_compressed_builds(config, outdir))
+    targetpaths = []
+    previous = {}
+    for build in config['builds']:
+        if readpaths and build['target'] in compressed:
+            build = compressed[build['target']]
+            targetpath, entries = concatenate_build(build, builddir, readpaths, previous)
+            build_exact = exact
+        else:
+            targetpath, entries = concatenate_build(build, builddir, None, previous)
+            build_exact = True
+        log.debug('Created %s from %s files.', targetpath, len(build['files']))
+        publishpath = join(outdir, build['target'])
+        previous[abspath(publishpath)] = (targetpath, entries)
+        if index:
+            write_bundle_index(targetpath, entries, build_exact, publishpath)
+        else:
+            remove_bundle_indexes(builddir, [build['target']])
+        targetpaths.append(targetpath)
+    return targetpaths
@@ -0,0 +1,133 @@
+import logging
+import os
+import signal
+import threading
+
+from djangosenchatools.jsb import JsbFormatError
+from djangosenchatools.parallel import build_apps_parallel, log_build_summary
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+class CrawlError(IOError):
+    """
+    Raised when ``sencha create jsb`` fails (or is killed by
+    :class:`ProcessTimeout`) without creating the JSB-file.
+    """
+
+
+class ProcessTimeout(object):
+    """
+    Kills a ``subprocess.Popen`` process if it does not finish within
+    ``timeout`` seconds. The process must be started in its own process
+    group (see :func:`get_popen_kwargs`), so any processes it starts are
+    killed as well.
+
+    Example::
+
+        process = Popen(cmd, **get_popen_kwargs(timeout))
+        with ProcessTimeout(process, timeout, ' '.join(cmd)) as processtimeout:
+            process.wait()
+        if processtimeout.expired:
+            ...
+    """
+    def __init__(self, process, timeout, name):
+        self.process = process
+        self.timeout = timeout
+        self.name = name
+        self.expired = False
+        self._timer = None
+
+    def __enter__(self):
+        if self.timeout:
+            self._timer = threading.Timer(self.timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._timer:
+            self._timer.cancel()
+        if exc_type is not None and self.process.returncode is None:
+            # Do not leave the process running if we are interrupted
+            # (E.g.: by KeyboardInterrupt, which no longer reaches a process
+            # in another process group).
+            self.kill()
+
+    def _expire(self):
+        self.expired = True
+        log.warning('"%s" did not finish within %s seconds. Killing it.', self.name, self.timeout)
+        self.kill()
+
+    def kill(self):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except OSError:
+            pass # Already finished
+
+
+def get_popen_kwargs(timeout):
+    """
+    Get the extra ``subprocess.Popen`` arguments required by
+    :class:`ProcessTimeout`.
+    """
+    if timeout and hasattr(os, 'setsid'):
+        return {'preexec_fn': os.setsid}
+    return {}
+
+
+def crawl_with_retries(sencha, crawl, retries=0):
+    """
+    Run ``crawl(sencha)`` until it succeeds, at most ``retries + 1`` times.
+    A crawl fails if any of the commands it runs fail (including timeouts),
+    or if it raises ``EnvironmentError`` or
+    :exc:`djangosenchatools.jsb.JsbFormatError` (E.g.: when ``sencha
+    create jsb`` does not create the JSB-file).
+
+    The commands of failed attempts are removed from ``sencha.returncodes``
+    when the crawl is retried, and marked as ``retried`` in
+    ``sencha.report``.
+
+    :param sencha: A :class:`djangosenchatools.management.commands.senchatoolsbuild.SenchaToolsWrapper`.
+    :raise: The error from the last attempt, if it raised an error.
+    """
+    for attempt in xrange(retries + 1):
+        returncodes_before = len(sencha.returncodes)
+        commands_before = len(sencha.report.commands)
+        try:
+            crawl(sencha)
+        except (EnvironmentError, JsbFormatError), e:
+            if attempt == retries:
+                raise
+            error = str(e)
+        else:
+            failed = [(cmd, returncode) for cmd, returncode in sencha.returncodes[returncodes_before:]
+                      if returncode != 0]
+            if not failed or attempt == retries:
+                return
+            error = 'exit status {0} from "{1}"'.format(failed[0][1], failed[0][0])
+        log.warning('Crawling %s failed (%s). Retrying (attempt %s of %s).',
+                    sencha.url, error, attempt + 2, retries + 1)
+        del sencha.returncodes[returncodes_before:]
+        for command in sencha.report.commands[commands_before:]:
+            command['retried'] = True
+
+
+def schedule_crawls(jobs, apps, crawl):
+    """
+    Crawl apps concurrently (against a shared buildserver), with at most
+    ``jobs`` crawls running at the same time.
+
+    :param apps: Iterable of ``(outdir, appname, url)``.
+    :param crawl:
+        Callable that takes ``(outdir, appname, url)`` as arguments, crawls
+        the app, and returns the ``SenchaToolsWrapper``. See
+        :func:`djangosenchatools.parallel.build_apps_parallel`.
+    :return: List of :class:`djangosenchatools.parallel.AppBuildResult` for the apps that failed.
+    """
+    log.info('Crawling {0} apps using {1} jobs.'.format(len(apps), jobs))
+    results = build_apps_parallel(jobs, apps, crawl, verb='Crawling')
+    return log_build_summary(results, title='Crawl summary', verb='crawling')
@@ -0,0 +1,167 @@
+"""
+The ``senchatoolsbuild --serve`` daemon. Keeps Django, the buildserver and
+the caches of ``senchatoolsbuild`` alive between builds, and accepts build
+requests on a Unix socket (see :mod:`djangosenchatools.client` for the
+protocol).
+
+Builds run one at a time. Requests that arrive during a build wait for it
+to finish. The log messages of a build are streamed to the client that
+requested it.
+"""
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+from os.path import dirname, exists, isdir
+from SocketServer import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+
+from djangosenchatools.client import send_message
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+class BuildDaemonError(Exception):
+    """
+    Raised when the daemon can not listen on its socket.
+    """
+
+
+class SocketLogHandler(logging.Handler):
+    """
+    Sends log records to a client as ``{"type": "log", ...}`` messages.
+    Stops sending when the client disconnects, so the build is not aborted.
+    """
+    def __init__(self, fileobj, level=logging.INFO):
+        logging.Handler.__init__(self, level)
+        self.fileobj = fileobj
+        self.disconnected = False
+
+    def emit(self, record):
+        if self.disconnected:
+            return
+        try:
+            send_message(self.fileobj, {'type': 'log',
+                                        'level': record.levelname,
+                                        'message': self.format(record)})
+        except socket.error:
+            self.disconnected = True
+        except Exception:
+            self.handleError(record)
+
+
+class BuildRequestHandler(StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            message = json.loads(line)
+            command = message['command']
+        except (ValueError, TypeError, KeyError):
+            self._reply({'type': 'result', 'ok': False, 'error': 'Invalid request: {0!r}'.format(line)})
+            return
+        if command == 'ping':
+            self._reply({'type': 'result', 'ok': True})
+        elif command == 'shutdown':
+            log.info('Shutdown requested.')
+            self._reply({'type': 'result', 'ok': True})
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            self._build(message)
+
+    def finish(self):
+        try:
+            StreamRequestHandler.finish(self)
+        except socket.error:
+            pass # The client disconnected, so the buffered messages can not be sent
+
+    def _reply(self, message):
+        try:
+            send_message(self.wfile, message)
+        except socket.error:
+            log.debug('The client disconnected before receiving: %r', message)
+
+    def _build(self, message):
+        level = logging.getLevelName(message.get('level', 'INFO'))
+        handler = SocketLogHandler(self.wfile, level if isinstance(level, int) else logging.INFO)
+        if not self.server.buildlock.acquire(False):
+            handler.emit(logging.makeLogRecord({'levelname': 'INFO',
+                                                'msg': 'Waiting for the current build to finish.'}))
+            self.server.buildlock.acquire()
+        log.addHandler(handler)
+        try:
+            try:
+                report = self.server.callback(message)
+            except Exception, e:
+                if not isinstance(e, self.server.expected_exceptions):
+                    log.exception('Build request failed: %r', message)
+                result = {'type': 'result', 'ok': False, 'error': str(e)}
+            else:
+                result = {'type': 'result', 'report': report,
+                          'ok': all(app['ok'] for app in report['apps'])}
+        finally:
+            log.removeHandler(handler)
+            self.server.buildlock.release()
+        self._reply(result)
+
+
+class BuildDaemon(ThreadingMixIn, UnixStreamServer):
+    """
+    Listens for build requests on the Unix socket in ``socketpath``, and
+    calls ``callback(message)`` for each request that is not handled by the
+    daemon itself (``ping`` and ``shutdown``). The callback returns the
+    build report as a dict (see
+    :meth:`djangosenchatools.report.BuildReport.as_dict`), and raises an
+    exception if the request is invalid or the build fails.
+
+    Example::
+
+        daemon = BuildDaemon(socketpath, callback)
+        try:
+            daemon.serve_forever()
+        finally:
+            daemon.close()
+    """
+    daemon_threads = True
+
+    def __init__(self, socketpath, callback, expected_exceptions=()):
+        """
+        :param expected_exceptions:
+            Exceptions raised by the callback that are only reported to the
+            client. Other exceptions are logged with a traceback.
+        """
+        self.socketpath = socketpath
+        self.callback = callback
+        self.expected_exceptions = tuple(expected_exceptions)
+        self.buildlock = threading.Lock()
+        self._remove_stale_socket()
+        if not isdir(dirname(socketpath)):
+            os.makedirs(dirname(socketpath))
+        umask = os.umask(0077) # Only the owner can request builds
+        try:
+            UnixStreamServer.__init__(self, socketpath, BuildRequestHandler)
+        except socket.error, e:
+            raise BuildDaemonError('Could not listen on {0}: {1}'.format(socketpath, e))
+        finally:
+            os.umask(umask)
+
+    def _remove_stale_socket(self):
+        if not exists(self.socketpath):
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socketpath)
+        except socket.error, e:
+            if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                log.debug('Removing stale socket: %s', self.socketpath)
+                os.remove(self.socketpath)
+                return
+            raise BuildDaemonError('Could not connect to {0}: {1}'.format(self.socketpath, e))
+        finally:
+            sock.close()
+        raise BuildDaemonError('Another daemon is listening on {0}.'.format(self.socketpath))
+
+    def close(self):
+        self.server_close()
+        if exists(self.socketpath):
+            os.remove(self.socketpath)
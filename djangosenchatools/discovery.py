@@ -0,0 +1,196 @@
+import logging
+import imp
+import json
+import sys
+import threading
+from hashlib import sha1
+from os import stat, walk, makedirs
+from os.path import join, dirname, isdir, exists
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+from djangosenchatools.buildcache import iter_app_sources
+from djangosenchatools.atomic import write_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+def find_module_dir(modulename):
+    """
+    Find the directory containing the given module or package without
+    importing it, using ``imp.find_module`` on each part of the name.
+
+    Falls back to importing the module if it can not be found this way
+    (E.g.: namespace packages or modules in zip files).
+    """
+    path = None
+    pathname = None
+    try:
+        for part in modulename.split('.'):
+            if pathname is not None and path is None:
+                raise ImportError('{0} is not a package'.format(pathname))
+            f, pathname, (suffix, mode, moduletype) = imp.find_module(part, path)
+            if f:
+                f.close()
+            if moduletype == imp.PKG_DIRECTORY:
+                path = [pathname]
+            elif moduletype in (imp.PY_SOURCE, imp.PY_COMPILED, imp.C_EXTENSION):
+                path = None
+            else:
+                raise ImportError('Unsupported module type: {0}'.format(pathname))
+    except ImportError:
+        log.debug('Could not find %s without importing it. Importing it instead.', modulename)
+        mod = import_module(modulename)
+        if not exists(mod.__file__):
+            return None
+        return dirname(mod.__file__)
+    if path is None:
+        return dirname(pathname)
+    return pathname
+
+
+def _encode_path(path):
+    if isinstance(path, unicode):
+        return path.encode('utf-8')
+    return path
+
+
+def _get_mtime(path):
+    try:
+        return stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class AppDiscoveryIndex(object):
+    """
+    Finds the ExtJS apps in ``INSTALLED_APPS`` without importing them (see
+    :func:`find_module_dir`), and caches the result, including the source
+    files of each app, in a JSON file.
+
+    The index is invalidated when ``INSTALLED_APPS`` or ``sys.path``
+    changes, and each app is re-discovered when the modification time of
+    any of the directories it was discovered from changes. Adding or
+    removing a file changes the modification time of its directory, so
+    the source files of an app are always up to date.
+    """
+    def __init__(self, indexpath):
+        """
+        :param indexpath: Path to the JSON file where the index is stored.
+        """
+        self.indexpath = indexpath
+        self.key = sha1(json.dumps([list(settings.INSTALLED_APPS), sys.path])).hexdigest()
+        self.entries = self._load()
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if not exists(self.indexpath):
+            return {}
+        try:
+            index = json.load(open(self.indexpath, 'rb'))
+        except ValueError:
+            log.warning('Ignoring invalid app discovery index: %s', self.indexpath)
+            return {}
+        if index.get('key') != self.key:
+            log.debug('INSTALLED_APPS or sys.path changed. Ignoring the app discovery index.')
+            return {}
+        return index['apps']
+
+    def save(self):
+        """
+        Save the index if it has changed.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            indexdir = dirname(self.indexpath)
+            if not isdir(indexdir):
+                makedirs(indexdir)
+            write_atomic(self.indexpath, json.dumps({'key': self.key, 'apps': self.entries}))
+            self._dirty = False
+
+    def _is_valid(self, entry):
+        for path, mtime in entry['dirs']:
+            if _get_mtime(path) != mtime:
+                return False
+        return True
+
+    def _discover(self, app):
+        moddir = find_module_dir(app)
+        entry = {'moddir': moddir,
+                 'appname': app.split('.')[-1],
+                 'outdir': None,
+                 'sources': [],
+                 'dirs': []}
+        if moddir is None:
+            return entry
+        outdir = join(moddir, 'static', entry['appname'])
+        appdir = join(outdir, 'app')
+        dirs = [moddir, join(moddir, 'static'), outdir, appdir]
+        if isdir(appdir):
+            entry['outdir'] = outdir
+            entry['sources'] = list(iter_app_sources(outdir))
+            for dirpath, dirnames, filenames in walk(appdir):
+                dirs.extend(join(dirpath, name) for name in dirnames)
+        entry['dirs'] = [(path, _get_mtime(path)) for path in dirs]
+        return entry
+
+    def _get_entry(self, app):
+        with self._lock:
+            entry = self.entries.get(app)
+            if entry is None or not self._is_valid(entry):
+                entry = self._discover(app)
+                self.entries[app] = entry
+                self._dirty = True
+            return entry
+
+    def get_appinfo(self, app):
+        """
+        Get information about an ExtJS app.
+
+        :return: ``(outdir, appname)``.
+        :raise LookupError: If ``app`` is not an ExtJS app.
+        """
+        entry = self._get_entry(app)
+        self.save()
+        appname = entry['appname']
+        if entry['outdir']:
+            log.debug('Found ExtJS app: %s', appname)
+            return _encode_path(entry['outdir']), _encode_path(appname)
+        elif entry['moddir']:
+            log.debug('%s is not an ExtJS app (%s does not exist).', appname,
+                      join(entry['moddir'], 'static', appname, 'app'))
+        raise LookupError()
+
+    def get_installed_extjs_apps(self):
+        """
+        Get all installed extjs apps.
+
+        :return: List of ``(outdir, appname)``.
+        """
+        installed_apps = []
+        checked = set()
+        for app in settings.INSTALLED_APPS:
+            if not app.startswith('django.') and not app in checked:
+                checked.add(app)
+                try:
+                    installed_apps.append(self.get_appinfo(app))
+                except LookupError:
+                    pass
+        return installed_apps
+
+    def get_sources(self, outdir):
+        """
+        Get the source files of the app in ``outdir``. See
+        :func:`djangosenchatools.buildcache.iter_app_sources`.
+
+        :return: List of paths, or ``None`` if ``outdir`` is not the outdir
+            of an app in the index.
+        """
+        with self._lock:
+            for app, entry in self.entries.items():
+                if entry['outdir'] == outdir:
+                    return [_encode_path(path) for path in self._get_entry(app)['sources']]
+        return None
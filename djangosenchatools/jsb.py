@@ -0,0 +1,231 @@
+"""
+Processing of the JSB3 configs created by ``sencha create jsb``.
+
+The configs of large apps contain thousands of files, so the files are
+rewritten in place, and the config is written one file per line using the
+C-accelerated string encoder of :mod:`json` instead of
+``json.dumps(indent=4)``, which falls back to the (slow) pure python encoder.
+"""
+import logging
+import json
+from copy import deepcopy
+from json.encoder import encode_basestring_ascii
+from os.path import join, abspath, sep
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+class JsbFormatError(ValueError):
+    """
+    Raised when a JSB config does not have the format created by
+    ``sencha create jsb``.
+    """
+
+
+def _check(condition, message, *args):
+    if not condition:
+        raise JsbFormatError('Invalid JSB config: ' + message.format(*args))
+
+
+def validate_jsb(config):
+    """
+    Make sure the JSB config has the format created by ``sencha create jsb``
+    (and that sencha/jsbuilder have not changed their format). That is, an
+    "All Classes" build followed by an ``app-all.js`` build of
+    ``all-classes.js`` and ``app.js``.
+
+    :raise JsbFormatError: If the config does not have the expected format.
+    """
+    _check(isinstance(config, dict), 'expected an object, got {0}.', type(config).__name__)
+    builds = config.get('builds')
+    _check(isinstance(builds, list) and len(builds) >= 2,
+           '"builds" must be a list with at least 2 builds.')
+    for index, build in enumerate(builds[:2]):
+        _check(isinstance(build, dict) and isinstance(build.get('files'), list),
+               'builds[{0}] must be an object with a "files" list.', index)
+        for fileinfo in build['files']:
+            _check(isinstance(fileinfo, dict) and isinstance(fileinfo.get('path'), basestring)
+                   and isinstance(fileinfo.get('name'), basestring),
+                   'each file in builds[{0}] must have a "path" and a "name". Got: {1!r}',
+                   index, fileinfo)
+    appall = builds[1]
+    names = [fileinfo['name'] for fileinfo in appall['files']]
+    _check(names == ['all-classes.js', 'app.js'],
+           'builds[1] must contain all-classes.js and app.js. Got: {0}', ', '.join(names))
+    _check(appall.get('target') == 'app-all.js',
+           'the target of builds[1] must be app-all.js. Got: {0}', appall.get('target'))
+
+
+class JsbPathRewriter(object):
+    """
+    Rewrites the paths in the "All Classes" section of a JSB config using a
+    prefix mapping. The result for each path is memoized, since most files
+    are in a few directories.
+    """
+    def __init__(self, prefixes):
+        """
+        :param prefixes:
+            Dict mapping path prefixes to their replacement. The longest
+            matching prefix is used. Paths not matching any prefix are not
+            changed.
+        """
+        self.prefixes = sorted(prefixes.items(), key=lambda item: len(item[0]), reverse=True)
+        self._cache = {}
+
+    def rewrite(self, path):
+        try:
+            return self._cache[path]
+        except KeyError:
+            pass
+        result = path
+        for prefix, replacement in self.prefixes:
+            if path.startswith(prefix):
+                result = replacement + path[len(prefix):]
+                break
+        self._cache[path] = result
+        return result
+
+
+def get_static_path_rewriter(static_root, static_url='/static/'):
+    """
+    Get a :class:`JsbPathRewriter` that fixes the paths of the files in
+    ``static_url`` created by ``sencha create jsb``:
+
+        - All urls are prefixed by ``..`` (E.g.: ``../static/``) since they
+          are relative to the app page.
+        - Static files are collected in ``static_root``, which is not
+          necessarily named like ``static_url``. The paths are made relative
+          to ``static_root`` instead.
+
+    :param static_root: Path to ``settings.STATIC_ROOT``, relative to the current directory.
+    """
+    static_url = static_url.rstrip('/') + '/'
+    static_root = static_root.rstrip('/') + '/'
+    return JsbPathRewriter({'..' + static_url: static_root,
+                            static_url: static_root,
+                            '..': ''})
+
+
+def clean_jsb(config, rewriter, unixstyle_outdir):
+    """
+    Validate the JSB config (see :func:`validate_jsb`), rewrite the paths in
+    the "All Classes" section with ``rewriter``, and make the files in the
+    ``app-all.js`` section relative to ``unixstyle_outdir``. The config is
+    changed in place.
+
+    :param rewriter: A :class:`JsbPathRewriter`.
+    :param unixstyle_outdir: Unix-style path to the output directory, with a trailing ``/``.
+    :return: ``config``.
+    """
+    validate_jsb(config)
+    rewrite = rewriter.rewrite
+    for fileinfo in config['builds'][0]['files']:
+        fileinfo['path'] = rewrite(fileinfo['path'])
+    for fileinfo in config['builds'][1]['files']:
+        fileinfo['path'] = unixstyle_outdir
+    return config
+
+
+def relocate_jsb(config, outdir, builddir):
+    """
+    Make the JSB config build into ``builddir`` instead of ``outdir`` (see
+    :class:`djangosenchatools.atomic.BuildDirectory`). The paths of all
+    files are made absolute, so they do not depend on the location of the
+    JSB config, and files that are the target of a build (E.g.:
+    ``all-classes.js`` in ``app-all.js``) are read from ``builddir``.
+
+    :return: A changed copy of ``config``.
+    """
+    config = deepcopy(config)
+    targets = set(abspath(join(outdir, build['target'])) for build in config['builds'])
+    builddir = abspath(builddir).replace(sep, '/') + '/'
+    for build in config['builds']:
+        for fileinfo in build['files']:
+            if abspath(fileinfo['path'] + fileinfo['name']) in targets:
+                fileinfo['path'] = builddir
+            else:
+                fileinfo['path'] = abspath(fileinfo['path'] or '.').replace(sep, '/') + '/'
+    return config
+
+
+def _encode(value):
+    if isinstance(value, basestring):
+        return encode_basestring_ascii(value)
+    return json.dumps(value)
+
+
+_object_templates = {}
+
+def _encode_object(obj):
+    # The files in a JSB config have the same keys, so we cache a template
+    # with the encoded keys for each set of keys.
+    keys = tuple(sorted(obj))
+    template = _object_templates.get(keys)
+    if template is None:
+        template = '{' + ', '.join(encode_basestring_ascii(key).replace('%', '%%') + ': %s'
+                                   for key in keys) + '}'
+        _object_templates[keys] = template
+    return template % tuple([_encode(obj[key]) for key in keys])
+
+
+def iter_jsb_chunks(config):
+    """
+    Iterate over the JSON-encoded JSB config in chunks, with one file per
+    line, so configs with thousands of files can be written without
+    creating the entire document in memory.
+    """
+    yield '{\n'
+    keys = sorted(config)
+    for keyindex, key in enumerate(keys):
+        yield '    ' + encode_basestring_ascii(key) + ': '
+        if key == 'builds':
+            yield '[\n'
+            for buildindex, build in enumerate(config['builds']):
+                yield '        {\n'
+                buildkeys = sorted(build)
+                for buildkeyindex, buildkey in enumerate(buildkeys):
+                    yield '            ' + encode_basestring_ascii(buildkey) + ': '
+                    if buildkey == 'files':
+                        files = build['files']
+                        yield '[\n'
+                        for fileindex, fileinfo in enumerate(files):
+                            yield ('                ' + _encode_object(fileinfo) +
+                                   (',\n' if fileindex < len(files) - 1 else '\n'))
+                        yield '            ]'
+                    else:
+                        yield _encode(build[buildkey])
+                    yield ',\n' if buildkeyindex < len(buildkeys) - 1 else '\n'
+                yield '        }'
+                yield ',\n' if buildindex < len(config['builds']) - 1 else '\n'
+            yield '    ]'
+        else:
+            yield _encode(config[key])
+        yield ',\n' if keyindex < len(keys) - 1 else '\n'
+    yield '}\n'
+
+
+def dump_jsb(config, fileobj):
+    """
+    Write the JSB config to ``fileobj``. See :func:`iter_jsb_chunks`.
+    """
+    for chunk in iter_jsb_chunks(config):
+        fileobj.write(chunk)
+
+
+def dumps_jsb(config):
+    """
+    Get the JSB config as a string. See :func:`iter_jsb_chunks`.
+    """
+    return ''.join(iter_jsb_chunks(config))
+
+
+def load_jsb(fileobj):
+    """
+    Load a JSB config from ``fileobj``.
+
+    :raise JsbFormatError: If the file does not contain valid JSON.
+    """
+    try:
+        return json.load(fileobj)
+    except ValueError, e:
+        raise JsbFormatError('Invalid JSB config: {0}'.format(e))
@@ -0,0 +1,141 @@
+import logging
+import json
+import re
+from hashlib import sha1
+from os import makedirs, getcwd
+from os.path import join, isdir, isfile, abspath, relpath
+
+from djangosenchatools.buildcache import iter_app_sources
+from djangosenchatools.atomic import write_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+_CALL_RE = re.compile(r'''\bExt\.(define|require|application)\s*\(\s*(\[[^\]]*\]|(['"])[^'"]*\3)?''')
+_PROPERTY_RE = re.compile(r'''\b(extend|requires|uses|mixins|controllers|models|views|stores)\s*:\s*(\[[^\]]*\]|\{[^}]*\}|(['"])[^'"]*\3)''')
+_STRING_RE = re.compile(r'''(['"])([^'"]*)\1''')
+
+
+def extract_declarations(source):
+    """
+    Extract the declarations that affect the class dependency graph from
+    the given javascript source code. That is, the name of the classes
+    defined with ``Ext.define``, classes loaded with ``Ext.require``,
+    and the ``extend``, ``requires``, ``uses``, ``mixins``,
+    ``controllers``, ``models``, ``views`` and ``stores`` properties.
+
+    This is a regex-based approximation, so changes to comments may be
+    detected as changes to the declarations. That only means that we run
+    ``sencha create jsb`` when it was not strictly required.
+
+    :return: List of ``(kind, names)`` tuples in the order they occur in the source.
+    """
+    declarations = []
+    for regex in (_CALL_RE, _PROPERTY_RE):
+        for match in regex.finditer(source):
+            kind, value = match.group(1), match.group(2) or ''
+            names = [name for quote, name in _STRING_RE.findall(value)]
+            declarations.append((kind, names))
+    return declarations
+
+
+def get_dependency_signature(outdir, url, sources=None):
+    """
+    Get a digest of the dependency declarations in all the source files of
+    the app in ``outdir``. The digest changes when a declaration changes,
+    and when a source file is added or removed, but not when anything else
+    in the sources change.
+
+    :param url: The url of the app. Included in the digest since the JSB depends on it.
+    :param sources: The app sources. Defaults to :func:`djangosenchatools.buildcache.iter_app_sources`.
+    """
+    checksum = sha1()
+    checksum.update(url)
+    if sources is None:
+        sources = iter_app_sources(outdir)
+    for path in sources:
+        if not isfile(path):
+            continue
+        source = open(path, 'rb').read()
+        checksum.update('\0')
+        checksum.update(relpath(path, outdir))
+        checksum.update('\0')
+        checksum.update(json.dumps(extract_declarations(source)))
+    return checksum.hexdigest()
+
+
+def get_jsb_signature(jsb):
+    """
+    Get a digest of the dependency declarations in the files in the
+    ``builds[0]`` section of the JSB config (E.g.: the ExtJS framework and
+    other libraries used by the app). See :func:`get_dependency_signature`.
+
+    :param jsb: The JSB config as a string. The paths are relative to the current directory.
+    """
+    checksum = sha1()
+    for fileinfo in json.loads(jsb)['builds'][0]['files']:
+        path = fileinfo['path'] + fileinfo['name']
+        checksum.update(path.encode('utf-8'))
+        checksum.update('\0')
+        if isfile(path):
+            checksum.update(json.dumps(extract_declarations(open(path, 'rb').read())))
+        else:
+            checksum.update('<missing>')
+        checksum.update('\0')
+    return checksum.hexdigest()
+
+
+class JsbDependencyState(object):
+    """
+    Stores the last cleaned JSB config of each app together with the
+    dependency signature (see :func:`get_dependency_signature`) of the
+    sources it was created from, and the signature of the files in the JSB
+    config (see :func:`get_jsb_signature`).
+
+    The paths in the JSB config are relative to the current directory, so
+    the state is stored per app and current directory.
+    """
+    def __init__(self, statedir):
+        self.statedir = statedir
+        if not isdir(self.statedir):
+            try:
+                makedirs(self.statedir)
+            except OSError:
+                if not isdir(self.statedir):
+                    raise
+
+    def _get_statefile(self, outdir):
+        key = '{0}\0{1}'.format(abspath(outdir), getcwd())
+        return join(self.statedir, sha1(key).hexdigest() + '.json')
+
+    def get(self, outdir, signature):
+        """
+        Get the stored JSB config for the app in ``outdir``.
+
+        :return: The JSB config as a string, or ``None`` if no JSB config
+            is stored for the app, if it was created from sources with
+            another dependency signature, or if the dependency declarations
+            of the files in the JSB config changed.
+        """
+        statefile = self._get_statefile(outdir)
+        if not isfile(statefile):
+            return None
+        try:
+            state = json.load(open(statefile, 'rb'))
+        except ValueError:
+            log.warning('Ignoring invalid JSB dependency state file: %s', statefile)
+            return None
+        if state['signature'] != signature:
+            return None
+        jsb = state['jsb'].encode('utf-8')
+        if state.get('jsb_signature') != get_jsb_signature(jsb):
+            log.debug('The class dependencies of the files in the JSB config of %s changed.', outdir)
+            return None
+        return jsb
+
+    def save(self, outdir, signature, jsb):
+        statefile = self._get_statefile(outdir)
+        write_atomic(statefile, json.dumps({'outdir': abspath(outdir),
+                                            'cwd': getcwd(),
+                                            'signature': signature,
+                                            'jsb_signature': get_jsb_signature(jsb),
+                                            'jsb': jsb}))
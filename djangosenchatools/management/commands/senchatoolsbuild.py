@@ -1,52 +1,66 @@
 from urlparse import urlparse
+import sys
 import logging
-from os.path import join, dirname, isdir, relpath, abspath, sep, exists
-from os import remove
-from subprocess import call
+from os.path import join, dirname, isdir, relpath, abspath, sep, exists, expanduser
+from os import makedirs
+from subprocess import Popen, PIPE, STDOUT
 from tempfile import mkdtemp
 from shutil import rmtree
+from hashlib import sha1
 import json
+import time
 from optparse import make_option
 
 from django.core.management.base import BaseCommand, CommandError
 from django.core import management
 from django.conf import settings
-from django.utils.importlib import import_module
-from djangosenchatools.buildserver import build_with_buildserver
+from djangosenchatools.buildserver import build_with_buildserver, BuildServer, BuildServerError
+from djangosenchatools.buildserver import request_counter
+from djangosenchatools.parallel import build_apps_parallel, log_build_summary
+from djangosenchatools.buildcache import BuildCache, get_build_key, get_build_targets
+from djangosenchatools.artifacts import ArtifactCache, get_artifact_backend, get_input_key
+from djangosenchatools.jsbdeps import JsbDependencyState, get_dependency_signature
+from djangosenchatools.collect import IncrementalCollector, iter_finder_files, iter_app_files
+from djangosenchatools.concat import concatenate_from_jsb
+from djangosenchatools.bundleindex import index_native_build, get_index_filenames
+from djangosenchatools.split import split_jsb_configs, create_vendor_jsb, get_hashed_filename
+from djangosenchatools.split import get_static_path, read_manifest, write_manifest, remove_unused_chunks
+from djangosenchatools.split import MANIFEST_FILENAME, VENDOR_TARGET
+from djangosenchatools.precompress import Precompressor
+from djangosenchatools.minify import MinifyStage, MinifierError
+from djangosenchatools.discovery import AppDiscoveryIndex
+from djangosenchatools.report import BuildReport, AppReport, wait_with_rusage
+from djangosenchatools.jsb import JsbFormatError, get_static_path_rewriter, clean_jsb
+from djangosenchatools.jsb import load_jsb, dump_jsb, dumps_jsb, relocate_jsb
+from djangosenchatools.atomic import BuildDirectory, AppLock, write_atomic, copy_atomic
+from djangosenchatools.crawl import ProcessTimeout, CrawlError, get_popen_kwargs
+from djangosenchatools.crawl import crawl_with_retries, schedule_crawls
+from djangosenchatools.client import get_default_socket
 
 log = logging.getLogger('senchatoolsbuild')
 
 
 def get_appinfo(app):
-    mod = import_module(app)
-    moddir = dirname(mod.__file__)
-    if exists(mod.__file__) and isdir(moddir):
-        appname = mod.__name__.split('.')[-1]
-        outdir = join(moddir, 'static', appname)
-        appdir = join(outdir, 'app')
-        if isdir(appdir):
-            log.debug('Found ExtJS app: %s', appname)
-            return (outdir, appname)
-        else:
-            log.debug('%s is not an ExtJS app (%s does not exist).', appname, appdir)
-    raise LookupError()
+    """
+    Get information about an ExtJS app. See
+    :meth:`djangosenchatools.discovery.AppDiscoveryIndex.get_appinfo`.
+    """
+    return get_discovery_index().get_appinfo(app)
 
 def get_installed_extjs_apps():
     """
     Get all installed extjs apps.
 
-    :return: List of ``(appdir, module, appname)``.
+    :return: List of ``(outdir, appname)``.
     """
-    installed_apps = []
-    checked = set()
-    for app in settings.INSTALLED_APPS:
-        if not app.startswith('django.') and not app in checked:
-            checked.add(app)
-            try:
-                installed_apps.append(get_appinfo(app))
-            except LookupError, e:
-                pass
-    return installed_apps
+    return get_discovery_index().get_installed_extjs_apps()
+
+def get_discovery_index(cachedir=None):
+    return AppDiscoveryIndex(join(cachedir or get_cachedir(), 'discovery.json'))
+
+def get_cachedir():
+    return getattr(settings, 'DJANGOSENCHATOOLS_CACHE_DIR',
+                   join(expanduser('~'), '.cache', 'djangosenchatools'))
 
 def setup_logging(verbosity):
     if verbosity < 1:
@@ -62,16 +76,71 @@ def get_verbosity(options):
 
 
 class SenchaToolsWrapper(object):
-    def __init__(self, outdir, url):
+    def __init__(self, outdir, url, capture_output=False, report=None, crawl_timeout=None):
         """
         :param outdir: The directory where the result is placed.
         :param url: The url forwarded as the ``--app-entry`` argument to ``sencha create jsb``.
+        :param capture_output:
+            Collect the output of the ``sencha`` commands in :obj:`output`
+            instead of writing it to the terminal.
+        :param report:
+            A :class:`djangosenchatools.report.AppReport` where timings are
+            recorded. Defaults to a new AppReport.
+        :param crawl_timeout:
+            Kill ``sencha create jsb`` if it does not finish within this
+            number of seconds. No timeout if ``None``.
         """
         self.url = url
         self.outdir = outdir
         self.configpath = join(outdir, 'app.jsb3')
         self.unixstyle_outdir = relpath(outdir).replace(sep, '/') + '/' # Make sure we have a unix-style path with trailing /
         self.static_root = relpath(settings.STATIC_ROOT)
+        static_url = getattr(settings, 'STATIC_URL', None) or '/static/'
+        if not static_url.startswith('/'):
+            static_url = '/static/'
+        self.pathrewriter = get_static_path_rewriter(self.static_root, static_url)
+        self.capture_output = capture_output
+        self.output = []
+        self.returncodes = []
+        self.report = report or AppReport(outdir, url=url)
+        self.crawl_timeout = crawl_timeout
+        self.jsb_created = False # Set when app.jsb3 is written
+        self.artifact_key = None # Set by the senchatoolsbuild command when using --artifact-cache
+
+    def _call(self, cmd, timeout=None):
+        """
+        Run the given command, and record its exit status in
+        :obj:`returncodes` as a ``(cmd, returncode)`` tuple, and its timings
+        in :obj:`report`.
+
+        :param timeout:
+            Kill the command if it does not finish within this number of
+            seconds. See :class:`djangosenchatools.crawl.ProcessTimeout`.
+        :return: The exit status of the command.
+        """
+        started = time.time()
+        popen_kwargs = get_popen_kwargs(timeout)
+        if self.capture_output:
+            process = Popen(cmd, stdout=PIPE, stderr=STDOUT, **popen_kwargs)
+        else:
+            process = Popen(cmd, **popen_kwargs)
+        with ProcessTimeout(process, timeout, ' '.join(cmd)):
+            if self.capture_output:
+                self.output.append(process.stdout.read())
+                process.stdout.close()
+            returncode, rusage = wait_with_rusage(process)
+        self.returncodes.append((' '.join(cmd), returncode))
+        self.report.add_command(' '.join(cmd), returncode, time.time() - started, rusage)
+        return returncode
+
+    def _createJsbConfigFile(self, tempdir):
+        tempfile = join(tempdir, 'app.jsb3')
+        cmd = ['sencha', 'create', 'jsb', '-a', self.url, '-p', tempfile]
+        log.debug('Running: %s', ' '.join(cmd))
+        returncode = self._call(cmd, timeout=self.crawl_timeout)
+        if returncode != 0 and not exists(tempfile):
+            raise CrawlError('"{0}" failed with exit status {1}.'.format(' '.join(cmd), returncode))
+        return tempfile
 
     def createJsbConfig(self):
         """
@@ -80,89 +149,139 @@ class SenchaToolsWrapper(object):
         :return: The created jsb3 config as a string.
         """
         tempdir = mkdtemp()
-        tempfile = join(tempdir, 'app.jsb3')
-        cmd = ['sencha', 'create', 'jsb', '-a', self.url, '-p', tempfile]
-        log.debug('Running: %s', ' '.join(cmd))
-        call(cmd)
-        jsb3 = open(tempfile).read()
-        rmtree(tempdir)
-        return jsb3
+        try:
+            return open(self._createJsbConfigFile(tempdir), 'rb').read()
+        finally:
+            rmtree(tempdir)
+
+    def _createCleanJsbConfigObject(self):
+        tempdir = mkdtemp()
+        try:
+            with self.report.phase('crawl'):
+                tempfile = self._createJsbConfigFile(tempdir)
+            with self.report.phase('clean'):
+                with open(tempfile, 'rb') as f:
+                    config = self._cleanJsbConfigObject(load_jsb(f))
+                log.debug('Cleaned the JSB config created by sencha (%s files).',
+                          len(config['builds'][0]['files']))
+                return config
+        finally:
+            rmtree(tempdir)
+
+    def _cleanJsbConfigObject(self, config):
+        return clean_jsb(config, self.pathrewriter, self.unixstyle_outdir)
 
     def cleanJsbConfig(self, jsbconfig):
         """
-        Clean up the JSB config.
+        Clean up the JSB config. See :func:`djangosenchatools.jsb.clean_jsb`.
+
+        :raise djangosenchatools.jsb.JsbFormatError: If the JSB config has an unexpected format.
         """
-        config = json.loads(jsbconfig)
-        self._cleanJsbAllClassesSection(config)
-        self._cleanJsbAppAllSection(config)
-        return json.dumps(config, indent=4)
+        try:
+            config = json.loads(jsbconfig)
+        except ValueError, e:
+            raise JsbFormatError('Invalid JSB config: {0}'.format(e))
+        return dumps_jsb(self._cleanJsbConfigObject(config))
 
     def createCleanJsbConfig(self):
         """
         Run :meth:`createJsbConfig`, clean up the JSB with
         :meth:`cleanJsbConfig` and return the result.
         """
-        jsb = self.createJsbConfig()
-        log.debug('sencha generated JSB config: %s', jsb)
-        jsb = self.cleanJsbConfig(jsb)
-        log.debug('cleaned JSB config: %s', jsb)
-        return jsb
+        return dumps_jsb(self._createCleanJsbConfigObject())
 
     def createAndWriteCleanJsbConfig(self):
-        jsb = self.createCleanJsbConfig()
-        open(self.configpath, 'wb').write(jsb)
-        return jsb
+        """
+        Like :meth:`createCleanJsbConfig`, but the result is written
+        directly to :obj:`configpath` instead of being returned.
+        """
+        config = self._createCleanJsbConfigObject()
+        with self.report.phase('clean'):
+            write_atomic(self.configpath, lambda f: dump_jsb(config, f))
+        self.jsb_created = True
+
+    def writeJsbConfig(self, jsb):
+        write_atomic(self.configpath, jsb)
+        self.jsb_created = True
 
     def readJsbConfig(self):
         return open(self.configpath, 'rb').read()
 
-    def _cleanJsbAllClassesSection(self, config):
+    def _buildAndPublish(self, jsb, build):
         """
-        Fixes two issues with the sencha created JSB:
+        Call ``build(builddir)`` to build the targets of the JSB config in a
+        private :class:`djangosenchatools.atomic.BuildDirectory`, and
+        publish the targets and their indexes to :obj:`outdir` if it
+        returns ``0``. Readers never see partially written targets, and a
+        failed build leaves the targets of the previous build in place.
 
-            - All extjs urls are prefixed by ``../static`` instead of
-              ``/static`` (no idea why).
-            - We assume static files are served at ``/static``, but collectstatic may
-              not build files in ``static/``. Therefore, we replace ``/static`` with
-              the relative path to ``settings.STATIC_ROOT``.
+        :return: The return value of ``build``.
         """
-        allclasses = config['builds'][0]
-        for fileinfo in allclasses['files']:
-            path = fileinfo['path']
-            if path.startswith('..'):
-                path = path[2:]
-            path = path.replace('/static', self.static_root)
-            fileinfo['path'] = path
-
-    def _cleanJsbAppAllSection(self, config):
-        appall = config['builds'][1]
-        #del appall['files'][1]
-        for file in appall['files']:
-            file['path'] = self.unixstyle_outdir
-
-        # Make sure the output files are correct (and that sencha/jsbuilder have not changed their format).
-        assert(appall['files'][0]['name'] == 'all-classes.js')
-        assert(appall['files'][1]['name'] == 'app.js')
-        assert(len(appall['files']) == 2)
-        assert(appall['target'] == 'app-all.js')
+        targets = get_build_targets(jsb)
+        with BuildDirectory(self.outdir) as builddir:
+            returncode = build(builddir.path)
+            if returncode == 0:
+                builddir.publish(targets, optional_filenames=get_index_filenames(targets))
+        return returncode
 
-    def buildFromJsbString(self, jsb, nocompressjs=False):
+    def buildFromJsbString(self, jsb, nocompressjs=False, index=True):
         """
         Build from the given config file using ``sencha build``.
 
         :param jsb: The JSB config as a string.
         :param nocompressjs: Compress the javascript? If ``True``, run ``sencha build --nocompress``.
+        :param index:
+            Index the uncompressed targets. See
+            :func:`djangosenchatools.bundleindex.index_native_build`.
+        :return: The exit status of ``sencha build``.
         """
-        tempconffile = 'temp-app.jsb3'
-        cmd = ['sencha', 'build', '-p', tempconffile, '-d', self.outdir]
-        if nocompressjs:
-            cmd.append('--nocompress')
-        open(tempconffile, 'w').write(jsb)
-        log.info('Running: %s', ' '.join(cmd))
-        try:
-            call(cmd)
-        finally:
-            remove(tempconffile)
+        config = json.loads(jsb)
+        def build(builddir):
+            # The JSB config is written to the private build directory with
+            # absolute paths, so concurrent builds never share a temp file.
+            configpath = join(builddir, 'app.jsb3')
+            with open(configpath, 'wb') as f:
+                dump_jsb(relocate_jsb(config, self.outdir, builddir), f)
+            cmd = ['sencha', 'build', '-p', configpath, '-d', builddir]
+            if nocompressjs:
+                cmd.append('--nocompress')
+            log.info('Running: %s', ' '.join(cmd))
+            returncode = self._call(cmd)
+            if index and returncode == 0:
+                index_native_build(config, self.outdir, compressed=not nocompressjs,
+                                   builddir=builddir)
+            return returncode
+        return self._buildAndPublish(jsb, build)
+
+    def concatenateFromJsbString(self, jsb, index=True):
+        """
+        Build from the given config file without compression, like
+        ``sencha build --nocompress``, but without running ``sencha``.
+        See :func:`djangosenchatools.concat.concatenate_from_jsb`.
+
+        :param jsb: The JSB config as a string.
+        :return: ``0``, for compatibility with :meth:`buildFromJsbString`.
+        """
+        log.info('Concatenating the files in the JSB config into %s', self.outdir)
+        def build(builddir):
+            concatenate_from_jsb(jsb, self.outdir, index=index, builddir=builddir)
+            return 0
+        return self._buildAndPublish(jsb, build)
+
+    def minifyFromJsbString(self, jsb, minifystage, index=True):
+        """
+        Build from the given config file using a
+        :class:`djangosenchatools.minify.MinifyStage` instead of running
+        ``sencha build``.
+
+        :param jsb: The JSB config as a string.
+        :return: ``0``, for compatibility with :meth:`buildFromJsbString`.
+        """
+        log.info('Minifying and concatenating the files in the JSB config into %s', self.outdir)
+        def build(builddir):
+            minifystage.build(jsb, self.outdir, index=index, builddir=builddir)
+            return 0
+        return self._buildAndPublish(jsb, build)
 
     def configureAndBuild(self, nocompressjs=False):
         """
@@ -180,11 +299,43 @@ class Command(BaseCommand):
             dest='collectstatic',
             default=True,
             help='Do not run collectstatic before building.'),
+        make_option('--incremental-collectstatic',
+            action='store_true',
+            dest='incremental_collectstatic',
+            default=False,
+            help=('Instead of running collectstatic, only copy the static files '
+                  'that changed since the last time they were collected by '
+                  'senchatoolsbuild. Changes are detected using a manifest in '
+                  'the cache directory (see --cachedir). Only supported with '
+                  'the default STATICFILES_STORAGE.')),
+        make_option('--collectstatic-link',
+            action='store_true',
+            dest='collectstatic_link',
+            default=False,
+            help=('Create symlinks instead of copying files with '
+                  '--incremental-collectstatic. Just like '
+                  '"collectstatic --link".')),
         make_option('--dont-use-buildserver',
             action='store_false',
             dest='use_buildserver',
             default=True,
             help='We normally start a Django server in a thread while building the app(s). If you prefer to manually start your own server, use this option.'),
+        make_option('--persistent-buildserver',
+            action='store_true',
+            dest='persistent_buildserver',
+            default=False,
+            help=('Start the buildserver once, and use it for all the builds '
+                  'instead of starting and stopping a buildserver for each app. '
+                  'With --watch, the buildserver is kept running between '
+                  'rebuilds. Note that this means that changes to your Python '
+                  'code are not reloaded by the buildserver.')),
+        make_option('--no-static-fastpath',
+            action='store_false',
+            dest='static_fastpath',
+            default=True,
+            help=('The buildserver normally serves requests for files in '
+                  'STATIC_ROOT from an in-memory cache, without going through '
+                  'Django. Use this option to let Django handle all requests.')),
         make_option('--url',
             dest='url',
             help="The URL path to your application's HTML entry point. Same as the --app-entry parameter for 'sencha create jsb', except that we only support urls."),
@@ -193,7 +344,21 @@ class Command(BaseCommand):
             help="Filesystem path to the output directory."),
         make_option('--watch',
             dest='watchdir',
-            help="Filesystem path a directory that should be watched for changes. Changes trigger a re-run of this command with the same options."),
+            help=("Filesystem path a directory that should be watched for changes. "
+                  "Changes trigger a re-run of this command with the same options, "
+                  "except that only the apps containing the changed files are "
+                  "rebuilt. collectstatic is run before each rebuild, unless "
+                  "--incremental-collectstatic is used, in which case only the "
+                  "changed files are copied to STATIC_ROOT. If files outside of "
+                  "the apps change, all apps are rebuilt.")),
+        make_option('--watch-delay',
+            type='float',
+            dest='watch_delay',
+            default=0.5,
+            help=("Number of seconds to wait for more changes before rebuilding "
+                  "in --watch mode. Changes that happen while building are "
+                  "handled by a new build when the current build is finished. "
+                  "Defaults to 0.5.")),
         make_option('--app',
             dest='app',
             help=("App to build. An alternative to using --url and --outdir. "
@@ -227,26 +392,267 @@ class Command(BaseCommand):
             dest='nocompressjs',
             default=False,
             help='Forwarded to "sencha build". See "sencha help build".'),
+        make_option('--builder',
+            dest='builder',
+            type='choice',
+            choices=['sencha', 'python'],
+            default='sencha',
+            help=('The backend used to build app-all.js from the JSB-file. '
+                  '"sencha" (the default) runs "sencha build". "python" '
+                  'concatenates the files in the JSB-file without starting '
+                  '"sencha", and requires --nocompress or --minifier.')),
+        make_option('--minifier',
+            dest='minifier',
+            default=None,
+            help=('Minify each file in the JSB-file with the given minifier, '
+                  'and concatenate the minified files into app-all.js instead '
+                  'of running "sencha build". Files are minified in parallel, '
+                  'and the result is cached, so unchanged files are only '
+                  'minified once. Built-in minifiers: uglifyjs, yuicompressor '
+                  'and jsmin. Add your own minifiers with the '
+                  'DJANGOSENCHATOOLS_MINIFIERS setting, or specify the python '
+                  'path to a djangosenchatools.minify.Minifier subclass. Can '
+                  'not be combined with --nocompress.')),
         make_option('--no-jsbcreate',
             action='store_false',
             dest='create_jsb',
             default=True,
-            help='Do not run "sencha create" to create/update the JSB-file.')
+            help='Do not run "sencha create" to create/update the JSB-file.'),
+        make_option('--jobs',
+            type='int',
+            dest='jobs',
+            default=1,
+            help=('Number of apps to build at the same time with --buildall. '
+                  'All the apps share a single buildserver, and the output and '
+                  'exit status of each app is reported when all apps are built. '
+                  'Defaults to 1.')),
+        make_option('--no-cache',
+            action='store_false',
+            dest='use_cache',
+            default=True,
+            help=('Do not use the build cache. We normally skip "sencha build" '
+                  'and reuse the previous result if the JSB-file, the app '
+                  'sources, the files in the JSB-file, --nocompress and the '
+                  'sencha version are unchanged since a previous build.')),
+        make_option('--cachedir',
+            dest='cachedir',
+            default=None,
+            help=('Directory where the build cache is stored. Defaults to '
+                  'settings.DJANGOSENCHATOOLS_CACHE_DIR, or '
+                  '"~/.cache/djangosenchatools" if the setting is not defined.')),
+        make_option('--bundle-index',
+            action='store_true',
+            dest='bundle_index',
+            default=None,
+            help=('Write the per-class index (<target>.idx) and source map '
+                  '(<target>.map) of each build target (the default). Use the '
+                  'senchatoolslocate command to find the class at a position '
+                  'in a build target using its index. Files minified by '
+                  '"sencha build" (app-all.js) can not be indexed, so this '
+                  'requires --minifier or --nocompress. Without this option, '
+                  'only the files that can be indexed get an index.')),
+        make_option('--no-bundle-index',
+            action='store_false',
+            dest='bundle_index',
+            default=None,
+            help=('Do not write the per-class index (<target>.idx) and source '
+                  'map (<target>.map) of each build target.')),
+        make_option('--split-vendor',
+            action='store_true',
+            dest='split_vendor',
+            default=False,
+            help=('Requires --buildall. Move the files shared by the apps '
+                  'into a shared vendor chunk named by its content '
+                  '(vendor-<checksum>.js), and only build the files of each '
+                  'app into its app-all.js. The chunk and a manifest.json '
+                  'listing the scripts of each app are written to '
+                  'settings.DJANGOSENCHATOOLS_VENDOR_DIR, which must be in a '
+                  '"static" directory. Use the senchatools_scripts template '
+                  'tag to load the scripts of an app.')),
+        make_option('--precompress',
+            action='store_true',
+            dest='precompress',
+            default=False,
+            help=('Write gzip (.gz) and brotli (.br, if the brotli package is '
+                  'installed) compressed versions of the built files next to '
+                  'them, for web servers that serve precompressed files. '
+                  'Files that have not changed since they were last '
+                  'compressed are skipped.')),
+        make_option('--artifact-cache',
+            dest='artifact_cache',
+            default=None,
+            help=('Share the JSB-file and the build results of each app '
+                  'through this artifact cache (E.g.: a directory on shared '
+                  'storage). Apps with the same sources as a previous build '
+                  '(on any machine using the same artifact cache) are neither '
+                  'crawled nor built, as long as all the files in the '
+                  'JSB-file are unchanged. Defaults to '
+                  'settings.DJANGOSENCHATOOLS_ARTIFACT_CACHE. Disabled by '
+                  '--no-cache.')),
+        make_option('--incremental-jsb',
+            action='store_true',
+            dest='incremental_jsb',
+            default=False,
+            help=('Only run "sencha create" when the class dependencies of the '
+                  'app may have changed. That is, when a file is added or '
+                  'removed, or when Ext.define, Ext.require, extend, requires, '
+                  'uses, mixins, controllers, models, views or stores change '
+                  'in any of the files. Otherwise, the JSB-file created by the '
+                  'last "sencha create" is reused. The state is stored in the '
+                  'cache directory (see --cachedir).')),
+        make_option('--crawl-jobs',
+            type='int',
+            dest='crawl_jobs',
+            default=1,
+            help=('Number of "sencha create jsb" crawls to run at the same '
+                  'time when building more than one app. All the apps are '
+                  'crawled against a single buildserver before any of them '
+                  'are built. Defaults to 1.')),
+        make_option('--crawl-timeout',
+            type='float',
+            dest='crawl_timeout',
+            default=None,
+            help=('Kill "sencha create jsb" if it does not finish within this '
+                  'number of seconds. Defaults to the '
+                  'DJANGOSENCHATOOLS_CRAWL_TIMEOUT setting, or no timeout if '
+                  'the setting is not defined.')),
+        make_option('--crawl-retries',
+            type='int',
+            dest='crawl_retries',
+            default=0,
+            help=('Number of times to retry "sencha create jsb" when it fails '
+                  'or times out. Defaults to 0.')),
+        make_option('--serve',
+            action='store_true',
+            dest='serve',
+            default=False,
+            help=('Run as a daemon that builds apps on request. Keeps Django, '
+                  'the buildserver and the caches alive between builds. Use '
+                  '"python -m djangosenchatools.client" to request builds. '
+                  'Builds all apps by default, or the app(s) given by --app, '
+                  '--url and --outdir, or the apps in the request.')),
+        make_option('--socket',
+            dest='socketpath',
+            default=None,
+            help=('The Unix socket where --serve listens for requests. '
+                  'Defaults to the DJANGOSENCHATOOLS_SOCKET environment '
+                  'variable, or ~/.cache/djangosenchatools/serve.sock.')),
+        make_option('--report',
+            dest='report_path',
+            default=None,
+            help=('Write the timings and statistics of the build to this '
+                  'path as JSON. A summary is always logged when the build '
+                  'is finished.'))
         )
 
     def handle(self, *args, **options):
         setup_logging(get_verbosity(options))
         self.nocompressjs = options['nocompressjs']
+        self.builder = options['builder']
+        self.minifier = options['minifier']
+        if self.minifier and self.nocompressjs:
+            raise CommandError('--minifier can not be combined with --nocompress.')
+        if self.builder == 'python' and not (self.nocompressjs or self.minifier):
+            raise CommandError('--builder=python requires --nocompress or --minifier.')
         self.urlpattern = options['urlpattern']
         self.use_buildserver = options['use_buildserver']
+        self.static_fastpath = options['static_fastpath']
         self.check_settings = options['check_settings']
         self.collectstatic = options['collectstatic']
+        self.incremental_collectstatic = options['incremental_collectstatic']
+        self.collectstatic_link = options['collectstatic_link']
+        self._collector = None
         self.app = options['app']
         self.url = options['url']
         self.outdir = options['outdir']
         self.buildall = options['buildall']
         self.watchdir = options['watchdir']
+        self.watch_delay = options['watch_delay']
         self.create_jsb = options['create_jsb']
+        self.jobs = options['jobs']
+        self.crawl_jobs = options['crawl_jobs']
+        self.crawl_timeout = options['crawl_timeout'] or getattr(settings, 'DJANGOSENCHATOOLS_CRAWL_TIMEOUT', None)
+        self.crawl_retries = options['crawl_retries']
+        self.bundle_index = options['bundle_index']
+        if not (self.nocompressjs or self.minifier):
+            if self.bundle_index:
+                raise CommandError('--bundle-index requires --minifier or --nocompress. '
+                                   'Files minified by "sencha build" can not be indexed.')
+            elif self.bundle_index is None:
+                log.info('Files minified by "sencha build" (app-all.js) are not indexed. '
+                         'Use --minifier to index them.')
+        if self.bundle_index is None:
+            self.bundle_index = True
+        self.split_vendor = options['split_vendor']
+        self._splitJsbs = {}
+        self.serve = options['serve']
+        if self.serve:
+            if self.watchdir:
+                raise CommandError('--serve can not be combined with --watch.')
+            if not (self.app or self.url or self.outdir):
+                self.buildall = True
+        if self.split_vendor:
+            if not self.buildall: # Set above by --serve without apps
+                raise CommandError('--split-vendor requires --buildall.')
+            self.vendordir = getattr(settings, 'DJANGOSENCHATOOLS_VENDOR_DIR', None)
+            if not self.vendordir:
+                raise CommandError('--split-vendor requires settings.DJANGOSENCHATOOLS_VENDOR_DIR.')
+            try:
+                self.vendor_static_path = get_static_path(self.vendordir)
+            except ValueError, e:
+                raise CommandError('Invalid DJANGOSENCHATOOLS_VENDOR_DIR: {0}'.format(e))
+        self._buildserver_running = False
+        self._buildingParallel = False
+        self.cachedir = cachedir = options['cachedir'] or get_cachedir()
+        self.discovery = get_discovery_index(cachedir)
+        if self.minifier:
+            try:
+                maxsize = getattr(settings, 'DJANGOSENCHATOOLS_MINIFY_CACHE_MAXSIZE', 200*1024*1024)
+                self.minifystage = MinifyStage(self.minifier, join(cachedir, 'minified'),
+                                               maxsize=maxsize)
+            except LookupError, e:
+                raise CommandError(str(e))
+        else:
+            self.minifystage = None
+        if options['use_cache']:
+            maxsize = getattr(settings, 'DJANGOSENCHATOOLS_CACHE_MAXSIZE', 200*1024*1024)
+            self.buildcache = BuildCache(join(cachedir, 'builds'), maxsize)
+        else:
+            self.buildcache = None
+        artifact_cache = options['artifact_cache'] or getattr(settings, 'DJANGOSENCHATOOLS_ARTIFACT_CACHE', None)
+        if options['use_cache'] and artifact_cache and self.split_vendor:
+            # The build of each app depends on the other apps
+            log.warning('The artifact cache is not used with --split-vendor.')
+            self.artifactcache = None
+        elif options['use_cache'] and artifact_cache:
+            try:
+                backend = get_artifact_backend(artifact_cache)
+            except LookupError, e:
+                raise CommandError(str(e))
+            maxsize = getattr(settings, 'DJANGOSENCHATOOLS_ARTIFACT_CACHE_MAXSIZE', 200*1024*1024)
+            self.artifactcache = ArtifactCache(backend, BuildCache(join(cachedir, 'artifacts'), maxsize),
+                                               settings.STATIC_ROOT)
+        else:
+            self.artifactcache = None
+        if options['incremental_jsb']:
+            self.jsbstate = JsbDependencyState(join(cachedir, 'jsbdeps'))
+        else:
+            self.jsbstate = None
+        if options['precompress']:
+            formats = getattr(settings, 'DJANGOSENCHATOOLS_PRECOMPRESS_FORMATS', ['gzip', 'brotli'])
+            try:
+                self.precompressor = Precompressor(join(cachedir, 'precompress.json'), formats)
+            except LookupError, e:
+                raise CommandError(str(e))
+        else:
+            self.precompressor = None
+        self.report_path = options['report_path']
+        self.report_options = dict((name, options[name]) for name in (
+            'nocompressjs', 'builder', 'minifier', 'jobs', 'use_cache', 'incremental_jsb',
+            'collectstatic', 'incremental_collectstatic', 'persistent_buildserver',
+            'static_fastpath', 'create_jsb', 'crawl_jobs', 'crawl_retries', 'artifact_cache',
+            'bundle_index', 'split_vendor', 'precompress'))
+        self.report = BuildReport(self.report_options)
         build_single = (self.url and self.outdir)
 
         if build_single:
@@ -258,36 +664,181 @@ class Command(BaseCommand):
             self._listAllApps()
             return
         if build_single or self.buildall or self.app:
-            if self.watchdir:
-                self._watch()
-            else:
-                self._run()
+            buildserver = None
+            daemon = None
+            try:
+                if self.serve:
+                    # Listen before starting the buildserver, so a running daemon is detected first
+                    daemon = self._createDaemon(options['socketpath'] or get_default_socket())
+                if self.use_buildserver and (options['persistent_buildserver'] or self.serve):
+                    buildserver = BuildServer(self.hostname, self.port,
+                                              static_fastpath=self.static_fastpath)
+                    with self.report.phase('buildserver start'):
+                        buildserver.start()
+                    self._buildserver_running = True
+                if daemon:
+                    self._serve(daemon)
+                elif self.watchdir:
+                    self._watch()
+                else:
+                    self._run()
+            except (BuildServerError, MinifierError, JsbFormatError, CrawlError), e:
+                raise CommandError(str(e))
+            finally:
+                if self.minifystage:
+                    self.minifystage.close()
+                if buildserver:
+                    buildserver.stop()
+                    self._buildserver_running = False
+                if daemon:
+                    daemon.close()
         else:
             raise CommandError('One of --listall, --buildall or --url and --outdir is required.')
 
 
-    def _run(self):
+    def _run(self, changed_apps=None, apps=None):
+        """
+        Run collectstatic and build the apps.
+
+        :param changed_apps:
+            Used by :meth:`_runChanged` to only build some of the apps. List
+            of ``((outdir, appname, url), changed_paths)`` tuples. With
+            ``--incremental-collectstatic``, the changed paths are copied to
+            ``settings.STATIC_ROOT`` instead of collecting all files.
+        :param apps:
+            Build these apps instead of the apps from :meth:`_getApps`.
+            List of ``(outdir, appname, url)``.
+        """
         if self.check_settings:
             if not getattr(settings, 'EXTJS4_DEBUG', False):
                 raise CommandError('settings.EXTJS4_DEBUG==False. Use --no-check-settings to ignore this check.')
         else:
             log.info('Skipping check for settings.EXTJS4_DEBUG.')
 
-        if self.collectstatic:
-            log.info('Running "collectstatic"')
-            management.call_command('collectstatic', verbosity=1, interactive=False)
+        try:
+            if apps is not None:
+                pass
+            elif changed_apps is None:
+                with self.report.phase('discovery'):
+                    apps = self._getApps()
+            else:
+                apps = [app for app, changed_paths in changed_apps]
+
+            if self.collectstatic:
+                with self.report.phase('collectstatic'):
+                    if not self.incremental_collectstatic:
+                        # Always run collectstatic, so STATICFILES_STORAGE
+                        # post-processing and finder precedence apply
+                        log.info('Running "collectstatic"')
+                        management.call_command('collectstatic', verbosity=1, interactive=False)
+                    elif changed_apps is None:
+                        log.info('Running incremental "collectstatic"')
+                        self._getCollector().collect(iter_finder_files())
+                    else:
+                        for (outdir, appname, url), changed_paths in changed_apps:
+                            self._copyStaticFiles(outdir, changed_paths)
+            else:
+                log.info('Skipping "collectstatic"')
+
+            self._buildApps(apps)
+        finally:
+            self._finishReport()
+
+    def _finishReport(self):
+        """
+        Log and write :obj:`report`, and start a new report for the next
+        build (when using ``--watch``).
+        """
+        self.report.finish()
+        if self.report.apps:
+            self.report.log_summary()
+        if self.report_path:
+            self.report.write(self.report_path)
+            log.info('Wrote build report to %s', self.report_path)
+        self.report = BuildReport(self.report_options)
+
+    def _runChanged(self, changed_paths):
+        """
+        Rebuild the apps containing ``changed_paths``. Used by :meth:`_watch`.
+        """
+        changed_apps = []
+        remaining_paths = set(abspath(path) for path in changed_paths)
+        static_root = abspath(settings.STATIC_ROOT) + sep
+        ignored_paths = set(path for path in remaining_paths if path.startswith(static_root))
+        if ignored_paths:
+            log.debug('Ignoring changes in STATIC_ROOT: %s', ', '.join(sorted(ignored_paths)))
+            remaining_paths -= ignored_paths
+            if not remaining_paths:
+                return
+        for app in self._getApps():
+            outdir, appname, url = app
+            if appname is None:
+                continue # Built with --url and --outdir, so we can not map files to STATIC_ROOT
+            prefix = outdir + sep
+            app_paths = set(path for path in remaining_paths if path.startswith(prefix))
+            if app_paths:
+                changed_apps.append((app, app_paths))
+                remaining_paths -= app_paths
+        if remaining_paths or not changed_apps:
+            log.info('Files outside of the apps changed. Rebuilding all apps.')
+            self._run()
         else:
-            log.info('Skipping "collectstatic"')
+            self._run(changed_apps)
+
+    def _copyStaticFiles(self, outdir, paths):
+        """
+        Copy files from the ``<appdir>/static/`` directory containing
+        ``outdir`` to ``settings.STATIC_ROOT``, just like collectstatic would
+        have done. Files that no longer exist are removed from ``STATIC_ROOT``.
+        """
+        log.info('Copying %s changed file(s) in %s to STATIC_ROOT instead of running "collectstatic"',
+                 len(paths), outdir)
+        self._getCollector().collect(iter_app_files(dirname(outdir), sorted(paths)),
+                                     remove_missing=True)
 
+    def _getCollector(self):
+        if self._collector is None:
+            storage = getattr(settings, 'STATICFILES_STORAGE',
+                              'django.contrib.staticfiles.storage.StaticFilesStorage')
+            if storage != 'django.contrib.staticfiles.storage.StaticFilesStorage':
+                raise CommandError('--incremental-collectstatic does not support '
+                                   'STATICFILES_STORAGE={0}.'.format(storage))
+            static_root = abspath(settings.STATIC_ROOT)
+            manifestpath = join(self.cachedir, 'collectstatic',
+                                sha1(static_root).hexdigest() + '.json')
+            self._collector = IncrementalCollector(manifestpath, link=self.collectstatic_link)
+        return self._collector
+
+    def _getApps(self):
+        """
+        Get the apps to build.
+
+        :return: List of ``(outdir, appname, url)``. ``appname`` is ``None``
+            when building with ``--url`` and ``--outdir``.
+        """
         if self.buildall:
-            self._buildAllApps()
+            return list(self._iterAllApps())
         elif self.app:
-            self._buildAppByName(self.app)
+            try:
+                outdir, appname = self.discovery.get_appinfo(self.app)
+            except LookupError:
+                raise CommandError('Could not find "{0}".'.format(self.app))
+            return [(outdir, appname, self._getUrl(appname))]
         else:
-            outdir = abspath(self.outdir)
-            self._buildApp(outdir, self.url)
-            log.info('Successfully built {url}. Results are in: {outdir}'.format(url=self.url,
-                                                                                 outdir=outdir))
+            return [(abspath(self.outdir), None, self.url)]
+
+    def _getAppsByName(self, appnames):
+        """
+        Get the ``(outdir, appname, url)`` of each of the given apps.
+        """
+        apps = []
+        for app in appnames:
+            try:
+                outdir, appname = self.discovery.get_appinfo(app)
+            except (LookupError, ImportError):
+                raise CommandError('Could not find "{0}".'.format(app))
+            apps.append((outdir, appname, self._getUrl(appname)))
+        return apps
 
     def _getUrl(self, appname):
         return self.urlpattern.format(appname=appname)
@@ -297,26 +848,294 @@ class Command(BaseCommand):
         return o.hostname, o.port
 
     def _iterAllApps(self):
-        for outdir, appname in get_installed_extjs_apps():
+        for outdir, appname in self.discovery.get_installed_extjs_apps():
             url = self._getUrl(appname)
             yield outdir, appname, url
 
-    def _buildAppByName(self, app):
+    def _createWrapper(self, outdir, appname, url, capture_output=False):
+        return SenchaToolsWrapper(outdir, url, capture_output=capture_output,
+                                  report=self.report.add_app(outdir, appname, url),
+                                  crawl_timeout=self.crawl_timeout)
+
+    def _clearUserCache(self):
+        """
+        Clear the users cached by :class:`djangosenchatools.auth.SettingUserBackend`
+        (if it is used), so each build looks up ``SENCHATOOLS_USER`` again.
+        Users changed by another process (E.g.: deactivated or deleted) are
+        not noticed by the cache in this process.
+        """
+        auth = sys.modules.get('djangosenchatools.auth')
+        if auth is not None:
+            auth.clear_user_cache()
+
+    def _buildApps(self, apps):
+        self._clearUserCache()
+        self._vendorManifest = None
+        self._buildAppsAndVendor(apps)
+        if self.precompressor:
+            self._precompress()
+
+    def _precompress(self):
+        """
+        Compress the targets of all the apps in :obj:`report` (the apps
+        built or restored from a cache), and the hashed vendor chunk. See
+        :class:`djangosenchatools.precompress.Precompressor`.
+        """
+        paths = []
+        for appreport in self.report.apps:
+            if self.split_vendor and appreport.outdir == self.vendordir:
+                continue # vendor.js is only used to create the hashed vendor chunk
+            for build in appreport.builds:
+                paths.append(join(appreport.outdir, build['target']))
+        if self._vendorManifest and self._vendorManifest[1]:
+            paths.append(join(self.vendordir, self._vendorManifest[1].rsplit('/', 1)[1]))
+        paths = [path for path in paths if exists(path)]
+        if paths:
+            with self.report.phase('precompress'):
+                self.precompressor.compress(paths)
+
+    def _buildAppsAndVendor(self, apps):
+        parallel = self.jobs > 1 and len(apps) > 1
+        wrappers = dict((outdir, self._createWrapper(outdir, appname, url, capture_output=parallel))
+                        for outdir, appname, url in apps)
+        if self.artifactcache:
+            apps = [app for app in apps if not self._restoreArtifacts(wrappers[app[0]])]
+        crawl_failed = []
+        # Crawl before building when building multiple apps, so an app that
+        # fails to crawl is reported and skipped instead of aborting the
+        # build of the other apps. Parallel builds report failed crawls
+        # with the other build failures.
+        if self.create_jsb and (self.split_vendor or
+                                len(apps) > 1 and (self.crawl_jobs > 1 or not parallel)):
+            crawl_failed = self._crawlApps(apps, wrappers)
+            failed_outdirs = set(result.outdir for result in crawl_failed)
+            apps = [app for app in apps if not app[0] in failed_outdirs]
+        if self.split_vendor:
+            apps = self._splitVendor(apps, wrappers, parallel)
+        self._builtApps = set()
         try:
-            outdir, appname = get_appinfo(app)
-        except LookupError:
-            raise CommandError('Could not find "{0}".'.format(app))
+            if parallel:
+                self._buildAppsParallel(apps, wrappers)
+            else:
+                for outdir, appname, url in apps:
+                    if appname:
+                        log.info('Building {appname} ({url}).'.format(**vars()))
+                    self._buildApp(outdir, url, wrappers[outdir])
+                    if not [returncode for cmd, returncode in wrappers[outdir].returncodes if returncode != 0]:
+                        self._builtApps.add(outdir)
+                    if appname:
+                        log.info('Successfully built {appname} ({url}). Results are in: {outdir}'.format(**vars()))
+                    else:
+                        log.info('Successfully built {url}. Results are in: {outdir}'.format(**vars()))
+        finally:
+            if self._vendorManifest:
+                # Also when some of the apps failed, so the apps that were
+                # built load the vendor chunk they were built for
+                self._writeVendorManifest()
+        if crawl_failed:
+            raise CommandError('{0} apps failed to crawl: {1}'.format(
+                len(crawl_failed), ', '.join(result.appname or result.url for result in crawl_failed)))
+
+    def _splitVendor(self, apps, wrappers, capture_output):
+        """
+        Build the files shared by the apps into the vendor chunk, and set up
+        :obj:`_splitJsbs` so only the files of each app are built into its
+        ``app-all.js``. See :mod:`djangosenchatools.split`.
+
+        :param apps: The apps to build. Their JSB-files must be created.
+        :return: The apps to build. All the apps with a JSB-file are built
+            if the files in the vendor chunk changed.
+        """
+        configs = {}
+        allapps = [app for app in self._getApps() if exists(join(app[0], 'app.jsb3'))]
+        for outdir, appname, url in allapps:
+            with open(join(outdir, 'app.jsb3'), 'rb') as f:
+                configs[outdir] = load_jsb(f)
+        min_apps = getattr(settings, 'DJANGOSENCHATOOLS_VENDOR_MIN_APPS', 2)
+        vendorfiles, appconfigs = split_jsb_configs(configs, min_apps)
+        vendorpaths = [fileinfo['path'] + fileinfo['name'] for fileinfo in vendorfiles]
+        log.info('%s files are shared by at least %s of %s apps.',
+                 len(vendorfiles), min_apps, len(configs))
+
+        manifestpath = join(self.vendordir, MANIFEST_FILENAME)
+        previous = read_manifest(manifestpath)
+        building = set(outdir for outdir, appname, url in apps)
+        if (previous is None or previous['files'] != vendorpaths) and len(building) < len(allapps):
+            log.info('The files shared by the apps changed. Building all the apps.')
+            for outdir, appname, url in allapps:
+                if not outdir in wrappers:
+                    wrappers[outdir] = self._createWrapper(outdir, appname, url,
+                                                           capture_output=capture_output)
+            apps = allapps
+
+        vendor = None
+        if vendorfiles:
+            if not isdir(self.vendordir):
+                makedirs(self.vendordir)
+            sencha = SenchaToolsWrapper(self.vendordir, None,
+                                        report=self.report.add_app(self.vendordir, 'vendor', None))
+            sencha.writeJsbConfig(dumps_jsb(create_vendor_jsb(vendorfiles)))
+            log.info('Building the shared files into %s.', self.vendordir)
+            self._buildApp(self.vendordir, None, sencha)
+            if sencha.returncodes and sencha.returncodes[-1][1] != 0:
+                raise CommandError('Failed to build the vendor chunk in {0}.'.format(self.vendordir))
+            vendorpath = join(self.vendordir, VENDOR_TARGET)
+            hashed = get_hashed_filename(vendorpath)
+            for suffix in ('', '.idx', '.map'):
+                if exists(vendorpath + suffix):
+                    copy_atomic(vendorpath + suffix, join(self.vendordir, hashed + suffix))
+            vendor = '{0}/{1}'.format(self.vendor_static_path, hashed)
+            log.info('Built the vendor chunk %s.', vendor)
+
+        appscripts = {}
+        self._splitJsbs = {}
+        for outdir, appname, url in allapps:
+            config = appconfigs[outdir]
+            self._splitJsbs[outdir] = dumps_jsb(config)
+            scripts = ['{0}/app-all.js'.format(get_static_path(outdir))]
+            if vendor and len(config['builds'][0]['files']) < len(configs[outdir]['builds'][0]['files']):
+                scripts.insert(0, vendor)
+            if appname:
+                appscripts[appname] = (outdir, scripts)
+        # Written by _writeVendorManifest() when the apps are built
+        self._vendorManifest = (manifestpath, vendor, vendorpaths, appscripts, previous)
+        return apps
+
+    def _writeVendorManifest(self):
+        """
+        Write the manifest of the split build. Apps that were not built (E.g.:
+        because they failed) keep the scripts from the previous manifest,
+        since their ``app-all.js`` was built for the previous vendor chunk.
+        Old vendor chunks are only removed when neither the new nor the
+        previous manifest uses them, so pages rendered with the previous
+        manifest can still load their vendor chunk.
+        """
+        manifestpath, vendor, vendorpaths, appscripts, previous = self._vendorManifest
+        previousapps = previous['apps'] if previous else {}
+        apps = {}
+        for appname, (outdir, scripts) in appscripts.iteritems():
+            if outdir in self._builtApps or not appname in previousapps:
+                apps[appname] = scripts
+            else:
+                log.info('%s was not built. It keeps loading its previous scripts.', appname)
+                apps[appname] = previousapps[appname]
+        write_manifest(manifestpath, vendor, vendorpaths, apps)
+        log.info('Wrote the scripts of each app to %s', manifestpath)
+        manifest = read_manifest(manifestpath)
+        for path in remove_unused_chunks(self.vendordir, filter(None, [manifest, previous])):
+            log.debug('Removed the old vendor chunk %s.', path)
+
+    def _getBuilderName(self):
+        """
+        Get a name for the builder used in the cache keys. Includes
+        ``+index`` when writing bundle indexes, since they are cached
+        along with the build results.
+        """
+        if self.minifier:
+            name = 'minifier:{0}'.format(self.minifier)
         else:
-            url = self._getUrl(appname)
-            log.info('Building {appname} ({url}).'.format(**vars()))
-            self._buildApp(outdir, url)
-            log.info('Successfully built {appname} ({url}). Results are in: {outdir}'.format(**vars()))
+            name = self.builder
+        if self.bundle_index:
+            name += '+index'
+        return name
 
-    def _buildAllApps(self):
-        for outdir, appname, url in self._iterAllApps():
-            log.info('Building {appname} ({url}).'.format(**vars()))
-            self._buildApp(outdir, url)
-            log.info('Successfully built {appname} ({url}). Results are in: {outdir}'.format(**vars()))
+    def _restoreArtifacts(self, sencha):
+        """
+        Restore the JSB-file and build results of the app from
+        :obj:`artifactcache`.
+
+        :return: ``True`` if the artifacts were restored, so the app does not have to be crawled or built.
+        """
+        with self._lockApp(sencha.outdir), sencha.report.measure():
+            with sencha.report.phase('cache'):
+                sencha.artifact_key = get_input_key(sencha.outdir, sencha.url, self.nocompressjs,
+                                                    self._getBuilderName(),
+                                                    sources=self.discovery.get_sources(sencha.outdir))
+                restored = self.artifactcache.restore(sencha.artifact_key, sencha.outdir,
+                                                      sencha.unixstyle_outdir)
+            if restored:
+                sencha.report.cached = True
+                sencha.report.add_jsb(sencha.readJsbConfig())
+                log.info('The sources of %s are unchanged since a previous build. '
+                         'Reused its JSB-file and build results from the artifact cache.',
+                         sencha.outdir)
+        return restored
+
+    def _crawlApps(self, apps, wrappers):
+        """
+        Create the JSB config of the apps with ``--crawl-jobs`` concurrent
+        crawls against a single buildserver. Apps that fail to crawl are
+        logged in a crawl summary.
+
+        :return: List of :class:`djangosenchatools.parallel.AppBuildResult` for the apps that failed.
+        """
+        def crawl(outdir, appname, url):
+            sencha = wrappers[outdir]
+            capture_output = sencha.capture_output
+            sencha.capture_output = True
+            try:
+                with sencha.report.measure():
+                    self._createJsbConfig(sencha)
+            finally:
+                sencha.capture_output = capture_output
+            return sencha
+
+        def crawler():
+            # With a single job, the requests of each crawl are counted
+            self._buildingParallel = self.crawl_jobs > 1
+            try:
+                return schedule_crawls(self.crawl_jobs, apps, crawl)
+            finally:
+                self._buildingParallel = False
+
+        if self.use_buildserver and not self._buildserver_running:
+            self._buildserver_running = True
+            try:
+                failed = build_with_buildserver(self.hostname, self.port, crawler,
+                                                static_fastpath=self.static_fastpath,
+                                                report=self.report)
+            finally:
+                self._buildserver_running = False
+        else:
+            failed = crawler()
+        for sencha in wrappers.itervalues():
+            del sencha.output[:] # Logged by schedule_crawls()
+        return failed
+
+    def _buildAppsParallel(self, apps, wrappers):
+        log.info('Building {0} apps using {1} jobs.'.format(len(apps), self.jobs))
+
+        def build(outdir, appname, url):
+            sencha = wrappers[outdir]
+            self._buildApp(outdir, url, sencha)
+            return sencha
+
+        def builder():
+            self._buildingParallel = True
+            try:
+                return build_apps_parallel(self.jobs, apps, build)
+            finally:
+                self._buildingParallel = False
+
+        if self.create_jsb and self.use_buildserver and not self._buildserver_running \
+                and not all(wrappers[outdir].jsb_created for outdir, appname, url in apps):
+            # Share a single (multithreaded) buildserver between all the jobs.
+            self._buildserver_running = True
+            try:
+                results = build_with_buildserver(self.hostname, self.port, builder,
+                                                 static_fastpath=self.static_fastpath,
+                                                 report=self.report)
+            finally:
+                self._buildserver_running = False
+        else:
+            results = builder()
+
+        self._builtApps.update(result.outdir for result in results if result.ok)
+        failed = log_build_summary(results)
+        if failed:
+            raise CommandError('{0} of {1} apps failed to build: {2}'.format(
+                len(failed), len(results),
+                ', '.join(result.appname for result in failed)))
 
     def _listAllApps(self):
         for outdir, appname, url in self._iterAllApps():
@@ -325,29 +1144,164 @@ class Command(BaseCommand):
             print '    outdir:', outdir
             print '    url:', url
 
-    def _buildApp(self, outdir, url):
-        sencha = SenchaToolsWrapper(outdir, url)
-        if self.create_jsb:
-            def builder():
-                jsb = sencha.createAndWriteCleanJsbConfig()
-            if self.use_buildserver:
-                build_with_buildserver(self.hostname, self.port, builder)
+    def _buildApp(self, outdir, url, sencha=None):
+        if sencha is None:
+            sencha = self._createWrapper(outdir, None, url)
+        with self._lockApp(outdir):
+            with sencha.report.measure():
+                self._buildAppWithWrapper(sencha)
+
+    def _lockApp(self, outdir):
+        """
+        Get a :class:`djangosenchatools.atomic.AppLock` that serializes
+        builds of the app in ``outdir`` (E.g.: ``--watch`` and a manual
+        build, or parallel CI jobs on the same checkout).
+        """
+        return AppLock(join(self.cachedir, 'locks'), outdir)
+
+    def _buildAppWithWrapper(self, sencha):
+        outdir = sencha.outdir
+        if self.create_jsb and not sencha.jsb_created:
+            self._createJsbConfig(sencha)
+        jsb = self._splitJsbs.get(outdir) or sencha.readJsbConfig()
+        sencha.report.add_jsb(jsb)
+        if self.buildcache:
+            with sencha.report.phase('cache'):
+                key = get_build_key(outdir, jsb, self.nocompressjs, self._getBuilderName(),
+                                    sources=self.discovery.get_sources(outdir))
+                targets = get_build_targets(jsb)
+                restored = self.buildcache.restore(key, outdir, targets,
+                                                   optional_filenames=get_index_filenames(targets))
+            if restored:
+                sencha.report.cached = True
+                log.info('%s and its inputs are unchanged since a previous build. '
+                         'Reused %s from the build cache.',
+                         sencha.configpath, ', '.join(targets))
+                self._storeArtifacts(sencha, jsb)
+                return
+        log.info('Building app-all.js from %s', sencha.configpath)
+        with sencha.report.phase('build'):
+            if self.minifystage:
+                returncode = sencha.minifyFromJsbString(jsb, self.minifystage, index=self.bundle_index)
+            elif self.builder == 'python':
+                returncode = sencha.concatenateFromJsbString(jsb, index=self.bundle_index)
+            else:
+                returncode = sencha.buildFromJsbString(jsb=jsb,
+                                                       nocompressjs=self.nocompressjs,
+                                                       index=self.bundle_index)
+        if self.buildcache and returncode == 0:
+            with sencha.report.phase('cache'):
+                self.buildcache.store(key, outdir, targets + [
+                    filename for filename in get_index_filenames(targets)
+                    if exists(join(outdir, filename))])
+        if returncode == 0:
+            self._storeArtifacts(sencha, jsb)
+
+    def _storeArtifacts(self, sencha, jsb):
+        if sencha.artifact_key:
+            with sencha.report.phase('cache'):
+                self.artifactcache.store(sencha.artifact_key, sencha.outdir, jsb)
+
+    def _createJsbConfig(self, sencha):
+        if self.jsbstate:
+            signature = get_dependency_signature(sencha.outdir, sencha.url,
+                                                 sources=self.discovery.get_sources(sencha.outdir))
+            jsb = self.jsbstate.get(sencha.outdir, signature)
+            if jsb is not None:
+                log.info('The class dependencies of %s are unchanged since the last '
+                         '"sencha create". Reusing its JSB config.', sencha.outdir)
+                sencha.writeJsbConfig(jsb)
+                return
+
+        def builder():
+            requests = request_counter.value
+            crawl_with_retries(sencha, SenchaToolsWrapper.createAndWriteCleanJsbConfig,
+                               self.crawl_retries)
+            if not self._buildingParallel:
+                sencha.report.buildserver_requests = request_counter.value - requests
+        if self.use_buildserver and not self._buildserver_running:
+            build_with_buildserver(self.hostname, self.port, builder,
+                                   static_fastpath=self.static_fastpath,
+                                   report=sencha.report)
+        else:
+            builder()
+        if self.jsbstate and sencha.returncodes[-1][1] == 0:
+            self.jsbstate.save(sencha.outdir, signature, sencha.readJsbConfig())
+
+    def _createDaemon(self, socketpath):
+        from djangosenchatools.daemon import BuildDaemon, BuildDaemonError
+
+        try:
+            return BuildDaemon(socketpath, self._handleServeRequest,
+                               expected_exceptions=(CommandError, BuildServerError, MinifierError,
+                                                    JsbFormatError, CrawlError))
+        except BuildDaemonError, e:
+            raise CommandError(str(e))
+
+    def _serve(self, daemon):
+        log.info('Listening for build requests on %s', daemon.socketpath)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    def _handleServeRequest(self, message):
+        """
+        Handle a build request to :meth:`_serve`.
+
+        - ``{"command": "build"}``: Build the apps given on the command line
+          (all apps by default).
+        - ``{"command": "build", "apps": ["myapp", ...]}``: Build the given apps.
+        - ``{"command": "changed", "paths": ["/path/to/file.js", ...]}``:
+          Rebuild the apps containing the changed files, just like ``--watch``.
+
+        :return: The build report as a dict.
+        """
+        # Time the request, not the time the daemon has been waiting
+        self.report = report = BuildReport(self.report_options)
+        if message['command'] == 'build':
+            appnames = message.get('apps')
+            if appnames and self.split_vendor:
+                log.info('Building all apps, since --split-vendor shares files between the apps.')
+                appnames = None
+            if appnames:
+                self._run(apps=self._getAppsByName(appnames))
             else:
-                builder()
-        jsb = sencha.readJsbConfig()
-        log.info('Building app-all.js from %s (copied to temp-app.jsb3)', sencha.configpath)
-        sencha.buildFromJsbString(jsb=jsb,
-                                  nocompressjs=self.nocompressjs)
+                self._run()
+        elif message['command'] == 'changed':
+            self._runChanged(message['paths'])
+        else:
+            raise CommandError('Invalid command: {0!r}'.format(message['command']))
+        if report is self.report:
+            # Nothing was built, so the report was not finished by _run()
+            report.finish()
+            self.report = BuildReport(self.report_options)
+        return report.as_dict()
 
     def _watch(self):
-        from djangosenchatools.watch import DjangoFileSystemEventHandler
+        from djangosenchatools.watch import (DjangoFileSystemEventHandler, DebouncedRebuilder,
+                                             WatchDirectoryFilter, PrunedWatcher)
         from watchdog.observers import Observer
         import time
 
         log.info('Listening for file events in: %s', self.watchdir)
-        event_handler = DjangoFileSystemEventHandler(self._run)
+        rebuilder = DebouncedRebuilder(self._runChanged, self.watch_delay)
+        rebuilder.start()
+        # Directories with build output and third party code are never
+        # watched, so large trees (E.g.: node_modules) do not use up the
+        # inotify watches, and writing the output does not trigger builds.
+        excluded_paths = [settings.STATIC_ROOT, self.cachedir]
+        if self.split_vendor:
+            excluded_paths.append(self.vendordir)
+        dirfilter = WatchDirectoryFilter(
+            getattr(settings, 'DJANGOSENCHATOOLS_WATCH_EXCLUDE_DIRS',
+                    ['.git', '.hg', '.svn', 'node_modules']),
+            [path for path in excluded_paths if path])
         observer = Observer()
-        observer.schedule(event_handler, self.watchdir, recursive=True)
+        event_handler = DjangoFileSystemEventHandler(rebuilder.add, dirfilter, self.watchdir)
+        watcher = PrunedWatcher(observer, event_handler, self.watchdir, dirfilter)
+        event_handler.directory_callback = watcher.add_directory
+        watcher.schedule()
         observer.start()
         try:
             while True:
@@ -355,3 +1309,4 @@ class Command(BaseCommand):
         except KeyboardInterrupt:
             observer.stop()
         observer.join()
+        rebuilder.stop()
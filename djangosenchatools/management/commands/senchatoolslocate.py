@@ -0,0 +1,71 @@
+from optparse import make_option
+from os.path import exists
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangosenchatools.bundleindex import BundleIndex, BundleIndexError
+
+
+def parse_position(position):
+    """
+    Parse a ``<line>[:<column>]`` or ``@<offset>`` position.
+
+    :return: ``(line, column, offset)``. The values not in ``position`` are ``None``.
+    :raise ValueError: If ``position`` is invalid.
+    """
+    if position.startswith('@'):
+        return None, None, int(position[1:])
+    parts = position.split(':')
+    if len(parts) > 2:
+        raise ValueError(position)
+    line = int(parts[0])
+    column = int(parts[1]) if len(parts) == 2 else None
+    return line, column, None
+
+
+class Command(BaseCommand):
+    help = ('Find the class and source file at positions in a file built by '
+            'senchatoolsbuild (E.g.: app-all.js), using the index written '
+            'next to it. Positions are <line>[:<column>], as shown in stack '
+            'traces, or @<byte offset>.')
+    args = '<target> <position> [position ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--index',
+            dest='indexpath',
+            default=None,
+            help='Path to the index. Defaults to <target>.idx.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) < 2:
+            raise CommandError('A target and at least one position is required.')
+        target, positions = args[0], args[1:]
+        indexpath = options['indexpath'] or target + '.idx'
+        if not exists(indexpath) and exists(target):
+            raise CommandError('{0} has no index. Files minified by "sencha build" are not '
+                               'indexed. Build with --minifier or --nocompress to index '
+                               'them.'.format(target))
+        try:
+            index = BundleIndex(indexpath)
+        except (IOError, BundleIndexError), e:
+            raise CommandError('Could not read the index of {0}: {1}'.format(target, e))
+        with index:
+            for position in positions:
+                try:
+                    line, column, offset = parse_position(position)
+                except ValueError:
+                    raise CommandError('Invalid position: {0}'.format(position))
+                try:
+                    if offset is None:
+                        entry, sourceline = index.find_line(line)
+                    else:
+                        entry, sourceline = index.find_offset(offset), None
+                except LookupError, e:
+                    self.stdout.write('{0}: {1}\n'.format(position, e))
+                    continue
+                location = entry.path
+                if sourceline is not None:
+                    location += ':{0}'.format(sourceline)
+                    if column is not None:
+                        location += ':{0}'.format(column)
+                self.stdout.write('{0}: {1} ({2})\n'.format(position, entry.clsname or '-', location))
@@ -0,0 +1,278 @@
+import logging
+import json
+import threading
+from hashlib import sha1
+from multiprocessing import Pool, cpu_count
+from os import makedirs, walk, stat, utime, remove
+from os.path import join, isdir, isfile, abspath, dirname
+from subprocess import Popen, PIPE
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+from djangosenchatools.concat import get_build_sourcepaths, get_compressed_builds, concatenate_from_jsb
+from djangosenchatools.atomic import write_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+class MinifierError(Exception):
+    """
+    Raised when a minifier fails to minify a file.
+    """
+
+
+class Minifier(object):
+    """
+    Base class for minifiers used by :class:`MinifyStage`.
+
+    Minifiers are created in the worker processes of the minify stage, so
+    they must have a constructor that takes no arguments.
+    """
+    def get_cache_id(self):
+        """
+        Get a string that identifies the minifier and its options. The
+        minified files are cached per cache id, so override this if the
+        output of the minifier depends on anything else than its class.
+        """
+        return '{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__)
+
+    def minify(self, source):
+        """
+        Minify the given javascript source code, and return the result.
+
+        :raise MinifierError: If the source can not be minified.
+        """
+        raise NotImplementedError()
+
+
+class CommandMinifier(Minifier):
+    """
+    Minifier that pipes the source through :obj:`command`.
+    """
+    #: The command as a list. Must read from stdin and write to stdout.
+    command = None
+
+    def get_cache_id(self):
+        return ' '.join(self.command)
+
+    def minify(self, source):
+        try:
+            process = Popen(self.command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        except OSError, e:
+            raise MinifierError('Could not run "{0}": {1}'.format(' '.join(self.command), e))
+        stdout, stderr = process.communicate(source)
+        if process.returncode != 0:
+            raise MinifierError('"{0}" failed with exit status {1}: {2}'.format(' '.join(self.command),
+                                                                             process.returncode,
+                                                                             stderr.strip()))
+        return stdout
+
+
+class UglifyJsMinifier(CommandMinifier):
+    command = ['uglifyjs', '--compress', '--mangle']
+
+
+class YuiCompressorMinifier(CommandMinifier):
+    command = ['yuicompressor', '--type', 'js']
+
+
+class JsminMinifier(Minifier):
+    """
+    Minifier using the ``jsmin`` python package (not installed by default).
+    """
+    def minify(self, source):
+        try:
+            from jsmin import jsmin
+        except ImportError:
+            raise MinifierError('The "jsmin" minifier requires the jsmin package. Install it with: pip install jsmin')
+        return jsmin(source)
+
+
+#: The built-in minifiers. Add your own with the ``DJANGOSENCHATOOLS_MINIFIERS`` setting.
+MINIFIERS = {
+    'uglifyjs': 'djangosenchatools.minify.UglifyJsMinifier',
+    'yuicompressor': 'djangosenchatools.minify.YuiCompressorMinifier',
+    'jsmin': 'djangosenchatools.minify.JsminMinifier'
+}
+
+
+def get_minifier(name):
+    """
+    Get an instance of the minifier named ``name``. ``name`` is a key in
+    :data:`MINIFIERS` or ``settings.DJANGOSENCHATOOLS_MINIFIERS``, or the
+    python path to a :class:`Minifier` subclass.
+
+    :raise LookupError: If the minifier can not be found.
+    """
+    minifiers = dict(MINIFIERS)
+    minifiers.update(getattr(settings, 'DJANGOSENCHATOOLS_MINIFIERS', {}))
+    path = minifiers.get(name, name)
+    if not '.' in path:
+        raise LookupError('Invalid minifier: {0}. Valid minifiers: {1}.'.format(
+            name, ', '.join(sorted(minifiers))))
+    modulename, classname = path.rsplit('.', 1)
+    try:
+        minifier_cls = getattr(import_module(modulename), classname)
+    except (ImportError, AttributeError), e:
+        raise LookupError('Could not load minifier {0}: {1}'.format(path, e))
+    return minifier_cls()
+
+
+def _minify_file(args):
+    """
+    Minify a single file in a :class:`MinifyStage` worker process.
+
+    :return: ``(cachepath, error)``. ``error`` is ``None`` unless the minifier failed.
+    """
+    name, sourcepath, cachepath = args
+    try:
+        minified = get_minifier(name).minify(open(sourcepath, 'rb').read())
+    except MinifierError, e:
+        return cachepath, '{0}: {1}'.format(sourcepath, e)
+    write_atomic(cachepath, minified)
+    return cachepath, None
+
+
+class MinifyStage(object):
+    """
+    Builds the targets with ``compress`` in a JSB config by minifying each
+    source file with a :class:`Minifier`, and concatenating the results.
+    Targets without ``compress`` (E.g.: the debug build, ``all-classes.js``)
+    are concatenated from the sources.
+
+    The files are minified in a pool of worker processes, and the minified
+    files are cached by the checksum of their source, so files that never
+    change (like the ExtJS framework) are only minified once. When the total
+    size of the cache exceeds ``maxsize``, the least recently used files
+    are removed.
+    """
+    def __init__(self, minifier_name, cachedir, processes=None, maxsize=200*1024*1024):
+        """
+        :param minifier_name: See :func:`get_minifier`.
+        :param cachedir: The directory where the minified files are cached.
+        :param processes: Number of worker processes. Defaults to the number of CPUs.
+        :param maxsize: The maximum size of the cache in bytes.
+        """
+        self.minifier_name = minifier_name
+        cache_id = get_minifier(minifier_name).get_cache_id()
+        self.cachedir = join(cachedir, sha1(cache_id).hexdigest())
+        self.processes = processes or cpu_count()
+        self.maxsize = maxsize
+        self._pool = None
+        self._lock = threading.Lock()
+        self._running = 0 # Builds in progress. Files are only evicted when no builds use them.
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = Pool(self.processes)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _get_cachepath(self, sourcepath):
+        checksum = sha1()
+        with open(sourcepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), ''):
+                checksum.update(chunk)
+        digest = checksum.hexdigest()
+        return join(self.cachedir, digest[:2], digest + '.js')
+
+    def _minify(self, sourcepaths):
+        """
+        Minify the given files, unless they are already in the cache.
+
+        :return: Dict mapping each source path to the path of its minified version.
+        """
+        cachepaths = {}
+        missing = []
+        for sourcepath in sourcepaths:
+            cachepath = self._get_cachepath(sourcepath)
+            cachepaths[sourcepath] = cachepath
+            if isfile(cachepath):
+                try:
+                    utime(cachepath, None) # Mark as recently used
+                except OSError:
+                    pass
+            else:
+                if not isdir(dirname(cachepath)):
+                    try:
+                        makedirs(dirname(cachepath))
+                    except OSError:
+                        if not isdir(dirname(cachepath)):
+                            raise
+                missing.append((self.minifier_name, sourcepath, cachepath))
+        log.info('Minifying %s of %s files with %s (the rest are cached).',
+                 len(missing), len(cachepaths), self.minifier_name)
+        if missing:
+            results = self._get_pool().map(_minify_file, missing, chunksize=1)
+            errors = [error for cachepath, error in results if error]
+            if errors:
+                raise MinifierError('\n'.join(errors))
+        return cachepaths
+
+    def evict(self):
+        """
+        Remove the least recently used minified files until the cache is no
+        larger than ``maxsize``.
+        """
+        files = []
+        totalsize = 0
+        for dirpath, dirnames, filenames in walk(self.cachedir):
+            for filename in filenames:
+                path = join(dirpath, filename)
+                if filename.startswith('.'):
+                    continue # Being written by write_atomic()
+                try:
+                    st = stat(path)
+                except OSError:
+                    continue # Removed by another build
+                files.append((st.st_mtime, st.st_size, path))
+                totalsize += st.st_size
+        files.sort()
+        while totalsize > self.maxsize and files:
+            mtime, size, path = files.pop(0)
+            log.debug('Evicting %s from the minify cache.', path)
+            try:
+                remove(path)
+            except OSError:
+                pass
+            totalsize -= size
+
+    def build(self, jsb, outdir, index=True, builddir=None):
+        """
+        Create all the build targets in the given JSB config in ``outdir``.
+        Files that are the target of a previous build (E.g.:
+        ``all-classes.js`` in ``app-all.js``) are included as they are in
+        builds without ``compress``, and replaced by the minified files they
+        were built from in builds with ``compress``.
+
+        :param jsb: The JSB config as a string.
+        :param index:
+            Write the index of each target. See
+            :func:`djangosenchatools.concat.concatenate_from_jsb`.
+        :param builddir: See :func:`djangosenchatools.concat.concatenate_from_jsb`.
+        :return: List with the path of each created file.
+        """
+        config = json.loads(jsb)
+        targetpaths = [abspath(join(outdir, build['target'])) for build in config['builds']]
+        sourcepaths = []
+        for build in get_compressed_builds(config, outdir):
+            for sourcepath in get_build_sourcepaths(build):
+                if abspath(sourcepath) not in targetpaths and not sourcepath in sourcepaths:
+                    sourcepaths.append(sourcepath)
+        with self._lock:
+            self._running += 1
+        try:
+            cachepaths = self._minify(sourcepaths)
+            return concatenate_from_jsb(jsb, outdir, readpaths=cachepaths, exact=False, index=index,
+                                        builddir=builddir)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if not self._running:
+                    self.evict()
@@ -0,0 +1,110 @@
+import logging
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+class AppBuildResult(object):
+    """
+    The result of building a single app with :func:`build_apps_parallel`.
+    """
+    def __init__(self, appname, outdir, url):
+        self.appname = appname
+        self.outdir = outdir
+        self.url = url
+        self.output = []
+        self.returncodes = []
+        self.error = None
+        self.duration = None
+
+    @property
+    def failed_commands(self):
+        """
+        List of ``(cmd, returncode)`` for all commands that did not exit with ``0``.
+        """
+        return [(cmd, returncode) for cmd, returncode in self.returncodes if returncode != 0]
+
+    @property
+    def ok(self):
+        return self.error is None and not self.failed_commands
+
+    def get_status(self):
+        if self.error:
+            return 'FAILED ({0})'.format(self.error.strip().splitlines()[-1])
+        failed_commands = self.failed_commands
+        if failed_commands:
+            cmd, returncode = failed_commands[0]
+            return 'FAILED (exit status {0} from "{1}")'.format(returncode, cmd)
+        return 'OK'
+
+
+def build_apps_parallel(jobs, apps, build, verb='Building'):
+    """
+    Build apps in a pool of ``jobs`` threads.
+
+    The heavy lifting is done by the ``sencha`` subprocesses, so threads are
+    sufficient to keep all the cores busy.
+
+    :param jobs: Number of apps to build at the same time.
+    :param apps: Iterable of ``(outdir, appname, url)``.
+    :param build:
+        Callable that takes ``(outdir, appname, url)`` as arguments, builds
+        the app, and returns a :class:`djangosenchatools.management.commands.senchatoolsbuild.SenchaToolsWrapper`
+        with the output and exit status of the ``sencha`` commands.
+    :param verb: Used in the log messages (E.g.: "Building app1").
+    :return: List of :class:`AppBuildResult`, in the same order as ``apps``.
+    """
+    def build_app(app):
+        outdir, appname, url = app
+        result = AppBuildResult(appname, outdir, url)
+        log.info('{verb} {appname} ({url}).'.format(verb=verb, appname=appname, url=url))
+        start = time.time()
+        try:
+            sencha = build(outdir, appname, url)
+        except Exception:
+            result.error = traceback.format_exc()
+        else:
+            result.output = sencha.output
+            result.returncodes = sencha.returncodes
+        result.duration = time.time() - start
+        log.info('Finished {verb} {appname}: {status}'.format(verb=verb.lower(), appname=appname,
+                                                              status=result.get_status()))
+        return result
+
+    pool = ThreadPool(jobs)
+    try:
+        return pool.map(build_app, list(apps), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def log_build_summary(results, title='Build summary', verb='building'):
+    """
+    Log the combined result of :func:`build_apps_parallel`. The output of
+    failed apps is logged as errors, and the output of successful apps as
+    debug messages.
+
+    :param title: The title of the summary.
+    :param verb: Used in the log messages (E.g.: "Output from building app1").
+    :return: List of the :class:`AppBuildResult` objects that failed.
+    """
+    failed = [result for result in results if not result.ok]
+    for result in results:
+        output = ''.join(result.output).strip()
+        if result.error:
+            output = '\n'.join(filter(None, [output, result.error.strip()]))
+        if output:
+            if result.ok:
+                log.debug('Output from %s %s:\n%s', verb, result.appname, output)
+            else:
+                log.error('Output from %s %s:\n%s', verb, result.appname, output)
+    log.info('%s (%s of %s apps succeeded):', title,
+             len(results) - len(failed), len(results))
+    for result in results:
+        log.info('    {appname}: {status} ({duration:.1f}s)'.format(appname=result.appname,
+                                                                    status=result.get_status(),
+                                                                    duration=result.duration))
+    return failed
@@ -0,0 +1,148 @@
+"""
+Precompressed versions of the built files (``<file>.gz``, and
+``<file>.br`` if the ``brotli`` package is installed), so web servers can
+serve them without compressing the files on each request (E.g.: nginx
+``gzip_static`` or whitenoise).
+"""
+import logging
+import json
+import gzip
+from cStringIO import StringIO
+from hashlib import sha1
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from os import remove, stat, makedirs
+from os.path import dirname, abspath, exists, isdir
+from stat import S_IMODE
+
+from djangosenchatools.atomic import write_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+def _compress_gzip(data):
+    buf = StringIO()
+    # mtime=0 makes the output only depend on the data
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _compress_brotli(data):
+    import brotli
+    return brotli.compress(data, mode=brotli.MODE_TEXT)
+
+
+#: Maps the supported formats to their file extension and compress function.
+FORMATS = {
+    'gzip': ('.gz', _compress_gzip),
+    'brotli': ('.br', _compress_brotli)
+}
+
+
+def get_available_formats(formats):
+    """
+    Get the formats in ``formats`` that can be used. ``brotli`` is only
+    available if the ``brotli`` package is installed.
+
+    :raise LookupError: If any of the formats are not in :data:`FORMATS`.
+    """
+    available = []
+    for name in formats:
+        if not name in FORMATS:
+            raise LookupError('Invalid precompress format: {0}. Valid formats: {1}.'.format(
+                name, ', '.join(sorted(FORMATS))))
+        if name == 'brotli':
+            try:
+                import brotli
+            except ImportError:
+                log.debug('Not creating .br files. Install the brotli package to enable brotli.')
+                continue
+        available.append(name)
+    return available
+
+
+def _compress_file(args):
+    """
+    Compress a single file in a :class:`Precompressor` worker thread, unless
+    its checksum is ``previous_checksum`` and all the compressed files exist.
+
+    :return: ``(path, checksum, created)``, where ``created`` is a list with
+        the path of each created file.
+    """
+    path, formats, previous_checksum = args
+    with open(path, 'rb') as f:
+        data = f.read()
+    checksum = sha1(data).hexdigest()
+    outputs = [(path + FORMATS[name][0], FORMATS[name][1]) for name in formats]
+    if checksum == previous_checksum and all(exists(outpath) for outpath, compress in outputs):
+        return path, checksum, []
+    created = []
+    sourcestat = stat(path)
+    for outpath, compress in outputs:
+        # Same permissions and mtime as the uncompressed file
+        write_atomic(outpath, compress(data), S_IMODE(sourcestat.st_mode), sourcestat.st_mtime)
+        created.append(outpath)
+    for name, (extension, compress) in FORMATS.iteritems():
+        if not name in formats and exists(path + extension):
+            remove(path + extension) # Outdated, so it must not be served
+    return path, checksum, created
+
+
+class Precompressor(object):
+    """
+    Writes compressed versions of files in parallel worker threads (the
+    compression libraries release the GIL). The checksum of each compressed
+    file is stored in ``statepath``, so unchanged files are skipped.
+    """
+    def __init__(self, statepath, formats, threads=None):
+        """
+        :param statepath: Path to the JSON file where the checksums are stored.
+        :param formats: List of names in :data:`FORMATS`. See :func:`get_available_formats`.
+        :param threads: Number of worker threads. Defaults to the number of CPUs.
+        """
+        self.statepath = statepath
+        self.formats = get_available_formats(formats)
+        self.threads = threads or cpu_count()
+
+    def _load_state(self):
+        try:
+            with open(self.statepath, 'rb') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        if not isdir(dirname(self.statepath)):
+            makedirs(dirname(self.statepath))
+        write_atomic(self.statepath, json.dumps(state))
+
+    def compress(self, paths):
+        """
+        Compress the given files.
+
+        :return: List with the path of each created file.
+        """
+        state = self._load_state()
+        formats = self.formats
+        jobs = []
+        for path in paths:
+            key = abspath(path)
+            previous = state.get(key)
+            if previous and previous['formats'] != formats:
+                previous = None
+            jobs.append((path, formats, previous and previous['checksum']))
+        pool = ThreadPool(min(self.threads, len(jobs) or 1))
+        try:
+            results = pool.map(_compress_file, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        created = []
+        for path, checksum, createdpaths in results:
+            state[abspath(path)] = {'checksum': checksum, 'formats': formats}
+            created.extend(createdpaths)
+        self._save_state(state)
+        log.info('Precompressed %s of %s files (%s).', len(created) / (len(formats) or 1),
+                 len(jobs), ', '.join(formats) or 'no available formats')
+        return created
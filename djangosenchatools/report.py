@@ -0,0 +1,270 @@
+import logging
+import errno
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from os.path import dirname, isdir, isfile, getsize, abspath
+try:
+    import resource
+except ImportError:
+    resource = None # Not available on Windows
+
+from djangosenchatools import version
+from djangosenchatools.concat import get_build_sourcepaths, get_source_builds
+from djangosenchatools.buildserver import request_counter
+from djangosenchatools.atomic import write_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+
+def _maxrss_bytes(maxrss):
+    # ru_maxrss is in bytes on OSX, and in kilobytes on Linux.
+    if sys.platform == 'darwin':
+        return maxrss
+    return maxrss * 1024
+
+
+def _get_cputime(who):
+    """
+    :param who: ``"RUSAGE_SELF"`` or ``"RUSAGE_CHILDREN"``.
+    """
+    if resource is None:
+        return 0.0
+    rusage = resource.getrusage(getattr(resource, who))
+    return rusage.ru_utime + rusage.ru_stime
+
+
+def wait_with_rusage(process):
+    """
+    Wait for a ``subprocess.Popen`` process to exit, and get its resource
+    usage.
+
+    :return: ``(returncode, rusage)``. ``rusage`` is ``None`` if the
+        platform does not support ``os.wait4``.
+    """
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+    while True:
+        try:
+            pid, status, rusage = os.wait4(process.pid, 0)
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise
+        else:
+            break
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return process.returncode, rusage
+
+
+class AppReport(object):
+    """
+    Timings and statistics for building a single app. Used by a single
+    thread, so phases can be nested.
+
+    Each phase records its wall time and the CPU time of the subprocesses
+    (``sencha``) that ran during the phase.
+    """
+    def __init__(self, outdir, appname=None, url=None):
+        self.outdir = outdir
+        self.appname = appname
+        self.url = url
+        self.duration = None
+        self.phases = {}
+        self.commands = []
+        self.builds = []
+        self.cached = False
+        #: Number of requests handled by the buildserver while crawling the
+        #: app. ``None`` if other apps were crawled at the same time (with
+        #: ``--crawl-jobs`` or ``--jobs``), since the requests of concurrent
+        #: crawls can not be told apart. See :obj:`BuildReport.buildserver_requests`
+        #: for the total.
+        self.buildserver_requests = None
+        self._open_phases = []
+
+    @contextmanager
+    def phase(self, name):
+        record = self.phases.setdefault(name, {'count': 0, 'wall': 0.0, 'child_cpu': 0.0})
+        self._open_phases.append(record)
+        started = time.time()
+        try:
+            yield
+        finally:
+            record['count'] += 1
+            record['wall'] += time.time() - started
+            self._open_phases.pop()
+
+    @contextmanager
+    def measure(self):
+        """
+        Add the time spent in the block to :obj:`duration`.
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.duration = (self.duration or 0.0) + time.time() - started
+
+    def add_command(self, cmd, returncode, wall, rusage):
+        """
+        Record a subprocess, and add its CPU time to the open phases.
+
+        :param rusage: See :func:`wait_with_rusage`.
+        """
+        command = {'cmd': cmd, 'returncode': returncode, 'wall': wall,
+                   'child_cpu': None, 'maxrss': None}
+        if rusage is not None:
+            command['child_cpu'] = cputime = rusage.ru_utime + rusage.ru_stime
+            command['maxrss'] = _maxrss_bytes(rusage.ru_maxrss)
+            for record in self._open_phases:
+                record['child_cpu'] += cputime
+        self.commands.append(command)
+
+    def add_jsb(self, jsb):
+        """
+        Record the number of source files and bytes in each build in the JSB
+        config. Targets of previous builds (E.g.: ``all-classes.js`` in
+        ``app-all.js``) are counted as the sources they are built from, so
+        the result does not depend on the output of previous builds.
+        """
+        self.builds = []
+        for build in get_source_builds(json.loads(jsb), self.outdir):
+            sourcepaths = get_build_sourcepaths(build)
+            self.builds.append({'target': build['target'],
+                                'files': len(sourcepaths),
+                                'bytes': sum(getsize(path) for path in sourcepaths if isfile(path))})
+
+    @property
+    def child_cpu(self):
+        return sum(command['child_cpu'] or 0.0 for command in self.commands)
+
+    @property
+    def maxrss(self):
+        return max([command['maxrss'] or 0 for command in self.commands] or [0])
+
+    @property
+    def ok(self):
+        return all(command['returncode'] == 0 for command in self.commands
+                   if not command.get('retried'))
+
+    def as_dict(self):
+        return {'appname': self.appname,
+                'outdir': self.outdir,
+                'url': self.url,
+                'ok': self.ok,
+                'cached': self.cached,
+                'duration': self.duration,
+                'phases': self.phases,
+                'child_cpu': self.child_cpu,
+                'child_maxrss': self.maxrss,
+                'buildserver_requests': self.buildserver_requests,
+                'builds': self.builds,
+                'commands': self.commands}
+
+
+class BuildReport(object):
+    """
+    Timings and statistics for a single run of ``senchatoolsbuild``.
+
+    Phases that are not specific to an app (collectstatic, starting the
+    buildserver, ...) record their wall time, the CPU time of this process
+    and the CPU time of finished subprocesses.
+    """
+    def __init__(self, options=None):
+        """
+        :param options: Dict with the options to include in the report.
+        """
+        self.options = options or {}
+        self.started = time.time()
+        self.duration = None
+        self.phases = {}
+        self.apps = []
+        self.buildserver_requests = None
+        self._request_counter = request_counter
+        self._requests_at_start = request_counter.value
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        with self._lock:
+            record = self.phases.setdefault(name, {'count': 0, 'wall': 0.0,
+                                                   'cpu': 0.0, 'child_cpu': 0.0})
+        started = time.time()
+        cpu = _get_cputime('RUSAGE_SELF')
+        child_cpu = _get_cputime('RUSAGE_CHILDREN')
+        try:
+            yield
+        finally:
+            with self._lock:
+                record['count'] += 1
+                record['wall'] += time.time() - started
+                record['cpu'] += _get_cputime('RUSAGE_SELF') - cpu
+                record['child_cpu'] += _get_cputime('RUSAGE_CHILDREN') - child_cpu
+
+    def add_app(self, outdir, appname=None, url=None):
+        """
+        Add an :class:`AppReport` to the report.
+        """
+        appreport = AppReport(outdir, appname, url)
+        with self._lock:
+            self.apps.append(appreport)
+        return appreport
+
+    def finish(self):
+        self.duration = time.time() - self.started
+        self.buildserver_requests = self._request_counter.value - self._requests_at_start
+
+    def as_dict(self):
+        if resource is None:
+            maxrss = None
+            child_maxrss = None
+        else:
+            maxrss = _maxrss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+            child_maxrss = _maxrss_bytes(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        return {'version': version,
+                'started': self.started,
+                'duration': self.duration,
+                'options': self.options,
+                'phases': self.phases,
+                'maxrss': maxrss,
+                'child_maxrss': child_maxrss,
+                'buildserver_requests': self.buildserver_requests,
+                'apps': [appreport.as_dict() for appreport in self.apps]}
+
+    def write(self, path):
+        """
+        Write the report to ``path`` as JSON.
+        """
+        path = abspath(path)
+        if not isdir(dirname(path)):
+            os.makedirs(dirname(path))
+        write_atomic(path, json.dumps(self.as_dict(), indent=2, sort_keys=True))
+
+    def log_summary(self):
+        """
+        Log a table with the timings of each app and phase.
+        """
+        phasenames = ['crawl', 'clean', 'cache', 'build']
+        log.info('Build timings (%.2fs in total, %s buildserver requests):',
+                 self.duration, self.buildserver_requests)
+        header = '    {0:<20} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8} {6:>8} {7:>9} {8:>6} {9:>11} {10:>8}'
+        log.info(header.format('app', 'total', *(phasenames + ['cpu', 'peak rss', 'files', 'bytes', 'requests'])))
+        row = '    {0:<20} {1:>7.2f}s {2:>7.2f}s {3:>7.2f}s {4:>7.2f}s {5:>7.2f}s {6:>7.2f}s {7:>8.1f}M {8:>6} {9:>11} {10:>8}'
+        for appreport in self.apps:
+            phases = [appreport.phases.get(name, {}).get('wall', 0.0) for name in phasenames]
+            requests = appreport.buildserver_requests
+            log.info(row.format(appreport.appname or appreport.url,
+                                appreport.duration or 0.0,
+                                *(phases + [appreport.child_cpu,
+                                            appreport.maxrss / (1024.0*1024.0),
+                                            sum(build['files'] for build in appreport.builds),
+                                            sum(build['bytes'] for build in appreport.builds),
+                                            '-' if requests is None else requests])))
+        for name, record in sorted(self.phases.items()):
+            log.info('    %s: %.2fs (cpu: %.2fs, subprocess cpu: %.2fs)',
+                     name, record['wall'], record['cpu'], record['child_cpu'])
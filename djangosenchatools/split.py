@@ -0,0 +1,230 @@
+"""
+Splitting the classes shared by many apps into a shared vendor chunk.
+
+The "All Classes" section of the JSB config of each app lists the classes
+of the app in dependency order. Files listed by at least ``min_apps``
+apps are moved into a vendor chunk, ordered by merging the order of the
+files in each app (see :func:`merge_orders`). The dependencies of a shared
+file are shared as well (every app that includes a file includes its
+dependencies), so the vendor chunk only depends on itself, and must be
+loaded before the ``app-all.js`` of the apps.
+
+The vendor chunk is named by its content (``vendor-<checksum>.js``), so it
+can be cached by browsers for a long time, and a manifest maps each app to
+the scripts it must load (see :func:`write_manifest`).
+"""
+import logging
+import json
+import heapq
+import re
+from copy import deepcopy
+from hashlib import sha1
+from os import listdir, remove
+from os.path import abspath, sep, isfile, getmtime, join
+
+from djangosenchatools.atomic import write_atomic
+
+log = logging.getLogger('senchatoolsbuild')
+
+#: Name of the manifest in the vendor directory.
+MANIFEST_FILENAME = 'manifest.json'
+
+#: The target of the vendor JSB config, before it is renamed by its checksum.
+VENDOR_TARGET = 'vendor.js'
+
+_HASHED_RE = re.compile(r'^(vendor-[0-9a-f]{12}\.js)(\.idx|\.map|\.gz|\.br)?$')
+
+
+def _get_path(fileinfo):
+    return fileinfo['path'] + fileinfo['name']
+
+
+def merge_orders(orders):
+    """
+    Merge lists of items into a single list where each item comes after the
+    items it follows in any of the lists. If the lists conflict, the item
+    seen first is placed first.
+
+    >>> merge_orders([['a', 'b', 'd'], ['a', 'c', 'd']])
+    ['a', 'b', 'c', 'd']
+    """
+    rank = {}
+    successors = {}
+    indegree = {}
+    for order in orders:
+        for item in order:
+            if not item in rank:
+                rank[item] = len(rank)
+                successors[item] = set()
+                indegree[item] = 0
+        for item, successor in zip(order, order[1:]):
+            if not successor in successors[item]:
+                successors[item].add(successor)
+                indegree[successor] += 1
+    ready = [(rank[item], item) for item in rank if indegree[item] == 0]
+    heapq.heapify(ready)
+    result = []
+    done = set()
+    while len(result) < len(rank):
+        if not ready:
+            # The orders conflict (E.g.: [a, b] and [b, a]). Break the cycle
+            # at the item seen first.
+            item = min((item for item in rank if not item in done), key=rank.get)
+            log.debug('Conflicting order of %s in the JSB configs.', item)
+            indegree[item] = 0
+            heapq.heappush(ready, (rank[item], item))
+        itemrank, item = heapq.heappop(ready)
+        if item in done:
+            continue
+        done.add(item)
+        result.append(item)
+        for successor in successors[item]:
+            indegree[successor] -= 1
+            if indegree[successor] == 0 and not successor in done:
+                heapq.heappush(ready, (rank[successor], successor))
+    return result
+
+
+def split_jsb_configs(configs, min_apps=2):
+    """
+    Split the "All Classes" section of the given JSB configs into the files
+    shared by at least ``min_apps`` apps, and the files of each app.
+
+    :param configs: Dict mapping the outdir of each app to its JSB config.
+    :return: ``(vendorfiles, appconfigs)``. ``vendorfiles`` is the list of
+        shared files in the "files" format of a JSB config.
+        ``appconfigs`` is a dict mapping the outdir of each app to a copy
+        of its JSB config without the shared files.
+    """
+    counts = {}
+    fileinfos = {}
+    for config in configs.itervalues():
+        for fileinfo in config['builds'][0]['files']:
+            path = _get_path(fileinfo)
+            counts[path] = counts.get(path, 0) + 1
+            fileinfos.setdefault(path, fileinfo)
+    shared = set(path for path, count in counts.iteritems() if count >= min_apps)
+    orders = [[_get_path(fileinfo) for fileinfo in configs[outdir]['builds'][0]['files']
+               if _get_path(fileinfo) in shared]
+              for outdir in sorted(configs)]
+    vendorfiles = [fileinfos[path] for path in merge_orders(orders)]
+    appconfigs = {}
+    for outdir, config in configs.iteritems():
+        config = deepcopy(config)
+        config['builds'][0]['files'] = [fileinfo for fileinfo in config['builds'][0]['files']
+                                        if not _get_path(fileinfo) in shared]
+        appconfigs[outdir] = config
+    return vendorfiles, appconfigs
+
+
+def create_vendor_jsb(vendorfiles):
+    """
+    Create a JSB config that builds the given files into
+    :data:`VENDOR_TARGET`.
+    """
+    return {'projectName': 'Vendor',
+            'builds': [{'name': 'Vendor',
+                        'target': VENDOR_TARGET,
+                        'compress': True,
+                        'files': vendorfiles}],
+            'resources': []}
+
+
+def get_hashed_filename(path):
+    """
+    Get the content-hashed name of the vendor chunk in ``path``
+    (``vendor-<checksum>.js``).
+    """
+    checksum = sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            checksum.update(chunk)
+    return 'vendor-{0}.js'.format(checksum.hexdigest()[:12])
+
+
+def get_static_path(directory):
+    """
+    Get the path of ``directory`` relative to the closest ``static``
+    directory containing it (the path used in ``{% static %}``).
+
+    :raise ValueError: If ``directory`` is not inside a ``static`` directory.
+    """
+    parts = abspath(directory).split(sep)
+    if not 'static' in parts[:-1]:
+        raise ValueError('{0} is not inside a "static" directory.'.format(directory))
+    index = len(parts) - 1 - parts[::-1].index('static')
+    return '/'.join(parts[index + 1:])
+
+
+def read_manifest(path):
+    """
+    Read the manifest written by :func:`write_manifest`.
+
+    :return: The manifest, or ``None`` if it does not exist.
+    """
+    if not isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return json.load(f)
+
+
+def write_manifest(path, vendor, vendorfiles, apps):
+    """
+    Write the manifest of a split build to ``path`` atomically.
+
+    :param vendor: The static path of the vendor chunk, or ``None`` if no files are shared.
+    :param vendorfiles: List with the path of each file in the vendor chunk.
+    :param apps:
+        Dict mapping the name of each app to the static paths of the scripts
+        it must load, in order.
+    """
+    manifest = {'vendor': vendor, 'files': vendorfiles, 'apps': apps}
+    write_atomic(path, json.dumps(manifest, indent=4, sort_keys=True))
+
+
+def remove_unused_chunks(directory, manifests):
+    """
+    Remove the hashed vendor chunks in ``directory`` (with their indexes,
+    source maps and precompressed files) that are not used by any of
+    ``manifests``.
+
+    :param manifests: List of manifests (see :func:`read_manifest`).
+    :return: List with the path of each removed file.
+    """
+    used = set()
+    for manifest in manifests:
+        for script in [manifest['vendor']] + sum(manifest['apps'].values(), []):
+            if script:
+                used.add(script.rsplit('/', 1)[-1])
+    removed = []
+    for filename in sorted(listdir(directory)):
+        match = _HASHED_RE.match(filename)
+        if match and not match.group(1) in used:
+            try:
+                remove(join(directory, filename))
+            except OSError:
+                continue # Removed by another build
+            removed.append(join(directory, filename))
+    return removed
+
+
+_manifest_cache = {}
+
+def get_app_scripts(manifestpath, appname):
+    """
+    Get the static path of the scripts to load for ``appname``, in order,
+    from the manifest in ``manifestpath``. The manifest is re-read when it
+    changes. Apps that are not in the manifest only load their
+    ``app-all.js``.
+    """
+    try:
+        mtime = getmtime(manifestpath)
+    except OSError:
+        mtime = None
+    cached = _manifest_cache.get(manifestpath)
+    if cached is None or cached[0] != mtime:
+        manifest = read_manifest(manifestpath) if mtime is not None else None
+        cached = (mtime, manifest or {'apps': {}})
+        _manifest_cache[manifestpath] = cached
+    apps = cached[1]['apps']
+    return apps.get(appname, ['{0}/app-all.js'.format(appname)])
@@ -0,0 +1,30 @@
+from os.path import join
+
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from djangosenchatools.split import MANIFEST_FILENAME, get_app_scripts
+
+register = template.Library()
+
+
+@register.simple_tag
+def senchatools_scripts(appname):
+    """
+    Render ``<script>`` tags for the built ``app-all.js`` of ``appname``,
+    preceded by the shared vendor chunk when the apps are built with
+    ``senchatoolsbuild --split-vendor``. Example::
+
+        {% load senchatools %}
+        {% senchatools_scripts "myapp" %}
+    """
+    vendordir = getattr(settings, 'DJANGOSENCHATOOLS_VENDOR_DIR', None)
+    if vendordir:
+        scripts = get_app_scripts(join(vendordir, MANIFEST_FILENAME), appname)
+    else:
+        scripts = ['{0}/app-all.js'.format(appname)]
+    return mark_safe('\n'.join('<script type="text/javascript" src="{0}"></script>'.format(
+        escape(staticfiles_storage.url(script))) for script in scripts))
@@ -1,42 +1,259 @@
-from fnmatch import fnmatch
+from fnmatch import translate
 import logging
+import re
+import threading
+import time
+from os import walk
+from os.path import join, abspath, dirname, basename, normcase, sep
 from django.conf import settings
 from watchdog.events import FileSystemEventHandler
 
 log = logging.getLogger('senchatoolsbuild')
 
 
+def compile_patterns(patterns):
+    """
+    Compile a list of ``fnmatch`` patterns into a single regular expression,
+    so a path is matched against all of them at once.
+
+    :return: The ``match`` method of the compiled regular expression, or
+        ``None`` if ``patterns`` is empty.
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:{0})'.format(translate(normcase(pattern)))
+                               for pattern in patterns)).match
+
+
+class WatchDirectoryFilter(object):
+    """
+    Decides which directories are not watched: directories with a name
+    matching any of ``patterns`` (E.g.: ``node_modules``), and the
+    directories in ``paths`` (E.g.: ``STATIC_ROOT``).
+    """
+    def __init__(self, patterns, paths=()):
+        self.patterns = patterns
+        self._match = compile_patterns(patterns)
+        self.paths = frozenset(normcase(abspath(path)) for path in paths)
+        self._prefixes = tuple(path + sep for path in self.paths)
+
+    def is_excluded(self, path):
+        """
+        Is the directory ``path`` excluded (not including its parent directories)?
+        """
+        path = normcase(abspath(path))
+        return path in self.paths or bool(self._match and self._match(basename(path)))
+
+    def contains(self, rootdir, path):
+        """
+        Is ``path`` in an excluded directory below ``rootdir``?
+        """
+        path = normcase(abspath(path))
+        if path.startswith(self._prefixes):
+            return True
+        if self._match:
+            relative = path[len(normcase(abspath(rootdir))) + 1:]
+            for name in relative.split(sep)[:-1]:
+                if self._match(name):
+                    return True
+        return False
+
+
+def get_watches(rootdir, dirfilter):
+    """
+    Get the watches needed to watch ``rootdir`` without watching any of the
+    directories excluded by ``dirfilter``. Directories that do not contain
+    any excluded directories are watched recursively, and the directories
+    containing them are watched non-recursively, so the excluded
+    directories are never walked by the observer.
+
+    :param dirfilter: A :class:`WatchDirectoryFilter`.
+    :return: List of ``(path, recursive)``.
+    """
+    rootdir = abspath(rootdir)
+    children = {}
+    contains_excluded = set()
+    for dirpath, dirnames, filenames in walk(rootdir):
+        included = []
+        for dirname_ in dirnames:
+            if dirfilter.is_excluded(join(dirpath, dirname_)):
+                log.debug('Not watching %s', join(dirpath, dirname_))
+                path = dirpath
+                while not path in contains_excluded:
+                    contains_excluded.add(path)
+                    if path == rootdir:
+                        break
+                    path = dirname(path)
+            else:
+                included.append(dirname_)
+        dirnames[:] = included
+        children[dirpath] = [join(dirpath, dirname_) for dirname_ in included]
+    watches = []
+    stack = [rootdir]
+    while stack:
+        path = stack.pop()
+        if path in contains_excluded:
+            watches.append((path, False))
+            stack.extend(children.get(path, []))
+        else:
+            watches.append((path, True))
+    return watches
+
+
+class PrunedWatcher(object):
+    """
+    Schedules ``handler`` on ``observer`` for ``rootdir``, without watching
+    the directories excluded by ``dirfilter`` (see :func:`get_watches`).
+    Directories created in non-recursively watched directories are
+    scheduled by :meth:`add_directory`.
+    """
+    def __init__(self, observer, handler, rootdir, dirfilter):
+        self.observer = observer
+        self.handler = handler
+        self.rootdir = abspath(rootdir)
+        self.dirfilter = dirfilter
+        self._nonrecursive = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, path=None):
+        watches = get_watches(path or self.rootdir, self.dirfilter)
+        with self._lock:
+            for watchpath, recursive in watches:
+                self.observer.schedule(self.handler, watchpath, recursive=recursive)
+                if not recursive:
+                    self._nonrecursive.add(watchpath)
+        nonrecursive = len([watch for watch in watches if not watch[1]])
+        log.debug('Watching %s directories recursively, and %s directories non-recursively, in %s.',
+                  len(watches) - nonrecursive, nonrecursive, path or self.rootdir)
+
+    def add_directory(self, path):
+        """
+        Watch a created directory unless it is excluded, or already watched
+        by a recursive watch.
+        """
+        path = abspath(path)
+        with self._lock:
+            watched = not dirname(path) in self._nonrecursive
+        if not watched and not self.dirfilter.is_excluded(path):
+            self.schedule(path)
+
 
 class DjangoFileSystemEventHandler(FileSystemEventHandler):
-    def __init__(self, callback):
+    """
+    Calls ``callback(path)`` for each changed file matching the
+    ``DJANGOSENCHATOOLS_WATCH_INCLUDE`` and ``DJANGOSENCHATOOLS_WATCH_EXCLUDE``
+    settings, unless the file is in a directory excluded by ``dirfilter``.
+    ``directory_callback(path)`` is called for each created directory.
+    """
+    def __init__(self, callback, dirfilter=None, rootdir=None, directory_callback=None):
         self.excludepatterns = getattr(settings, 'DJANGOSENCHATOOLS_WATCH_EXCLUDE',
                                       ['*.*.swp', '*~', '*.pyc', '*.pyo',
                                        '*app-all.js', '*all-classes.js'])
         self.includepatterns = getattr(settings, 'DJANGOSENCHATOOLS_WATCH_INCLUDE',
                                        ['*.js'])
+        self._include = compile_patterns(self.includepatterns)
+        self._exclude = compile_patterns(self.excludepatterns)
+        self.dirfilter = dirfilter
+        self.rootdir = rootdir
         self.callback = callback
+        self.directory_callback = directory_callback
         super(DjangoFileSystemEventHandler, self).__init__()
 
     def on_any_event(self, event):
-        callback = self.callback
-        path = event.src_path
-        event_type = event.event_type
         if event.is_directory:
-            log.debug('Ignored {event_type}-event on {path} because it is a directory'.format(**vars()))
+            if self.directory_callback and event.event_type in ('created', 'moved'):
+                self.directory_callback(getattr(event, 'dest_path', None) or event.src_path)
+            log.debug('Ignored %s-event on %s because it is a directory', event.event_type, event.src_path)
+            return
+        self._handle_path(event, event.src_path)
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            self._handle_path(event, dest_path)
+
+    def _handle_path(self, event, path):
+        normpath = normcase(path)
+        if self._include and not self._include(normpath):
+            log.debug('Ignored %s-event on %s because it does not match any of: %r',
+                      event.event_type, path, self.includepatterns)
+            return
+        if self._exclude and self._exclude(normpath):
+            if log.isEnabledFor(logging.DEBUG):
+                pattern = [pattern for pattern in self.excludepatterns
+                           if compile_patterns([pattern])(normpath)][0]
+                log.debug('Ignored %s-event on %s because of the "%s" excludepattern',
+                          event.event_type, path, pattern)
             return
-        if self.includepatterns:
-            match = False
-            for patt in self.includepatterns:
-                if fnmatch(path, patt):
-                    match = True
+        if self.dirfilter and self.dirfilter.contains(self.rootdir, path):
+            log.debug('Ignored %s-event on %s because it is in an excluded directory',
+                      event.event_type, path)
+            return
+        log.info('Change of type=%s detected in: %s', event.event_type, path)
+        self.callback(path)
+
+
+class DebouncedRebuilder(object):
+    """
+    Collects changed paths with :meth:`add`, and calls ``callback(paths)``
+    with all the collected paths when no paths have been added for
+    ``delay`` seconds.
+
+    The callback is called in a single worker thread, so paths added while
+    the callback is running are collected and handled by the next call
+    instead of starting a new build in parallel.
+    """
+    def __init__(self, callback, delay):
+        self.callback = callback
+        self.delay = delay
+        self._paths = set()
+        self._last_added = None
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def add(self, path):
+        with self._condition:
+            self._paths.add(path)
+            self._last_added = time.time()
+            self._condition.notify()
+
+    def _wait_for_paths(self):
+        """
+        Wait until paths have been added, and no paths have been added for
+        :obj:`delay` seconds.
+
+        :return: The collected paths, or ``None`` if :meth:`stop` was called.
+        """
+        with self._condition:
+            while not self._paths and not self._stopped:
+                self._condition.wait()
+            while not self._stopped:
+                remaining = self._last_added + self.delay - time.time()
+                if remaining <= 0:
                     break
-            if not match:
-                includepatterns_str = repr(self.includepatterns)
-                log.debug('Ignored {event_type}-event on {path} because it does not match any of: {includepatterns_str}'.format(**vars()))
-                return
-        for ignorepatt in self.excludepatterns:
-            if fnmatch(path, ignorepatt):
-                log.debug('Ignored {event_type}-event on {path} because of the "{ignorepatt}" excludepattern'.format(**vars()))
+                self._condition.wait(remaining)
+            if self._stopped:
+                return None
+            paths = self._paths
+            self._paths = set()
+            return paths
+
+    def _run(self):
+        while True:
+            paths = self._wait_for_paths()
+            if paths is None:
                 return
-        log.info('Change of type={0} detected in: {1}'.format(event.event_type, path))
-        callback()
+            log.debug('Handling changes to %s file(s).', len(paths))
+            try:
+                self.callback(paths)
+            except Exception:
+                log.exception('Rebuild failed. Waiting for more changes.')